@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""Compares fetching reports with and without compressed transfer
+encoding, from a local stand-in server that serves the recorded responses
+in benchmarks/fixtures.
+
+The server gzips the response when the request accepts it and counts the
+body bytes it sends. --bandwidth limits the simulated link speed, so the
+time saved on the wire can be weighed against the cost of decompressing.
+
+Usage: python benchmarks/compression_benchmark.py [-n NUMBER] [-b KB/S]
+"""
+
+import gzip
+import io
+import os
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pywapi
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# provider, fixture, function fetching a report from the stand-in server
+PROVIDERS = (
+    ('weather_com', 'weather_com_5day.xml',
+     lambda: pywapi.get_weather_from_weather_com('USNY0996')),
+    ('yahoo', 'yahoo_forecastrss.xml',
+     lambda: pywapi.get_weather_from_yahoo('USNY0996')),
+    ('noaa', 'noaa_current_obs.xml',
+     lambda: pywapi.get_weather_from_noaa('KJFK')),
+)
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    bandwidth = 0           # bytes per second, 0 for no limit
+    bytes_sent = 0
+    documents = {}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        provider = self.path.split('/')[1]
+        body = self.server.documents[provider]
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if compress:
+            buffer = io.BytesIO()
+            with gzip.GzipFile(fileobj = buffer, mode = 'wb') as f:
+                f.write(body)
+            body = buffer.getvalue()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.server.bytes_sent += len(body)
+        if self.server.bandwidth:
+            time.sleep(len(body) / float(self.server.bandwidth))
+        self.wfile.write(body)
+
+
+def start_server(bandwidth):
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server.bandwidth = bandwidth
+    for (provider, fixture, fetch) in PROVIDERS:
+        with open(os.path.join(FIXTURES, fixture), 'rb') as f:
+            server.documents[provider] = f.read()
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    base = 'http://127.0.0.1:%d' % server.server_port
+    pywapi.WEATHER_COM_URL = base + '/weather_com/%s?unit=%s'
+    pywapi.YAHOO_WEATHER_URL = base + '/yahoo/%s_%s.xml'
+    pywapi.NOAA_WEATHER_URL = base + '/noaa/%s.xml'
+    return server
+
+
+def measure(server, fetch, number, accept_encoding):
+    pywapi.http_pool = pywapi.HTTPConnectionPool(
+        accept_encoding = accept_encoding)
+    fetch()     # open the connection
+    server.bytes_sent = 0
+    start = time.time()
+    for i in range(number):
+        weather_data = fetch()
+        assert 'error' not in weather_data, weather_data
+    elapsed = time.time() - start
+    pywapi.http_pool.clear()
+    return (server.bytes_sent / float(number), elapsed / number * 1000)
+
+
+def main():
+    parser = OptionParser(usage = 'usage: %prog [-n NUMBER] [-b KB/S]')
+    parser.add_option('-n', '--number', dest = 'number', type = 'int',
+                      default = 200, help = 'reports fetched per provider')
+    parser.add_option('-b', '--bandwidth', dest = 'bandwidth', type = 'int',
+                      default = 256, help = 'simulated link speed in KB/s, '
+                      '0 for no limit (default: 256)')
+    (options, args) = parser.parse_args()
+
+    server = start_server(options.bandwidth * 1024)
+    print('%-12s %-9s %10s %12s' % ('provider', 'encoding', 'bytes/req',
+                                    'ms/req'))
+    for (provider, fixture, fetch) in PROVIDERS:
+        for accept_encoding in (None, pywapi.HTTP_ACCEPT_ENCODING):
+            (size, latency) = measure(server, fetch, options.number,
+                                      accept_encoding)
+            print('%-12s %-9s %10.0f %12.3f' % (
+                provider, 'gzip' if accept_encoding else 'identity',
+                size, latency))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
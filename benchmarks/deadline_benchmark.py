@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+"""Checks that fetch functions called with a timeout return within it,
+against a local stand-in server that is deliberately slow.
+
+Every scenario fetches a NOAA report (benchmarks/fixtures) from the
+server with the thread and, on Python 3.5+, the asyncio functions, and
+measures how long the call takes to return. The server
+
+  fast      answers at once, the report must be parsed as usual
+  stall     accepts the connection and never answers
+  drip      sends the headers, then the body one byte at a time
+  chunked   sends the body one byte per chunk of a chunked response
+  connect   never accepts the connection (its listen backlog is full)
+
+The script exits with status 1 if a call returns a report it should not,
+or takes longer than its timeout plus --slack milliseconds.
+
+Usage: python benchmarks/deadline_benchmark.py [-t SECONDS] [--slack MS]
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pywapi
+try:
+    import asyncio
+    import pywapi_async
+except (ImportError, SyntaxError):
+    pywapi_async = None
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# scenario, whether the call must succeed
+SCENARIOS = (('fast', True), ('stall', False), ('drip', False),
+             ('chunked', False), ('connect', False))
+
+# seconds the server keeps a slow response going
+SLOW_SECONDS = 10
+DRIP_INTERVAL = 0.02
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    document = b''
+
+    def handle_error(self, request, client_address):
+        pass        # clients that gave up reset their connections
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        scenario = self.path.split('/')[1]
+        body = self.server.document
+        if scenario == 'stall':
+            time.sleep(SLOW_SECONDS)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=UTF-8')
+        if scenario == 'chunked':
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if scenario == 'fast':
+            self.wfile.write(body)
+            return
+        try:
+            stop = time.time() + SLOW_SECONDS
+            for i in range(len(body)):
+                if time.time() > stop:
+                    break
+                byte = body[i:i + 1]
+                if scenario == 'chunked':
+                    byte = b'1\r\n' + byte + b'\r\n'
+                self.wfile.write(byte)
+                self.wfile.flush()
+                time.sleep(DRIP_INTERVAL)
+        except socket.error:
+            pass        # the client gave up
+
+
+def start_server():
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    with open(os.path.join(FIXTURES, 'noaa_current_obs.xml'), 'rb') as f:
+        server.document = f.read()
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def start_full_listener():
+    """Returns a listening socket that never accepts, with its backlog
+    filled, so that new connections to it hang, and the filler sockets"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(0)
+    fillers = []
+    for i in range(8):
+        filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        filler.setblocking(False)
+        filler.connect_ex(listener.getsockname())
+        fillers.append(filler)
+    return (listener, fillers)
+
+
+def scenario_url(server, listener, scenario):
+    if scenario == 'connect':
+        return 'http://127.0.0.1:%d/%%s.xml' % listener.getsockname()[1]
+    return 'http://127.0.0.1:%d/%s/%%s.xml' % (server.server_port, scenario)
+
+
+def measure(fetch):
+    start = time.time()
+    weather_data = fetch()
+    return (weather_data, time.time() - start)
+
+
+def main():
+    parser = OptionParser(usage = 'usage: %prog [-t SECONDS] [--slack MS]')
+    parser.add_option('-t', '--timeout', dest = 'timeout', type = 'float',
+                      default = 0.5, help = 'timeout of each call in '
+                      'seconds (default: 0.5)')
+    parser.add_option('--slack', dest = 'slack', type = 'float',
+                      default = 100, help = 'milliseconds a call may take '
+                      'beyond its timeout (default: 100)')
+    (options, args) = parser.parse_args()
+
+    server = start_server()
+    (listener, fillers) = start_full_listener()
+    # total deadline, and the same budget split into connect and read
+    timeouts = ((options.timeout, options.timeout),
+                ((options.timeout / 2, options.timeout / 2),
+                 options.timeout))
+    fetchers = [('thread', lambda timeout:
+                 pywapi.get_weather_from_noaa('KJFK', timeout = timeout))]
+    if pywapi_async is not None:
+        loop = asyncio.new_event_loop()
+        fetchers.append(('asyncio', lambda timeout: loop.run_until_complete(
+            pywapi_async.get_weather_from_noaa('KJFK', timeout = timeout))))
+
+    failures = 0
+    print('%-8s %-8s %-13s %9s %9s  %s' % ('api', 'scenario', 'timeout',
+                                             'ms', 'bound ms', 'result'))
+    for (scenario, succeeds) in SCENARIOS:
+        pywapi.NOAA_WEATHER_URL = scenario_url(server, listener, scenario)
+        for (api, fetch) in fetchers:
+            for (timeout, bound) in timeouts:
+                (weather_data, elapsed) = measure(lambda: fetch(timeout))
+                ok = ('error' not in weather_data) == succeeds and \
+                     elapsed * 1000 <= bound * 1000 + options.slack
+                failures += not ok
+                print('%-8s %-8s %-13s %9.1f %9.1f  %s%s' % (
+                    api, scenario, timeout, elapsed * 1000, bound * 1000,
+                    weather_data.get('error', 'report'),
+                    '' if ok else '  FAILED'))
+
+    server.shutdown()
+    if failures:
+        print('%d calls missed their deadline' % failures)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""Compares the compiled extraction plans used by pywapi with the former
+minidom parsers, which called getElementsByTagName() once per field.
+
+Usage: python benchmarks/extraction_benchmark.py [-n NUMBER]
+"""
+
+import os
+import sys
+import timeit
+from optparse import OptionParser
+from xml.dom import minidom
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pywapi
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def legacy_parse_weather_com(xml_response):
+    """Weather.com parser of pywapi 0.3.8"""
+    dom = minidom.parseString(xml_response)
+    weather_dom = dom.getElementsByTagName('weather')[0]
+    key_map = pywapi.WEATHER_COM_KEY_MAP
+    data_structure = dict(pywapi.WEATHER_COM_DATA_STRUCTURE)
+    cc_structure = dict(pywapi.WEATHER_COM_CC_STRUCTURE)
+    for (tag, list_of_tags2) in data_structure.items():
+        for tag2 in list_of_tags2:
+            if weather_dom.getElementsByTagName(tag)[0].childNodes.length == 0:
+                data_structure[tag] = []
+    weather_data = {}
+    for (tag, list_of_tags2) in data_structure.items():
+        key = key_map[tag]
+        weather_data[key] = {}
+        for tag2 in list_of_tags2:
+            key2 = key_map[tag2]
+            try:
+                weather_data[key][key2] = weather_dom.getElementsByTagName(
+                    tag)[0].getElementsByTagName(tag2)[0].firstChild.data
+            except AttributeError:
+                weather_data[key][key2] = ''
+    if weather_dom.getElementsByTagName('cc')[0].childNodes.length > 0:
+        cc_dom = weather_dom.getElementsByTagName('cc')[0]
+        for (tag, list_of_tags2) in cc_structure.items():
+            key = key_map[tag]
+            weather_data['current_conditions'][key] = {}
+            for tag2 in list_of_tags2:
+                key2 = key_map[tag2]
+                try:
+                    weather_data['current_conditions'][key][key2] = cc_dom.getElementsByTagName(
+                        tag)[0].getElementsByTagName(tag2)[0].firstChild.data
+                except AttributeError:
+                    weather_data['current_conditions'][key][key2] = ''
+    forecasts = []
+    if len(weather_dom.getElementsByTagName('dayf')) > 0:
+        time_of_day_map = {'d':'day', 'n':'night'}
+        for forecast in weather_dom.getElementsByTagName('dayf')[0].getElementsByTagName('day'):
+            tmp_forecast = {}
+            tmp_forecast['day_of_week'] = forecast.getAttribute('t')
+            tmp_forecast['date'] = forecast.getAttribute('dt')
+            for tag in ('hi', 'low', 'sunr', 'suns'):
+                key = key_map[tag]
+                try:
+                    tmp_forecast[key] = forecast.getElementsByTagName(
+                    tag)[0].firstChild.data
+                except AttributeError:
+                    tmp_forecast[key] = ''
+            for part in forecast.getElementsByTagName('part'):
+                time_of_day = time_of_day_map[part.getAttribute('p')]
+                tmp_forecast[time_of_day] = {}
+                for tag2 in ('icon', 't', 'bt', 'ppcp', 'hmid'):
+                    key2 = key_map[tag2]
+                    try:
+                        tmp_forecast[time_of_day][
+                            key2] = part.getElementsByTagName(tag2)[0].firstChild.data
+                    except AttributeError:
+                        tmp_forecast[time_of_day][key2] = ''
+                tmp_forecast[time_of_day]['wind'] = {}
+                for tag2 in ('s', 'gust', 'd', 't'):
+                    key2 = key_map[tag2]
+                    tmp_forecast[time_of_day]['wind'][key2] = part.getElementsByTagName(
+                        'wind')[0].getElementsByTagName(tag2)[0].firstChild.data
+            forecasts.append(tmp_forecast)
+    weather_data['forecasts'] = forecasts
+    dom.unlink()
+    return weather_data
+
+
+def legacy_parse_yahoo(xml_response):
+    """Yahoo! Weather parser of pywapi 0.3.8"""
+    ns = pywapi.YAHOO_WEATHER_NS
+    dom = minidom.parseString(xml_response)
+    weather_data = {}
+    weather_data['title'] = dom.getElementsByTagName('title')[0].firstChild.data
+    weather_data['link'] = dom.getElementsByTagName('link')[0].firstChild.data
+    for (tag, attrs) in pywapi.YAHOO_NS_DATA_STRUCTURE:
+        weather_data[tag] = pywapi.xml_get_ns_yahoo_tag(dom, ns, tag, attrs)
+    weather_data['geo'] = {}
+    weather_data['geo']['lat'] = dom.getElementsByTagName(
+        'geo:lat')[0].firstChild.data
+    weather_data['geo']['long'] = dom.getElementsByTagName(
+        'geo:long')[0].firstChild.data
+    weather_data['condition']['title'] = dom.getElementsByTagName(
+        'item')[0].getElementsByTagName('title')[0].firstChild.data
+    weather_data['html_description'] = dom.getElementsByTagName(
+        'item')[0].getElementsByTagName('description')[0].firstChild.data
+    forecasts = []
+    for forecast in dom.getElementsByTagNameNS(ns, 'forecast'):
+        forecasts.append(pywapi.xml_get_attrs(forecast, pywapi.YAHOO_FORECAST_ATTRS))
+    weather_data['forecasts'] = forecasts
+    dom.unlink()
+    return weather_data
+
+
+CASES = (
+    ('Weather.com 5-day', 'weather_com_5day.xml',
+     legacy_parse_weather_com, pywapi.parse_weather_com_response),
+    ('Yahoo! forecastrss', 'yahoo_forecastrss.xml',
+     legacy_parse_yahoo, pywapi.parse_yahoo_response),
+)
+
+
+def best_time(function, argument, number):
+    timer = timeit.Timer(lambda: function(argument))
+    return min(timer.repeat(repeat = 5, number = number)) / number
+
+
+def main():
+    parser = OptionParser(usage = 'usage: %prog [-n NUMBER]')
+    parser.add_option('-n', '--number', dest = 'number', type = 'int',
+                      default = 200, help = 'parses per timing run')
+    (options, args) = parser.parse_args()
+
+    print('%-20s %12s %12s %8s' % ('payload', 'minidom', 'plan', 'speedup'))
+    for (name, fixture, legacy, current) in CASES:
+        with open(os.path.join(FIXTURES, fixture), 'rb') as f:
+            xml_response = f.read()
+        if legacy(xml_response) != current(xml_response):
+            sys.exit('%s: results differ' % name)
+        legacy_time = best_time(legacy, xml_response, options.number)
+        current_time = best_time(current, xml_response, options.number)
+        print('%-20s %10.1fus %10.1fus %7.1fx' % (
+            name, legacy_time * 1e6, current_time * 1e6,
+            legacy_time / current_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""Compares the latency of asking one provider with get_current_conditions()
+asking all three, from a local stand-in server that serves the recorded
+responses in benchmarks/fixtures.
+
+Every provider of the server is usually fast, but answers a share of the
+requests (--slow-rate) only after --slow-ms milliseconds, independently of
+the others. One provider alone has that slow tail; 'fastest' mode only
+waits for the slowest of all providers when they are all slow at once,
+while 'merge' mode waits for the slowest of them every time.
+
+Usage: python benchmarks/fanout_benchmark.py [-n NUMBER] [--slow-rate RATE]
+           [--slow-ms MS]
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pywapi
+try:
+    import asyncio
+    import pywapi_async
+except (ImportError, SyntaxError):
+    pywapi_async = None
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+DOCUMENTS = (('weather_com', 'weather_com_5day.xml'),
+             ('yahoo', 'yahoo_forecastrss.xml'),
+             ('noaa', 'noaa_current_obs.xml'))
+
+LOCATION_IDS = {'noaa': 'KJFK', 'weather_com': 'USNY0996',
+                'yahoo': 'USNY0996'}
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    documents = {}
+    slow_rate = 0.0
+    slow_seconds = 0.0
+
+    def handle_error(self, request, client_address):
+        pass        # fetches abandoned in 'fastest' mode
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = self.server.documents[self.path.split('/')[1]]
+        if random.random() < self.server.slow_rate:
+            time.sleep(self.server.slow_seconds)
+        else:
+            time.sleep(0.002)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(slow_rate, slow_seconds):
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server.slow_rate = slow_rate
+    server.slow_seconds = slow_seconds
+    for (provider, fixture) in DOCUMENTS:
+        with open(os.path.join(FIXTURES, fixture), 'rb') as f:
+            server.documents[provider] = f.read()
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    base = 'http://127.0.0.1:%d' % server.server_port
+    pywapi.WEATHER_COM_URL = base + '/weather_com/%s?unit=%s'
+    pywapi.YAHOO_WEATHER_URL = base + '/yahoo/%s_%s.xml'
+    pywapi.NOAA_WEATHER_URL = base + '/noaa/%s.xml'
+    return server
+
+
+def measure(query, number):
+    """Returns the sorted latencies of number queries in milliseconds"""
+    latencies = []
+    for i in range(number):
+        start = time.time()
+        conditions = query()
+        latencies.append((time.time() - start) * 1000)
+        assert 'error' not in conditions, conditions
+    latencies.sort()
+    return latencies
+
+
+def main():
+    parser = OptionParser(usage = 'usage: %prog [-n NUMBER] '
+                          '[--slow-rate RATE] [--slow-ms MS]')
+    parser.add_option('-n', '--number', dest = 'number', type = 'int',
+                      default = 200, help = 'queries per setup')
+    parser.add_option('--slow-rate', dest = 'slow_rate', type = 'float',
+                      default = 0.1, help = 'share of slow answers of every '
+                      'provider (default: 0.1)')
+    parser.add_option('--slow-ms', dest = 'slow_ms', type = 'float',
+                      default = 200, help = 'latency of a slow answer in '
+                      'milliseconds (default: 200)')
+    (options, args) = parser.parse_args()
+
+    server = start_server(options.slow_rate, options.slow_ms / 1000.0)
+    setups = [('%s only' % provider,
+               lambda provider = provider: pywapi.get_current_conditions(
+                   {provider: LOCATION_IDS[provider]}))
+              for (provider, fixture) in DOCUMENTS]
+    setups.append(('fastest', lambda: pywapi.get_current_conditions(
+        LOCATION_IDS, 'fastest')))
+    setups.append(('merge', lambda: pywapi.get_current_conditions(
+        LOCATION_IDS, 'merge')))
+    if pywapi_async is not None:
+        loop = asyncio.new_event_loop()
+        setups.append(('async fastest', lambda: loop.run_until_complete(
+            pywapi_async.get_current_conditions(LOCATION_IDS, 'fastest'))))
+
+    print('%-18s %9s %9s %9s %9s' % ('query', 'p50 ms', 'p90 ms', 'p99 ms',
+                                     'max ms'))
+    for (name, query) in setups:
+        latencies = measure(query, options.number)
+        print('%-18s %9.2f %9.2f %9.2f %9.2f' % (
+            name, latencies[len(latencies) // 2],
+            latencies[int(len(latencies) * 0.9)],
+            latencies[int(len(latencies) * 0.99)], latencies[-1]))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""Measures the time taken by 'import pywapi' in a fresh interpreter, and
+checks that the network, XML and optional modules are not loaded until
+they are used.
+
+Usage: python benchmarks/import_benchmark.py [-n NUMBER] [--max-ms MS]
+
+Exits with status 1 if a deferred module is imported eagerly, or if the
+fastest import takes longer than --max-ms milliseconds.
+"""
+
+import os
+import subprocess
+import sys
+from optparse import OptionParser
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# modules that importing pywapi must not load
+DEFERRED = ('http.client', 'urllib.request', 'urllib.error', 'json',
+            'xml.parsers.expat', 'socket', 'zlib', 'csv', 'sqlite3',
+            'unidecode', 'numpy', 'pyarrow', 'email')
+
+MEASURE = r'''
+import sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+import pywapi
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(' '.join(sorted(set(sys.modules) - before)))
+'''
+
+
+def measure_once():
+    output = subprocess.check_output([sys.executable, '-c', MEASURE],
+                                     cwd = ROOT, universal_newlines = True)
+    (elapsed, modules) = output.split('\n')[:2]
+    return (float(elapsed), modules.split())
+
+
+def main():
+    parser = OptionParser(usage = 'usage: %prog [-n NUMBER] [--max-ms MS]')
+    parser.add_option('-n', '--number', dest = 'number', type = 'int',
+                      default = 20, help = 'fresh interpreters to start')
+    parser.add_option('--max-ms', dest = 'max_ms', type = 'float',
+                      help = 'fail if the fastest import is slower')
+    (options, args) = parser.parse_args()
+
+    times = []
+    for i in range(options.number):
+        (elapsed, modules) = measure_once()
+        times.append(elapsed * 1000)
+    times.sort()
+    print('import pywapi: min %.2f ms, median %.2f ms, max %.2f ms '
+          '(%d runs)' % (times[0], times[len(times) // 2], times[-1],
+                         len(times)))
+    print('modules loaded: %d' % len(modules))
+
+    status = 0
+    eager = sorted(set(name for name in DEFERRED for module in modules
+                       if module == name or module.startswith(name + '.')))
+    if eager:
+        print('FAIL: loaded eagerly: %s' % ', '.join(eager))
+        status = 1
+    if options.max_ms is not None and times[0] > options.max_ms:
+        print('FAIL: slower than %.2f ms' % options.max_ms)
+        status = 1
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""Offline benchmark of the pywapi response parsers.
+
+Parses the recorded provider responses in benchmarks/fixtures and reports,
+for every parser, the throughput in documents per second, latency
+percentiles and the peak memory allocated while parsing one document. No
+network access is needed.
+
+Results can be saved with --save and compared with a previous run with
+--baseline:
+
+  python benchmarks/parse_benchmark.py --save before.json
+  (change pywapi.py)
+  python benchmarks/parse_benchmark.py --baseline before.json
+"""
+
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pywapi
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# name, fixture, parser
+PARSERS = (
+    ('weather_com', 'weather_com_5day.xml', pywapi.parse_weather_com_response),
+    ('yahoo', 'yahoo_forecastrss.xml', pywapi.parse_yahoo_response),
+    ('noaa', 'noaa_current_obs.xml', pywapi.parse_noaa_response),
+    ('loc_id', 'weather_com_search.xml', pywapi.parse_loc_id_response),
+    ('woeid', 'yahoo_woeid_search.json', pywapi.parse_woeid_response),
+)
+
+
+def percentile(sorted_values, fraction):
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def measure(parse, document, number, warmup):
+    for i in range(warmup):
+        parse(document)
+
+    timer = time.perf_counter
+    latencies = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = timer()
+        for i in range(number):
+            t0 = timer()
+            parse(document)
+            latencies.append(timer() - t0)
+        total = timer() - start
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    latencies.sort()
+
+    tracemalloc.start()
+    parse(document)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'docs_per_sec': number / total,
+            'p50_us': percentile(latencies, 0.50) * 1e6,
+            'p90_us': percentile(latencies, 0.90) * 1e6,
+            'p99_us': percentile(latencies, 0.99) * 1e6,
+            'peak_kib': peak / 1024.0,
+            'size_bytes': len(document)}
+
+
+def main():
+    parser = OptionParser(usage = 'usage: %prog [options] [parser ...]')
+    parser.add_option('-n', '--number', dest = 'number', type = 'int',
+                      default = 2000, help = 'documents parsed per parser')
+    parser.add_option('-w', '--warmup', dest = 'warmup', type = 'int',
+                      default = 200, help = 'untimed parses before measuring')
+    parser.add_option('--save', dest = 'save', metavar = 'FILE',
+                      help = 'write the results to FILE as JSON')
+    parser.add_option('--baseline', dest = 'baseline', metavar = 'FILE',
+                      help = 'compare with results saved by --save')
+    (options, args) = parser.parse_args()
+
+    baseline = {}
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    print('%-12s %7s %10s %9s %9s %9s %9s %8s' % (
+        'parser', 'bytes', 'docs/s', 'p50 us', 'p90 us', 'p99 us',
+        'peak KiB', 'change'))
+    for (name, fixture, parse) in PARSERS:
+        if args and name not in args:
+            continue
+        with open(os.path.join(FIXTURES, fixture), 'rb') as f:
+            document = f.read()
+        result = measure(parse, document, options.number, options.warmup)
+        results[name] = result
+        change = ''
+        if name in baseline:
+            change = '%+.1f%%' % (100.0 * (result['docs_per_sec'] /
+                                  baseline[name]['docs_per_sec'] - 1.0))
+        print('%-12s %7d %10.0f %9.1f %9.1f %9.1f %9.1f %8s' % (
+            name, result['size_bytes'], result['docs_per_sec'],
+            result['p50_us'], result['p90_us'], result['p99_us'],
+            result['peak_kib'], change))
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
+
+
+if __name__ == '__main__':
+    main()
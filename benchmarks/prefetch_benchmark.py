@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""Measures how often callers wait for a fetch with a ResponseCache alone,
+and with a Prefetcher refreshing the popular reports ahead of expiry.
+'expired' counts the requests that found their report expired; the
+remaining misses are first requests and rarely requested locations.
+
+A few client threads request Yahoo! reports for --locations locations,
+picked with a Zipf-like popularity (a handful of locations get most of
+the requests), for --seconds seconds. The reports come from a local
+stand-in server that answers after --latency-ms milliseconds, and are
+cached for --ttl seconds.
+
+Usage: python benchmarks/prefetch_benchmark.py [-s SECONDS] [-l LOCATIONS]
+           [--ttl SECONDS] [--latency-ms MS]
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pywapi
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+CLIENTS = 4
+# seconds between two requests of a client
+THINK_TIME = 0.005
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    document = b''
+    latency = 0.0
+    requests = 0
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+        body = self.server.document
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(latency):
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server.latency = latency
+    with open(os.path.join(FIXTURES, 'yahoo_forecastrss.xml'), 'rb') as f:
+        server.document = f.read()
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    pywapi.YAHOO_WEATHER_URL = 'http://127.0.0.1:%d/%%s_%%s.xml' % \
+                               server.server_port
+    return server
+
+
+def run(seconds, locations):
+    """Requests reports from CLIENTS threads for seconds, returns the
+    sorted latencies in milliseconds"""
+    weights = [1.0 / rank for rank in range(1, locations + 1)]
+    total = sum(weights)
+    cumulative = []
+    for weight in weights:
+        cumulative.append((cumulative[-1] if cumulative else 0) +
+                          weight / total)
+    latencies = []
+    stop = time.time() + seconds
+
+    def client():
+        rng = random.Random()
+        while time.time() < stop:
+            draw = rng.random()
+            rank = len([c for c in cumulative if c < draw])
+            location_id = 'USNY%04d' % min(rank, locations - 1)
+            start = time.time()
+            pywapi.get_weather_from_yahoo(location_id)
+            latencies.append((time.time() - start) * 1000)
+            time.sleep(THINK_TIME)
+
+    threads = [threading.Thread(target = client) for i in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return latencies
+
+
+def main():
+    parser = OptionParser(usage = 'usage: %prog [-s SECONDS] [-l LOCATIONS] '
+                          '[--ttl SECONDS] [--latency-ms MS]')
+    parser.add_option('-s', '--seconds', dest = 'seconds', type = 'float',
+                      default = 10, help = 'duration of each run')
+    parser.add_option('-l', '--locations', dest = 'locations', type = 'int',
+                      default = 50, help = 'number of locations (default: 50)')
+    parser.add_option('--ttl', dest = 'ttl', type = 'float', default = 2,
+                      help = 'seconds a report stays cached (default: 2)')
+    parser.add_option('--latency-ms', dest = 'latency_ms', type = 'float',
+                      default = 50, help = 'latency of the server in '
+                      'milliseconds (default: 50)')
+    (options, args) = parser.parse_args()
+
+    server = start_server(options.latency_ms / 1000.0)
+    print('%-11s %8s %9s %8s %9s %9s %9s %9s %10s' % (
+        'prefetcher', 'calls', 'hit rate', 'expired', 'p50 ms', 'p95 ms',
+        'p99 ms', 'upstream', 'refreshed'))
+    for setup in ('off', 'on'):
+        pywapi.response_cache = cache = pywapi.ResponseCache(
+            ttl = {'yahoo': options.ttl})
+        pywapi.prefetcher = None
+        if setup == 'on':
+            pywapi.prefetcher = pywapi.Prefetcher(
+                lead = 0.25, half_life = options.ttl * 2)
+        server.requests = 0
+        latencies = run(options.seconds, options.locations)
+        stats = cache.stats()
+        refreshed = 0
+        if pywapi.prefetcher is not None:
+            refreshed = pywapi.prefetcher.stats()['refreshed']
+            pywapi.prefetcher.close()
+        print('%-11s %8d %8.1f%% %8d %9.3f %9.3f %9.3f %9d %10d' % (
+            setup, len(latencies),
+            100.0 * stats['hits'] / (stats['hits'] + stats['misses']),
+            stats['expirations'], latencies[len(latencies) // 2],
+            latencies[int(len(latencies) * 0.95)],
+            latencies[int(len(latencies) * 0.99)], server.requests,
+            refreshed))
+    pywapi.prefetcher = None
+    pywapi.response_cache = None
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""Crawls several countries at once with get_everything_from_yahoo(),
+with and without a RateLimiter, from a local stand-in server that
+tolerates --server-rate requests per second and answers 429 Too Many
+Requests beyond that, like a throttling provider.
+
+Without the limiter the crawls burst past the server's rate and many
+cities fail; with the limiter set just below the server's rate and
+burst, the requests are spread out and all cities are fetched. The wait-time stats show what the
+pacing cost.
+
+Usage: python benchmarks/rate_limit_benchmark.py [-c CITIES] [-w WORKERS]
+           [--server-rate RATE] [--burst BURST]
+"""
+
+import os
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pywapi
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+COUNTRIES = ('FRXX', 'GMXX', 'ITXX', 'SPXX')
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    document = b''
+    bucket = None
+    throttled = 0
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.server.bucket.reserve(max_wait = 0) is None:
+            self.server.throttled += 1
+            (status, body) = (429, b'Too Many Requests')
+        else:
+            (status, body) = (200, self.server.document)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server():
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    with open(os.path.join(FIXTURES, 'yahoo_forecastrss.xml'), 'rb') as f:
+        server.document = f.read()
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    pywapi.YAHOO_WEATHER_URL = 'http://127.0.0.1:%d/%%s_%%s.xml' % \
+                               server.server_port
+    return server
+
+
+class Counter(object):
+    """Sink counting the reports and the errors of a crawl"""
+
+    def __init__(self):
+        self.reports = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def append(self, city_code, weather_data):
+        with self._lock:
+            if 'error' in weather_data:
+                self.errors += 1
+            else:
+                self.reports += 1
+
+
+def crawl(cities, max_workers):
+    """Crawls all COUNTRIES at the same time, returns the Counter and the
+    seconds taken"""
+    counter = Counter()
+    threads = [threading.Thread(target = pywapi.get_everything_from_yahoo,
+                                args = (country_code, cities),
+                                kwargs = {'max_workers': max_workers,
+                                          'sink': counter})
+               for country_code in COUNTRIES]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (counter, time.time() - start)
+
+
+def main():
+    parser = OptionParser(usage = 'usage: %prog [-c CITIES] [-w WORKERS] '
+                          '[--server-rate RATE] [--burst BURST]')
+    parser.add_option('-c', '--cities', dest = 'cities', type = 'int',
+                      default = 50, help = 'cities per country (default: 50)')
+    parser.add_option('-w', '--workers', dest = 'workers', type = 'int',
+                      default = 4, help = 'workers per country (default: 4)')
+    parser.add_option('--server-rate', dest = 'server_rate',
+                      type = 'float', default = 100, help = 'requests per '
+                      'second the server tolerates (default: 100)')
+    parser.add_option('--burst', dest = 'burst', type = 'int', default = 10,
+                      help = 'burst the server tolerates (default: 10)')
+    (options, args) = parser.parse_args()
+
+    server = start_server()
+    print('%-9s %8s %8s %10s %8s %9s %9s %9s' % (
+        'limiter', 'reports', 'errors', 'throttled', 'req/s', 'delayed',
+        'mean ms', 'max ms'))
+    # a little below the server's limits, as requests reach it with jitter
+    for limiter in (None, pywapi.RateLimiter(options.server_rate * 0.95,
+                                             max(1, options.burst // 2))):
+        pywapi.rate_limiter = limiter
+        server.bucket = pywapi.TokenBucket(options.server_rate,
+                                           options.burst)
+        server.throttled = 0
+        (counter, elapsed) = crawl(options.cities, options.workers)
+        requests = counter.reports + counter.errors
+        stats = {'delayed': 0, 'mean_wait_seconds': 0,
+                 'max_wait_seconds': 0}
+        if limiter is not None:
+            stats = limiter.stats()['yahoo']
+        print('%-9s %8d %8d %10d %8.1f %9d %9.2f %9.2f' % (
+            'on' if limiter else 'off', counter.reports, counter.errors,
+            server.throttled, requests / elapsed, stats['delayed'],
+            stats['mean_wait_seconds'] * 1000,
+            stats['max_wait_seconds'] * 1000))
+    pywapi.rate_limiter = None
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
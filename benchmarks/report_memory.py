@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""Measures the memory held by many parsed reports, as nested dictionaries
+and as CompactReports.
+
+Usage: python benchmarks/report_memory.py [-n NUMBER]
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pywapi
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+REPORTS = (
+    ('weather_com', 'weather_com_5day.xml', pywapi.parse_weather_com_response),
+    ('yahoo', 'yahoo_forecastrss.xml', pywapi.parse_yahoo_response),
+    ('noaa', 'noaa_current_obs.xml', pywapi.parse_noaa_response),
+)
+
+
+def retained_bytes(build, number):
+    """Returns the memory held by number results of build()"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    reports = [build() for i in range(number)]
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del reports
+    return retained
+
+
+def main():
+    parser = OptionParser(usage = 'usage: %prog [-n NUMBER]')
+    parser.add_option('-n', '--number', dest = 'number', type = 'int',
+                      default = 2000, help = 'reports held in memory')
+    (options, args) = parser.parse_args()
+
+    print('%-12s %14s %16s %8s' % ('provider', 'dict B/report',
+                                   'compact B/report', 'saved'))
+    for (name, fixture, parse) in REPORTS:
+        with open(os.path.join(FIXTURES, fixture), 'rb') as f:
+            document = f.read()
+        as_dict = retained_bytes(lambda: parse(document), options.number)
+        compact = retained_bytes(
+            lambda: pywapi.compact_report(parse(document)), options.number)
+        print('%-12s %14.0f %16.0f %7.0f%%' % (
+            name, as_dict / float(options.number),
+            compact / float(options.number),
+            100.0 * (1 - compact / float(as_dict))))
+
+
+if __name__ == '__main__':
+    main()
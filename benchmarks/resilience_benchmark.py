@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""Measures what RetryPolicy and CircuitBreakers change when a provider
+misbehaves, with a local stand-in server serving the recorded NOAA report
+in benchmarks/fixtures.
+
+  flaky   the server answers 503 to a random share of the requests
+          (--failure-rate); retries turn most failures into reports
+  down    the provider never accepts connections, and every call waits
+          for its --timeout; with the circuit open, calls fail at once
+
+Usage: python benchmarks/resilience_benchmark.py [-n NUMBER] [-w WORKERS]
+           [--failure-rate RATE] [-t SECONDS]
+"""
+
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from optparse import OptionParser
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pywapi
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    document = b''
+    failure_rate = 0.0
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if random.random() < self.server.failure_rate:
+            (status, body) = (503, b'Service Unavailable')
+        else:
+            (status, body) = (200, self.server.document)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(failure_rate):
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server.failure_rate = failure_rate
+    with open(os.path.join(FIXTURES, 'noaa_current_obs.xml'), 'rb') as f:
+        server.document = f.read()
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def start_full_listener():
+    """Returns a listening socket that never accepts, with its backlog
+    filled, so that new connections to it hang, and the filler sockets"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(0)
+    fillers = []
+    for i in range(8):
+        filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        filler.setblocking(False)
+        filler.connect_ex(listener.getsockname())
+        fillers.append(filler)
+    return (listener, fillers)
+
+
+def run(number, max_workers, timeout):
+    """Fetches number reports with max_workers threads and returns the
+    share of reports and the latencies of the calls in milliseconds"""
+    latencies = []
+    def fetch(i):
+        start = time.time()
+        weather_data = pywapi.get_weather_from_noaa('KJFK',
+                                                    timeout = timeout)
+        latencies.append((time.time() - start) * 1000)
+        return weather_data
+    start = time.time()
+    results = pywapi._map_concurrently(fetch, range(number), max_workers)
+    elapsed = time.time() - start
+    reports = len([r for r in results if 'error' not in r])
+    latencies.sort()
+    return (reports / float(number), latencies, elapsed)
+
+
+def report(scenario, setup, outcome):
+    (share, latencies, elapsed) = outcome
+    print('%-6s %-18s %8.1f%% %10.3f %10.3f %10.3f %9.2f' % (
+        scenario, setup, share * 100, latencies[len(latencies) // 2],
+        latencies[int(len(latencies) * 0.99)], latencies[-1], elapsed))
+
+
+def main():
+    parser = OptionParser(usage = 'usage: %prog [-n NUMBER] [-w WORKERS] '
+                          '[--failure-rate RATE] [-t SECONDS]')
+    parser.add_option('-n', '--number', dest = 'number', type = 'int',
+                      default = 400, help = 'reports fetched per setup')
+    parser.add_option('-w', '--workers', dest = 'workers', type = 'int',
+                      default = 8, help = 'concurrent fetches (default: 8)')
+    parser.add_option('--failure-rate', dest = 'failure_rate',
+                      type = 'float', default = 0.3,
+                      help = 'share of 503 answers when flaky (default: 0.3)')
+    parser.add_option('-t', '--timeout', dest = 'timeout', type = 'float',
+                      default = 0.2, help = 'timeout of each call in '
+                      'seconds (default: 0.2)')
+    (options, args) = parser.parse_args()
+
+    server = start_server(options.failure_rate)
+    (listener, fillers) = start_full_listener()
+    print('%-6s %-18s %9s %10s %10s %10s %9s' % (
+        'server', 'setup', 'reports', 'p50 ms', 'p99 ms', 'max ms',
+        'total s'))
+
+    pywapi.NOAA_WEATHER_URL = 'http://127.0.0.1:%d/%%s.xml' % \
+                              server.server_port
+    for (setup, policy) in (('no retries', None),
+                            ('retries', pywapi.RetryPolicy(
+                                base_delay = 0.01, max_delay = 0.1))):
+        pywapi.retry_policy = policy
+        report('flaky', setup, run(options.number, options.workers, None))
+    pywapi.retry_policy = None
+
+    pywapi.NOAA_WEATHER_URL = 'http://127.0.0.1:%d/%%s.xml' % \
+                              listener.getsockname()[1]
+    number = options.workers * 8     # every call waits without a breaker
+    for (setup, breakers) in (('no breaker', None),
+                              ('circuit breaker',
+                               pywapi.CircuitBreakers())):
+        pywapi.circuit_breakers = breakers
+        report('down', setup, run(number, options.workers, options.timeout))
+    pywapi.circuit_breakers = None
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -30,68 +30,2433 @@
 
 __version__ = "0.3.8"
 
-try:
-    # Python 3 imports
-    from urllib.request import urlopen
-    from urllib.parse import quote
-    from urllib.parse import urlencode
-    from urllib.error import URLError
+import sys
+import os
+import math
+import time
+import threading
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import OrderedDict
+from array import array
+import io
+import heapq
+from math import pow
+
+if sys.version_info[0] >= 3:
     # needed for code to work on Python3
     xrange = range
     unicode = str
-except ImportError:
-    # Python 2 imports
-    from urllib2 import urlopen
-    from urllib import quote
-    from urllib import urlencode
-    from urllib2 import URLError
-import sys
-import re
-from math import pow
-from xml.dom import minidom
-import json
 
-try:
-    from unidecode import unidecode
-except ImportError:
-    pass
 
-GOOGLE_COUNTRIES_URL = 'http://www.google.com/ig/countries?output=xml&hl=%s'
-GOOGLE_CITIES_URL    = 'http://www.google.com/ig/cities?output=xml&' + \
-                       'country=%s&hl=%s'
+class _LazyModule(object):
+    """Module imported when one of its attributes is first used, so that
+    importing pywapi only loads what the helper functions need. The
+    network and XML modules are loaded on first use; optional
+    dependencies are imported by the functions that use them.
+
+    Parameters:
+      names: names of the module to try in turn, e.g. the Python 3 and
+      the Python 2 name
+
+    """
+
+    def __init__(self, names):
+        self.__dict__['_names'] = names
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, name):
+        module = self._module
+        if module is None:
+            module = self._load()
+        value = getattr(module, name)
+        # later lookups find the attribute without calling __getattr__
+        self.__dict__[name] = value
+        return value
+
+    def _load(self):
+        error = None
+        for name in self._names:
+            try:
+                __import__(name)
+            except ImportError:
+                error = sys.exc_info()[1]
+                continue
+            self.__dict__['_module'] = sys.modules[name]
+            return sys.modules[name]
+        raise error
+
+
+_url_quoting = _LazyModule(('urllib.parse', 'urllib'))
+_url_parsing = _LazyModule(('urllib.parse', 'urlparse'))
+_url_errors = _LazyModule(('urllib.error', 'urllib2'))
+_url_request = _LazyModule(('urllib.request', 'urllib2'))
+_http_client = _LazyModule(('http.client', 'httplib'))
+queue = _LazyModule(('queue', 'Queue'))
+re = _LazyModule(('re',))
+socket = _LazyModule(('socket',))
+zlib = _LazyModule(('zlib',))
+json = _LazyModule(('json',))
+base64 = _LazyModule(('base64',))
+random = _LazyModule(('random',))
+csv = _LazyModule(('csv',))
+expat = _LazyModule(('xml.parsers.expat',))
+
+# names formerly imported into this module, resolved on first use
+_LAZY_NAMES = {'quote': _url_quoting, 'urlencode': _url_quoting,
+               'urljoin': _url_parsing, 'urlsplit': _url_parsing,
+               'URLError': _url_errors, 'HTTPError': _url_errors,
+               'urlopen': _url_request,
+               'HTTPConnection': _http_client,
+               'HTTPSConnection': _http_client,
+               'HTTPException': _http_client}
+
+def __getattr__(name):
+    # module attribute lookup fallback (Python 3.7+), e.g. pywapi.URLError
+    try:
+        module = _LAZY_NAMES[name]
+    except KeyError:
+        raise AttributeError("module 'pywapi' has no attribute %r" % name)
+    return getattr(module, name)
+
+GOOGLE_COUNTRIES_URL = 'http://www.google.com/ig/countries?output=xml&hl=%s'
+GOOGLE_CITIES_URL    = 'http://www.google.com/ig/cities?output=xml&' + \
+                       'country=%s&hl=%s'
+
+YAHOO_WEATHER_URL    = 'http://xml.weather.yahoo.com/forecastrss/%s_%s.xml'
+YAHOO_WEATHER_NS     = 'http://xml.weather.yahoo.com/ns/rss/1.0'
+
+NOAA_WEATHER_URL     = 'http://www.weather.gov/xml/current_obs/%s.xml'
+
+WEATHER_COM_URL      = 'http://wxdata.weather.com/wxdata/weather/local/%s?' + \
+                       'unit=%s&dayf=5&cc=*'
+
+LOCID_SEARCH_URL     = 'http://wxdata.weather.com/wxdata/search/search?where=%s'
+
+WOEID_SEARCH_URL     = 'http://query.yahooapis.com/v1/public/yql'
+WOEID_QUERY_STRING   = 'select line1, line2, line3, line4, ' + \
+                       'woeid from geo.placefinder where text="%s"'
+
+HTTP_POOL_MAXSIZE       = 4     # idle connections kept per host
+HTTP_POOL_IDLE_TIMEOUT  = 30    # seconds before an idle connection is dropped
+HTTP_MAX_REDIRECTS      = 5
+HTTP_ACCEPT_ENCODING    = 'gzip, deflate'   # None to disable compression
+HTTP_READ_CHUNK_SIZE    = 16384
+HTTP_PROXY_CACHE_SIZE   = 256   # hosts whose proxy is remembered
+
+# seconds a cached report stays valid, see ResponseCache
+CACHE_TTL            = {'weather_com': 600,
+                        'yahoo': 600,
+                        'noaa': 3600}   # unless the report suggests a period
+CACHE_MAX_ENTRIES    = 1024
+VALIDATOR_CACHE_MAX_ENTRIES = 1024
+
+# retries of transient failures, see RetryPolicy
+RETRY_MAX_ATTEMPTS   = 3        # attempts per call, including the first
+RETRY_BASE_DELAY     = 0.1      # seconds, doubled after every attempt
+RETRY_MAX_DELAY      = 2.0
+
+# see CircuitBreaker
+BREAKER_FAILURE_THRESHOLD = 5   # consecutive failures opening the circuit
+BREAKER_RESET_TIMEOUT     = 30  # seconds before a trial request is let through
+
+# requests per second and burst of each provider, see RateLimiter
+RATE_LIMIT_RATE      = 10.0
+RATE_LIMIT_BURST     = 10
+
+# refresh-ahead of popular cached reports, see Prefetcher
+PREFETCH_MAX_WORKERS = 2
+PREFETCH_LEAD        = 0.1      # share of the time to live left at refresh
+PREFETCH_MIN_SCORE   = 2.0      # recent accesses making a report popular
+PREFETCH_HALF_LIFE   = 600      # seconds for the access score to halve
+PREFETCH_MAX_ENTRIES = 4096     # reports whose accesses are tracked
+PREFETCH_TIMEOUT     = 30       # seconds allowed for a refresh
+
+# strings up to this length are shared between compact reports
+COMPACT_INTERN_MAX_LENGTH  = 40
+COMPACT_INTERN_MAX_ENTRIES = 65536
+
+# seconds a location search result stays valid, see LocationCache
+LOCATION_CACHE_TTL   = 30 * 24 * 3600
+
+# clock used for the timings of the metrics hooks
+_timer = getattr(time, 'perf_counter', time.time)
+
+#WXUG_BASE_URL        = 'http://api.wunderground.com/auto/wui/geo'
+#WXUG_FORECAST_URL    = WXUG_BASE_URL + '/ForecastXML/index.xml?query=%s'
+#WXUG_CURRENT_URL     = WXUG_BASE_URL + '/WXCurrentObXML/index.xml?query=%s'
+#WXUG_GEOLOOKUP_URL   = WXUG_BASE_URL + '/GeoLookupXML/index.xml?query=%s'
+#WXUG_ALERTS_URL      = WXUG_BASE_URL + '/AlertsXML/index.xml?query=%s'
+
+
+
+class WindUnits:
+    """Class for available wind unit systems"""
+    MPS = 1
+    MPH = 2
+    BEAUFORT = 3
+    KPH = 4
+    KNOTS = 5
+
+
+class HTTPConnectionPool(object):
+    """Pool of persistent HTTP/1.1 connections, shared by all provider
+    functions of this module.
+
+    Connections are kept open after each request and reused for the next
+    request to the same host, which saves the DNS lookup and TCP handshake.
+    At most maxsize idle connections are kept per host, and connections
+    that have been idle for longer than idle_timeout seconds are dropped.
+
+    Compressed responses are requested with the Accept-Encoding header
+    accept_encoding and decompressed while they are read; gzip and deflate
+    are supported.
+
+    Requests go through the proxies of the environment (http_proxy,
+    https_proxy and no_proxy, see urllib's getproxies()), https requests
+    through a CONNECT tunnel. The proxy of a host is looked up on the
+    first request to it and kept until clear() is called, so call clear()
+    after changing the proxy variables. If an opener has been installed
+    with install_opener(), e.g. with a ProxyHandler, requests are made
+    with urlopen() instead, without connection reuse or compression.
+
+    """
+
+    def __init__(self, maxsize = HTTP_POOL_MAXSIZE,
+                 idle_timeout = HTTP_POOL_IDLE_TIMEOUT,
+                 accept_encoding = HTTP_ACCEPT_ENCODING):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.accept_encoding = accept_encoding
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def request(self, url, headers = None, timeout = None):
+        """Performs a GET request, following redirects
+
+        Parameters:
+          url: absolute http or https URL
+          headers: dictionary of additional request headers
+          timeout: seconds allowed for the request, a (connect, read)
+          tuple or a Deadline, see Deadline.from_timeout()
+
+        Returns:
+          an HTTPResponse with the status, the headers (keyed by lowercase
+          name) and the full body of the response.
+
+        Raises URLError if the server could not be reached or the timeout
+        ran out, and HTTPError if it answered with an error status.
+
+        """
+        deadline = Deadline.from_timeout(timeout)
+        if _opener_installed():
+            return _request_with_opener(url, headers, deadline)
+        for i in xrange(HTTP_MAX_REDIRECTS + 1):
+            response = self._request_once(url, headers, deadline)
+            if response.status in (301, 302, 303, 307, 308) and \
+               'location' in response.headers:
+                url = _url_parsing.urljoin(url, response.headers['location'])
+                continue
+            if response.status >= 400:
+                raise _url_errors.HTTPError(url, response.status,
+                                            response.reason,
+                                            response.headers, None)
+            return response
+        raise _url_errors.URLError('Too many redirects')
+
+    def clear(self):
+        """Closes all idle connections and forgets the proxy of every
+        host"""
+        _proxies.clear()
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for (connection, last_used) in connections:
+                connection.close()
+
+    def _request_once(self, url, headers, deadline):
+        parts = _url_parsing.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise _url_errors.URLError('Unsupported URL scheme: %s' %
+                                       parts.scheme)
+        proxy = _proxy_for(parts)
+        key = (parts.scheme, parts.hostname, parts.port, proxy)
+        path = parts.path or '/'
+        if parts.query:
+            path = '?'.join((path, parts.query))
+        request_headers = {'User-Agent': 'pywapi/%s' % __version__}
+        if proxy is not None and parts.scheme == 'http':
+            # a plain proxy takes the absolute URL and the credentials
+            path = '%s://%s%s' % (parts.scheme, parts.netloc, path)
+            if proxy[2]:
+                request_headers['Proxy-Authorization'] = proxy[2]
+        if self.accept_encoding:
+            request_headers['Accept-Encoding'] = self.accept_encoding
+        if headers:
+            request_headers.update(headers)
+
+        while True:
+            start = _timer()
+            (connection, reused) = self._get_connection(key)
+            try:
+                if not reused:
+                    if deadline is not None:
+                        connection.timeout = _socket_timeout(
+                            deadline.connect_timeout())
+                    connection.connect()
+                connected = _timer()
+                if deadline is not None:
+                    deadline.connected()
+                    connection.sock.settimeout(
+                        _socket_timeout(deadline.read_timeout()))
+                elif reused:
+                    connection.sock.settimeout(socket.getdefaulttimeout())
+                connection.request('GET', path, headers = request_headers)
+                response = connection.getresponse()
+                body = _read_body(response,
+                                  response.getheader('content-encoding'),
+                                  deadline, connection.sock)
+            except (_http_client.HTTPException, socket.error):
+                connection.close()
+                if reused and (deadline is None or not deadline.expired()):
+                    # the server closed the idle connection, try a new one
+                    continue
+                raise _url_errors.URLError(sys.exc_info()[1])
+            break
+
+        result = HTTPResponse(response.status, response.reason,
+                              _decoded_headers(response.getheaders()), body,
+                              connected - start, _timer() - connected)
+        if response.will_close:
+            connection.close()
+        else:
+            self._put_connection(key, connection)
+        return result
+
+    def _get_connection(self, key):
+        now = time.time()
+        with self._lock:
+            connections = self._idle.get(key)
+            while connections:
+                (connection, last_used) = connections.pop()
+                if now - last_used <= self.idle_timeout:
+                    return (connection, True)
+                connection.close()
+        (scheme, host, port, proxy) = key
+        if proxy is None:
+            if scheme == 'https':
+                return (_http_client.HTTPSConnection(host, port), False)
+            return (_http_client.HTTPConnection(host, port), False)
+        (proxy_host, proxy_port, authorization) = proxy
+        if scheme == 'http':
+            return (_http_client.HTTPConnection(proxy_host, proxy_port),
+                    False)
+        connection = _http_client.HTTPSConnection(proxy_host, proxy_port)
+        tunnel_headers = None
+        if authorization:
+            tunnel_headers = {'Proxy-Authorization': authorization}
+        connection.set_tunnel(host, port, tunnel_headers)
+        return (connection, False)
+
+    def _put_connection(self, key, connection):
+        now = time.time()
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            # drop connections that have been idle for too long
+            while connections and \
+                  now - connections[0][1] > self.idle_timeout:
+                connections.pop(0)[0].close()
+            if len(connections) < self.maxsize:
+                connections.append((connection, now))
+                return
+        connection.close()
+
+
+# proxy of every (scheme, host), see _proxy_for(); emptied by the clear()
+# method of the connection pools
+_proxies = {}
+
+def _proxy_for(parts):
+    """Returns the proxy of the environment for a split URL as a
+    (host, port, Proxy-Authorization header value or None) tuple, None
+    if the URL is reached directly. The result is kept for every scheme
+    and host, at most HTTP_PROXY_CACHE_SIZE of them, until the pool is
+    cleared."""
+    key = (parts.scheme, parts.hostname)
+    try:
+        return _proxies[key]
+    except KeyError:
+        pass
+    proxy = _url_request.getproxies().get(parts.scheme)
+    if not proxy or _url_request.proxy_bypass(parts.hostname):
+        proxy = None
+    else:
+        proxy = _parse_proxy(proxy)
+    if len(_proxies) >= HTTP_PROXY_CACHE_SIZE:
+        _proxies.clear()
+    _proxies[key] = proxy
+    return proxy
+
+def _parse_proxy(proxy):
+    """Returns the (host, port, Proxy-Authorization header value or None)
+    tuple of a proxy URL"""
+    if '://' not in proxy:
+        proxy = 'http://' + proxy
+    proxy = _url_parsing.urlsplit(proxy)
+    authorization = None
+    if proxy.username is not None:
+        credentials = '%s:%s' % (_url_quoting.unquote(proxy.username),
+                                 _url_quoting.unquote(proxy.password or ''))
+        authorization = 'Basic ' + base64.b64encode(
+            credentials.encode('utf-8')).decode('ascii')
+    port = proxy.port
+    if port is None:
+        port = 443 if proxy.scheme == 'https' else 80
+    return (proxy.hostname, port, authorization)
+
+def _opener_installed():
+    """Returns whether an opener has been installed with install_opener()"""
+    # read from the module, as _LazyModule keeps the first value it finds
+    module = _url_request._module or _url_request._load()
+    return getattr(module, '_opener', None) is not None
+
+def _request_with_opener(url, headers, deadline):
+    """Performs a GET request with urlopen() and the opener installed
+    with install_opener(), and returns an HTTPResponse. The timeout of
+    every socket operation is what is left of deadline when the
+    connection is opened."""
+    request_headers = {'User-Agent': 'pywapi/%s' % __version__}
+    if headers:
+        request_headers.update(headers)
+    request = _url_request.Request(url, headers = request_headers)
+    start = _timer()
+    try:
+        if deadline is None:
+            response = _url_request.urlopen(request)
+        else:
+            response = _url_request.urlopen(
+                request, timeout = _socket_timeout(deadline.connect_timeout()))
+        connected = _timer()
+        if deadline is not None:
+            deadline.connected()
+        body = response.read()
+    except (_http_client.HTTPException, socket.error):
+        raise _url_errors.URLError(sys.exc_info()[1])
+    headers = dict((name.lower(), value)
+                   for (name, value) in response.info().items())
+    reason = getattr(response, 'reason', None) or getattr(response, 'msg', '')
+    response.close()
+    return HTTPResponse(response.getcode(), reason, headers, body,
+                        connected - start, _timer() - connected)
+
+def _read_body(response, content_encoding, deadline = None, sock = None):
+    """Reads the body of an http.client response, decompressing it chunk
+    by chunk as it arrives. With a Deadline, the timeout of the socket
+    sock is set to the time left before every read."""
+    coding = _content_coding(content_encoding)
+    if coding is None and deadline is None:
+        return response.read()
+    decoder = coding and _ContentDecoder(coding)
+    # read1() returns what has arrived instead of waiting for a full chunk
+    read = getattr(response, 'read1', response.read)
+    chunks = []
+    while True:
+        if deadline is not None:
+            sock.settimeout(_socket_timeout(deadline.read_timeout()))
+        chunk = read(HTTP_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        chunks.append(decoder.decompress(chunk) if decoder else chunk)
+    if not response.isclosed():
+        # read1() does not close a response once all of it has been read
+        response.read()
+    if decoder:
+        chunks.append(decoder.flush())
+    return b''.join(chunks)
+
+def _socket_timeout(timeout):
+    """Returns timeout, or the default socket timeout if it is None"""
+    if timeout is None:
+        return socket.getdefaulttimeout()
+    return timeout
+
+def _decoded_headers(headers):
+    """Returns response headers keyed by lowercase name, without the
+    Content-Encoding and Content-Length of a compressed body"""
+    headers = dict((name.lower(), value) for (name, value) in headers)
+    if _content_coding(headers.get('content-encoding')) is not None:
+        del headers['content-encoding']
+        headers.pop('content-length', None)
+    return headers
+
+def _content_coding(content_encoding):
+    """Returns 'gzip' or 'deflate' for a Content-Encoding header value,
+    None if the body is not compressed or the encoding is not supported"""
+    if not content_encoding:
+        return None
+    content_encoding = content_encoding.strip().lower()
+    if content_encoding in ('gzip', 'x-gzip'):
+        return 'gzip'
+    if content_encoding == 'deflate':
+        return 'deflate'
+    return None
+
+
+class _ContentDecoder(object):
+    """Incremental decompressor for a gzip or deflate encoded body.
+    Raises HTTPException if the body is not valid."""
+
+    def __init__(self, coding):
+        if coding == 'gzip':
+            self._wbits = 16 + zlib.MAX_WBITS
+        else:
+            self._wbits = zlib.MAX_WBITS
+        self._decompressor = zlib.decompressobj(self._wbits)
+        self._started = False
+
+    def decompress(self, data):
+        try:
+            try:
+                result = self._decompressor.decompress(data)
+            except zlib.error:
+                if self._started or self._wbits != zlib.MAX_WBITS:
+                    raise
+                # some servers send deflate without the zlib header
+                self._wbits = -zlib.MAX_WBITS
+                self._decompressor = zlib.decompressobj(self._wbits)
+                result = self._decompressor.decompress(data)
+        except zlib.error:
+            raise _http_client.HTTPException(
+                'Invalid compressed response body')
+        self._started = True
+        return result
+
+    def flush(self):
+        try:
+            return self._decompressor.flush()
+        except zlib.error:
+            raise _http_client.HTTPException(
+                'Invalid compressed response body')
+
+
+class HTTPResponse(object):
+    """Response returned by HTTPConnectionPool.request(). connect_time and
+    download_time are the seconds spent opening the connection (0 for a
+    reused connection) and sending the request and reading the response."""
+    __slots__ = ('status', 'reason', 'headers', 'body', 'connect_time',
+                 'download_time')
+
+    def __init__(self, status, reason, headers, body, connect_time = 0.0,
+                 download_time = 0.0):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.connect_time = connect_time
+        self.download_time = download_time
+
+
+class Deadline(object):
+    """Time budget of a single call, split into a connect and a read
+    budget.
+
+    connect is the number of seconds allowed for opening a connection,
+    read the number of seconds allowed for everything after the first
+    connection is open: sending the request, reading and decompressing
+    the response, and decoding and parsing the report. total bounds the
+    whole call, counted from the creation of the Deadline. Budgets that
+    are None are unlimited. A report is not parsed if no time is left
+    after reading it; parsing itself is not interrupted.
+
+    """
+    __slots__ = ('connect', 'read', '_start', '_expires')
+
+    def __init__(self, connect = None, read = None, total = None):
+        self.connect = connect
+        self.read = read
+        self._start = _timer()
+        self._expires = None
+        if total is not None:
+            self._expires = self._start + total
+
+    @classmethod
+    def from_timeout(cls, timeout):
+        """Returns the Deadline of a timeout argument: None for no limit,
+        a number of seconds for the whole call, or a (connect, read)
+        tuple. A Deadline is returned unchanged."""
+        if timeout is None or isinstance(timeout, cls):
+            return timeout
+        if isinstance(timeout, tuple):
+            (connect, read) = timeout
+            return cls(connect, read)
+        return cls(timeout, total = timeout)
+
+    def connected(self):
+        """Starts the read budget; called when a connection is open"""
+        if self.read is not None:
+            expires = _timer() + self.read
+            if self._expires is None or expires < self._expires:
+                self._expires = expires
+
+    def connect_timeout(self):
+        """Returns the seconds left for opening a connection, None if
+        unlimited. Raises socket.timeout if the deadline has passed."""
+        remaining = self.read_timeout()
+        if remaining is None or (self.connect is not None and
+                                 self.connect < remaining):
+            return self.connect
+        return remaining
+
+    def read_timeout(self):
+        """Returns the seconds left before the deadline, None if
+        unlimited. Raises socket.timeout if the deadline has passed."""
+        if self._expires is None:
+            return None
+        remaining = self._expires - _timer()
+        if remaining <= 0:
+            raise socket.timeout('timed out')
+        return remaining
+
+    def remaining(self):
+        """Returns the seconds left for the whole call, None if
+        unlimited"""
+        if self._expires is not None:
+            expires = self._expires
+        elif self.connect is not None and self.read is not None:
+            expires = self._start + self.connect + self.read
+        else:
+            return None
+        return max(expires - _timer(), 0)
+
+    def expired(self):
+        return self._expires is not None and _timer() >= self._expires
+
+    def check(self):
+        """Raises URLError if the deadline has passed"""
+        if self.expired():
+            raise _url_errors.URLError(socket.timeout('timed out'))
+
+
+# connection pool used by all functions of this module
+http_pool = HTTPConnectionPool()
+
+
+def _fetch_url(url, deadline = None):
+    """Fetches url through the shared connection pool
+
+    Returns:
+      the body of the response, encoded as UTF-8
+
+    Raises URLError if the server could not be reached or deadline ran
+    out.
+
+    """
+    response = http_pool.request(url, timeout = deadline)
+    if deadline is not None:
+        deadline.check()
+    return _recode_body(response)
+
+def _fetch_response(url, headers = None, deadline = None):
+    """Fetches url through the shared connection pool and returns the
+    HTTPResponse. Raises URLError if the server could not be reached or
+    deadline ran out."""
+    return http_pool.request(url, headers, deadline)
+
+def _recode_body(response):
+    """Returns the body of an HTTPResponse, re-encoded as UTF-8 if the
+    Content-Type header names another charset"""
+    content_type = response.headers.get('content-type', '')
+    try:
+        charset = re.search('charset\=(.*)', content_type).group(1)
+    except AttributeError:
+        charset = 'utf-8'
+    if charset.lower() != 'utf-8':
+        return response.body.decode(charset).encode('utf-8')
+    return response.body
+
+
+class ResponseCache(object):
+    """In-memory cache of weather reports, with a time to live for each
+    provider and least-recently-used eviction.
+
+    The cache is disabled by default. To enable it, assign an instance
+    to the module attribute response_cache:
+
+      pywapi.response_cache = pywapi.ResponseCache(max_entries = 5000)
+
+    Reports are keyed by provider, location and units. The time to live
+    of each provider defaults to CACHE_TTL and can be overridden with the
+    ttl parameter, e.g. ttl = {'yahoo': 300}. Unless overridden, NOAA
+    reports are kept for the suggested_pickup_period of the report.
+    Error results are never cached.
+
+    Cached reports are shared between callers and must not be modified.
+
+    """
+
+    def __init__(self, max_entries = CACHE_MAX_ENTRIES, ttl = None):
+        self.max_entries = max_entries
+        self.ttl = dict(CACHE_TTL)
+        self._ttl_overrides = dict(ttl or {})
+        self.ttl.update(self._ttl_overrides)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached report for key, or None if there is none
+        or it has expired"""
+        now = time.time()
+        with self._lock:
+            try:
+                (expires, value) = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires <= now:
+                self.misses += 1
+                self.expirations += 1
+                return None
+            # re-insert as most recently used
+            self._entries[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl = None):
+        """Stores value under key. key is a tuple whose first item is the
+        provider name, which selects the time to live unless ttl is given."""
+        if ttl is None:
+            ttl = self.ttl.get(key[0], 0)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+                self.evictions += 1
+
+    def provider_ttl(self, provider, suggested = None):
+        """Returns the time to live for a provider, preferring a period
+        suggested by the report unless the ttl was set explicitly"""
+        if suggested is not None and provider not in self._ttl_overrides:
+            return suggested
+        return self.ttl.get(provider, 0)
+
+    def clear(self):
+        """Removes all entries. The counters are left untouched."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Returns a dictionary with the cache counters"""
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'expirations': self.expirations}
+
+
+# cache consulted by the get_weather_from_* functions, disabled by default
+response_cache = None
+
+
+class Prefetcher(object):
+    """Refreshes popular reports of the response cache shortly before they
+    expire, so that callers keep finding them in the cache.
+
+    Disabled by default. To enable it, assign an instance to the module
+    attribute prefetcher, next to a ResponseCache:
+
+      pywapi.response_cache = pywapi.ResponseCache()
+      pywapi.prefetcher = pywapi.Prefetcher()
+
+    Every request for a report adds 1 to its access score, which halves
+    every half_life seconds. When a report with a score of at least
+    min_score is cached, its refresh is scheduled when the share lead of
+    its time to live is left. Refreshes that are due wait in a priority
+    queue, highest score first, for one of max_workers background
+    threads; a report that has become unpopular in the meantime is not
+    refreshed. The accesses of at most max_entries reports are tracked,
+    the least recently requested are forgotten first. Every refresh may
+    take timeout seconds, a (connect, read) tuple or None for no limit,
+    see Deadline.from_timeout().
+
+    """
+
+    def __init__(self, max_workers = PREFETCH_MAX_WORKERS,
+                 lead = PREFETCH_LEAD, min_score = PREFETCH_MIN_SCORE,
+                 half_life = PREFETCH_HALF_LIFE,
+                 max_entries = PREFETCH_MAX_ENTRIES,
+                 timeout = PREFETCH_TIMEOUT):
+        self.max_workers = max_workers
+        self.lead = lead
+        self.min_score = min_score
+        self.half_life = half_life
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.scheduled = 0
+        self.refreshed = 0
+        self.skipped = 0
+        self.errors = 0
+        self._entries = OrderedDict()
+        self._schedule = []     # heap of (due time, sequence, key)
+        self._ready = None      # queue of (-score, sequence, key, refresh)
+        self._sequence = 0
+        self._threads = []
+        self._closed = False
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def record(self, key, function, *args):
+        """Counts an access to the report key. function(*args, timeout =
+        timeout) fetches and caches the report again; the function and
+        its arguments are kept from the first access to the report."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                entry = _PrefetchEntry()
+                entry.refresh = (function, args)
+            entry.score = self._score(entry, now) + 1
+            entry.updated = now
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+    def cached(self, key, ttl):
+        """Schedules the refresh of the report key, cached for ttl
+        seconds, if it is popular"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.scheduled or self._closed or \
+               self._score(entry, now) < self.min_score:
+                return
+            entry.scheduled = True
+            self.scheduled += 1
+            self._sequence += 1
+            heapq.heappush(self._schedule, (now + ttl * (1 - self.lead),
+                                            self._sequence, key))
+            if not self._threads:
+                self._start()
+            self._changed.notify()
+
+    def close(self):
+        """Stops the background threads; scheduled refreshes are dropped"""
+        with self._lock:
+            self._closed = True
+            threads, self._threads = self._threads, []
+            self._changed.notify()
+        for thread in threads[1:]:
+            self._ready.put((float('-inf'), 0, None, None))
+        for thread in threads:
+            thread.join()
+
+    def stats(self):
+        """Returns a dictionary with the number of tracked reports, of
+        scheduled refreshes, of refreshes made, skipped because the report
+        had become unpopular, and failed"""
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'pending': len(self._schedule),
+                    'scheduled': self.scheduled, 'refreshed': self.refreshed,
+                    'skipped': self.skipped, 'errors': self.errors}
+
+    def _score(self, entry, now):
+        return entry.score * pow(0.5, (now - entry.updated) / self.half_life)
+
+    def _start(self):
+        self._ready = queue.PriorityQueue()
+        self._threads = [threading.Thread(target = self._run_schedule)]
+        self._threads += [threading.Thread(target = self._run_refreshes)
+                          for i in xrange(max(self.max_workers, 1))]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _run_schedule(self):
+        # moves the refreshes that are due to the ready queue
+        with self._lock:
+            while not self._closed:
+                now = time.time()
+                while self._schedule and self._schedule[0][0] <= now:
+                    (due, sequence, key) = heapq.heappop(self._schedule)
+                    entry = self._entries.get(key)
+                    if entry is None:
+                        continue
+                    score = self._score(entry, now)
+                    if score < self.min_score:
+                        entry.scheduled = False
+                        self.skipped += 1
+                        continue
+                    self._ready.put((-score, sequence, key, entry))
+                timeout = None
+                if self._schedule:
+                    timeout = self._schedule[0][0] - now
+                self._changed.wait(timeout)
+
+    def _run_refreshes(self):
+        while True:
+            (priority, sequence, key, entry) = self._ready.get()
+            if entry is None:
+                return
+            with self._lock:
+                # the refresh schedules the next one when it caches
+                entry.scheduled = False
+                (function, args) = entry.refresh
+            try:
+                weather_data = function(*args, timeout = self.timeout)
+            except Exception:
+                weather_data = {'error': sys.exc_info()[1]}
+            with self._lock:
+                if 'error' in weather_data:
+                    self.errors += 1
+                else:
+                    self.refreshed += 1
+
+
+class _PrefetchEntry(object):
+    """Access score and (refresh function, arguments) of a report in
+    Prefetcher"""
+    __slots__ = ('score', 'updated', 'refresh', 'scheduled')
+
+    def __init__(self):
+        self.score = 0.0
+        self.updated = 0.0
+        self.refresh = None
+        self.scheduled = False
+
+
+# refresh-ahead of popular cached reports, disabled by default
+prefetcher = None
+
+
+class ValidatorCache(object):
+    """Remembers the validators (ETag and Last-Modified headers) of the
+    last response for every report, together with the parsed report.
+
+    The next request for the report is sent as a conditional GET. When
+    the server answers 304 Not Modified, the remembered report is returned
+    without downloading or parsing the body again. To enable it, assign an
+    instance to the module attribute validator_cache:
+
+      pywapi.validator_cache = pywapi.ValidatorCache()
+
+    At most max_entries reports are remembered, the least recently used
+    are dropped first. Remembered reports are shared between callers and
+    must not be modified.
+
+    """
+
+    def __init__(self, max_entries = VALIDATOR_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.not_modified = 0
+        self.modified = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def request_headers(self, key, url):
+        """Returns the conditional request headers for the report under
+        key, and the remembered report (None if there is none)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != url:
+                return ({}, None)
+            # re-insert as most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+        (url, etag, last_modified, weather_data) = entry
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        return (headers, weather_data)
+
+    def put(self, key, url, response, weather_data):
+        """Remembers the validators of response and the report parsed
+        from it. Errors and responses without validators are ignored."""
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+        with self._lock:
+            self.modified += 1
+            if 'error' in weather_data or \
+               (etag is None and last_modified is None):
+                self._entries.pop(key, None)
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (url, etag, last_modified, weather_data)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+    def count_not_modified(self):
+        """Counts a 304 answer to a conditional request"""
+        with self._lock:
+            self.not_modified += 1
+
+    def clear(self):
+        """Forgets all reports. The counters are left untouched."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Returns a dictionary with the number of remembered reports and
+        of 304 and other answers"""
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'not_modified': self.not_modified,
+                    'modified': self.modified}
+
+
+# validators of the last responses, disabled by default
+validator_cache = None
+
+
+def _cache_get(key):
+    cache = response_cache
+    if cache is None:
+        return None
+    return cache.get(key)
+
+def _cache_put(key, weather_data, suggested_ttl = None):
+    cache = response_cache
+    if cache is None:
+        return
+    ttl = cache.provider_ttl(key[0], suggested_ttl)
+    cache.put(key, weather_data, ttl)
+    refresher = prefetcher
+    if refresher is not None and ttl > 0:
+        refresher.cached(key, ttl)
+
+def _cache_report(cache_key, weather_data):
+    """Caches a freshly parsed report, unless it is an error"""
+    if 'error' in weather_data:
+        return
+    suggested_ttl = None
+    if cache_key[0] == 'noaa':
+        suggested_ttl = _noaa_pickup_period(weather_data)
+    _cache_put(cache_key, weather_data, suggested_ttl)
+
+def _get_report(cache_key, url, parse, connect_error, typed = False,
+                timeout = None):
+    """Returns the cached report for cache_key, or fetches url and
+    parses the response with parse
+
+    Parameters:
+      cache_key: key of the report, see ResponseCache
+      url: URL of the report
+      parse: function extracting the report from the response
+      connect_error: error message if the server can't be reached
+      typed: passed on to parse, typed reports are cached separately
+      timeout: time allowed for the fetch, see Deadline.from_timeout()
+
+    """
+    if typed:
+        cache_key = cache_key + ('typed',)
+    weather_data = _cache_get(cache_key)
+    recorder = metrics
+    if recorder is not None and response_cache is not None:
+        recorder.increment(cache_key[0], 'cache_hits' if weather_data
+                           is not None else 'cache_misses')
+    refresher = prefetcher
+    if refresher is not None and response_cache is not None:
+        refresher.record(cache_key, _refresh_report, cache_key, url, parse,
+                         connect_error, typed)
+    if weather_data is not None:
+        return weather_data
+    deadline = Deadline.from_timeout(timeout)
+    flight = single_flight
+    if flight is None:
+        return _fetch_report(cache_key, url, parse, connect_error, typed,
+                             deadline)
+    try:
+        return flight.do(cache_key,
+                         lambda: _fetch_report(cache_key, url, parse,
+                                               connect_error, typed,
+                                               deadline),
+                         deadline)
+    except _url_errors.URLError:
+        _count_error(cache_key[0], sys.exc_info()[1])
+        return {'error': connect_error}
+
+def _refresh_report(cache_key, url, parse, connect_error, typed,
+                    timeout = None):
+    """Fetches and caches a report again, for the Prefetcher"""
+    deadline = Deadline.from_timeout(timeout)
+    flight = single_flight
+    if flight is None:
+        return _fetch_report(cache_key, url, parse, connect_error, typed,
+                             deadline)
+    try:
+        return flight.do(cache_key, lambda: _fetch_report(
+            cache_key, url, parse, connect_error, typed, deadline), deadline)
+    except _url_errors.URLError:
+        _count_error(cache_key[0], sys.exc_info()[1])
+        return {'error': connect_error}
+
+def _fetch_report(cache_key, url, parse, connect_error, typed,
+                  deadline = None):
+    """Fetches url, parses the response with parse and caches the report"""
+    validators = validator_cache
+    (headers, previous) = (None, None)
+    if validators is not None:
+        (headers, previous) = validators.request_headers(cache_key, url)
+    try:
+        response = _fetch_with_retries(
+            cache_key[0], lambda: _fetch_response(url, headers, deadline),
+            deadline)
+        if deadline is not None:
+            # what is left of the read budget goes to decoding and parsing
+            deadline.check()
+    except _url_errors.URLError:
+        _count_error(cache_key[0], sys.exc_info()[1])
+        return {'error': connect_error}
+    weather_data = _report_from_response(validators, cache_key, url,
+                                         response, previous, parse, typed)
+    _cache_report(cache_key, weather_data)
+    return weather_data
+
+
+class SingleFlight(object):
+    """Coalesces concurrent identical fetches: while a report is being
+    fetched, other threads asking for the same report wait for that fetch
+    and get its result instead of sending their own request.
+
+    Disabled by default. To enable it, assign an instance to the module
+    attribute single_flight:
+
+      pywapi.single_flight = pywapi.SingleFlight()
+
+    Reports are keyed like in ResponseCache, by provider, location and
+    units. The waiting callers share the report and must not modify it.
+
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, deadline = None):
+        """Returns function(), or the result of the call of function
+        already in progress for key. Exceptions are raised in all callers
+        waiting for the call. A caller waiting for another call raises
+        URLError when its Deadline deadline runs out."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            if deadline is None:
+                call.done.wait()
+            elif not call.done.wait(deadline.remaining()):
+                raise _url_errors.URLError(socket.timeout('timed out'))
+            if call.exc_info is not None:
+                raise call.exc_info[1]
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        """Returns a dictionary with the number of calls made and of
+        callers that shared the result of another call"""
+        with self._lock:
+            return {'in_flight': len(self._calls), 'calls': self.calls,
+                    'shared': self.shared}
+
+
+class _Call(object):
+    """A call in progress in SingleFlight"""
+    __slots__ = ('done', 'result', 'exc_info')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+# coalescing of concurrent identical fetches, disabled by default
+single_flight = None
+
+
+class RetryPolicy(object):
+    """Retries of fetches that failed for a transient reason: the server
+    could not be reached, the connection broke, or the server answered
+    429 Too Many Requests or a 5xx status.
+
+    Disabled by default. To enable it, assign an instance to the module
+    attribute retry_policy:
+
+      pywapi.retry_policy = pywapi.RetryPolicy()
+
+    A call makes at most max_attempts attempts. Before retry n (counted
+    from 0) it sleeps a random time between 0 and
+    min(max_delay, base_delay * 2 ** n) seconds ("full jitter"), so that
+    callers that failed together do not retry together. No retry is
+    made that would not fit in the timeout of the call.
+
+    """
+
+    def __init__(self, max_attempts = RETRY_MAX_ATTEMPTS,
+                 base_delay = RETRY_BASE_DELAY,
+                 max_delay = RETRY_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """Returns the seconds to sleep before retry number attempt"""
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** attempt))
+
+    def retryable(self, error):
+        """Returns whether a URLError is worth retrying"""
+        return _transient_error(error)
+
+
+class CircuitBreaker(object):
+    """Circuit breaker of one provider.
+
+    The circuit opens after failure_threshold consecutive transient
+    failures (see RetryPolicy). While it is open, calls fail at once
+    without contacting the provider. After reset_timeout seconds, one
+    trial call is let through: the circuit closes again if it succeeds,
+    and stays open for another reset_timeout seconds if it fails. The
+    breaker is shared by all threads and must be given the outcome of
+    every call it allowed.
+
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns whether a call may go to the provider now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.time()
+            if now - self._opened_at >= self.reset_timeout:
+                # let a single trial call through
+                self.state = self.HALF_OPEN
+                self._opened_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or \
+               (self.state == self.CLOSED and
+                self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self._opened_at = time.time()
+                self.opened += 1
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures,
+                    'opened': self.opened, 'rejected': self.rejected}
+
+
+class CircuitBreakers(object):
+    """The CircuitBreakers of the providers, created on first use with
+    the given parameters.
+
+    Disabled by default. To enable it, assign an instance to the module
+    attribute circuit_breakers:
+
+      pywapi.circuit_breakers = pywapi.CircuitBreakers()
+
+    The providers are 'weather_com', 'yahoo' and 'noaa' for reports, and
+    'weather_com_search' and 'yahoo_search' for location searches.
+
+    """
+
+    def __init__(self, failure_threshold = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider):
+        """Returns the CircuitBreaker of provider"""
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(provider, CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout))
+        return breaker
+
+    def stats(self):
+        """Returns the stats of every provider's CircuitBreaker"""
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return dict((provider, breaker.stats())
+                    for (provider, breaker) in breakers)
+
+
+# retries and circuit breakers, disabled by default
+retry_policy = None
+circuit_breakers = None
+
+
+def _check_rate(rate, burst):
+    """Raises ValueError unless rate > 0 and burst >= 1"""
+    if not rate > 0:
+        raise ValueError('rate must be positive, not %r' % (rate,))
+    if not burst >= 1:
+        raise ValueError('burst must be at least 1, not %r' % (burst,))
+
+
+class TokenBucket(object):
+    """Token bucket allowing rate requests per second on average, and
+    bursts of up to burst requests.
+
+    reserve() takes a token even if none is left yet and returns how long
+    the caller must wait before using it, so waiting callers are served in
+    order and the bucket can be shared by threads and asyncio tasks: a
+    thread sleeps, a task awaits asyncio.sleep().
+
+    Raises ValueError unless rate is positive and burst is at least 1.
+
+    """
+
+    def __init__(self, rate = RATE_LIMIT_RATE, burst = RATE_LIMIT_BURST):
+        _check_rate(rate, burst)
+        self.rate = float(rate)
+        self.burst = burst
+        self.requests = 0
+        self.delayed = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._tokens = float(burst)
+        self._updated = _timer()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait = None):
+        """Takes a token and returns the seconds to wait before using it,
+        0 if it can be used at once. Returns None without taking a token
+        if the wait would be longer than max_wait seconds."""
+        with self._lock:
+            now = _timer()
+            tokens = min(self.burst,
+                         self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0
+            if tokens < 1:
+                wait = (1 - tokens) / self.rate
+                if max_wait is not None and wait > max_wait:
+                    self._tokens = tokens
+                    return None
+                self.delayed += 1
+                self.wait_seconds += wait
+                self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            self._tokens = tokens - 1
+            self.requests += 1
+            return wait
+
+    def stats(self):
+        """Returns a dictionary with the number of requests, of requests
+        that had to wait, and the total, mean and longest wait in
+        seconds"""
+        with self._lock:
+            return {'requests': self.requests, 'delayed': self.delayed,
+                    'wait_seconds': self.wait_seconds,
+                    'mean_wait_seconds': self.wait_seconds /
+                                         (self.requests or 1),
+                    'max_wait_seconds': self.max_wait_seconds}
+
+
+class RateLimiter(object):
+    """Per-provider TokenBuckets that pace the requests of all threads and
+    asyncio tasks, so that bulk jobs such as get_everything_from_yahoo()
+    run at a steady rate the provider tolerates instead of being
+    throttled.
+
+    Disabled by default. To enable it, assign an instance to the module
+    attribute rate_limiter:
+
+      pywapi.rate_limiter = pywapi.RateLimiter(rates = {'yahoo': (5, 10)})
+
+    rates maps a provider to its (rate, burst); other providers get rate
+    and burst. The providers are named like in CircuitBreakers. Every
+    request waits for a token of its provider, retries included; a call
+    with a timeout fails at once if the wait would not fit in it.
+
+    Raises ValueError unless every rate is positive and every burst is
+    at least 1.
+
+    """
+
+    def __init__(self, rate = RATE_LIMIT_RATE, burst = RATE_LIMIT_BURST,
+                 rates = None):
+        _check_rate(rate, burst)
+        for (provider_rate, provider_burst) in (rates or {}).values():
+            _check_rate(provider_rate, provider_burst)
+        self.rate = rate
+        self.burst = burst
+        self.rates = dict(rates or {})
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider):
+        """Returns the TokenBucket of provider"""
+        bucket = self._buckets.get(provider)
+        if bucket is None:
+            (rate, burst) = self.rates.get(provider, (self.rate, self.burst))
+            with self._lock:
+                bucket = self._buckets.setdefault(provider,
+                                                  TokenBucket(rate, burst))
+        return bucket
+
+    def stats(self):
+        """Returns the stats of every provider's TokenBucket"""
+        with self._lock:
+            buckets = list(self._buckets.items())
+        return dict((provider, bucket.stats())
+                    for (provider, bucket) in buckets)
+
+
+# pacing of the requests to every provider, disabled by default
+rate_limiter = None
+
+
+def _transient_error(error):
+    """Returns whether a URLError may go away if the request is repeated"""
+    if isinstance(error, _url_errors.HTTPError):
+        return error.code == 429 or error.code >= 500
+    return True
+
+def _fetch_with_retries(provider, fetch, deadline = None):
+    """Returns fetch(), retried following retry_policy, guarded by the
+    circuit breaker of provider and paced by rate_limiter. Raises URLError
+    if all attempts failed or the circuit is open."""
+    policy = retry_policy
+    breaker = _circuit_breaker(provider)
+    attempt = 0
+    while True:
+        _check_circuit(provider, breaker)
+        wait = _rate_limit_wait(provider, deadline)
+        if wait:
+            time.sleep(wait)
+        try:
+            result = fetch()
+        except _url_errors.URLError:
+            error = sys.exc_info()[1]
+            delay = _retry_delay(provider, breaker, policy, error, attempt,
+                                 deadline)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+def _circuit_breaker(provider):
+    breakers = circuit_breakers
+    if breakers is None:
+        return None
+    return breakers.get(provider)
+
+def _check_circuit(provider, breaker):
+    """Raises URLError if the circuit of provider is open"""
+    if breaker is not None and not breaker.allow():
+        recorder = metrics
+        if recorder is not None:
+            recorder.increment(provider, 'circuit_open')
+        raise _url_errors.URLError('Circuit open for %s' % provider)
+
+def _rate_limit_wait(provider, deadline):
+    """Returns the seconds to wait for a token of provider from
+    rate_limiter. Raises URLError if the wait would not fit in deadline."""
+    limiter = rate_limiter
+    if limiter is None:
+        return 0
+    max_wait = None
+    if deadline is not None:
+        max_wait = deadline.remaining()
+    wait = limiter.get(provider).reserve(max_wait)
+    if wait is None:
+        raise _url_errors.URLError(socket.timeout('rate limited'))
+    recorder = metrics
+    if recorder is not None:
+        recorder.observe(provider, 'rate_limit_wait_seconds', wait)
+    return wait
+
+def _retry_delay(provider, breaker, policy, error, attempt, deadline):
+    """Records a failed attempt with the circuit breaker, and returns the
+    seconds to sleep before retrying, None if the error must be raised"""
+    transient = _transient_error(error)
+    if breaker is not None:
+        if transient:
+            breaker.record_failure()
+        else:
+            # the provider answered, it is up
+            breaker.record_success()
+    if policy is None or attempt + 1 >= policy.max_attempts or \
+       not policy.retryable(error):
+        return None
+    delay = policy.delay(attempt)
+    if deadline is not None:
+        remaining = deadline.remaining()
+        if remaining is not None and delay >= remaining:
+            return None
+    recorder = metrics
+    if recorder is not None:
+        recorder.increment(provider, 'retries')
+    return delay
+
+
+def _report_from_response(validators, cache_key, url, response, previous,
+                          parse, typed):
+    """Parses a report response and remembers its validators in the
+    ValidatorCache validators, unless it is None. Returns the previous
+    report if the server answered 304 Not Modified."""
+    recorder = metrics
+    provider = cache_key[0]
+    if recorder is not None:
+        _observe_response(recorder, provider, response)
+    if response.status == 304 and previous is not None:
+        validators.count_not_modified()
+        if recorder is not None:
+            recorder.increment(provider, 'not_modified')
+        return previous
+    weather_data = _parse_response(recorder, provider, response, parse,
+                                   typed)
+    if validators is not None:
+        validators.put(cache_key, url, response, weather_data)
+    return weather_data
+
+def _search_from_response(provider, response, parse):
+    """Parses a location search response, recording it with the metrics
+    hooks under '<provider>_search'"""
+    recorder = metrics
+    name = provider + '_search'
+    if recorder is not None:
+        _observe_response(recorder, name, response)
+    return _parse_response(recorder, name, response, parse)
+
+def _observe_response(recorder, name, response):
+    """Records a request and the transfer of its HTTPResponse"""
+    recorder.increment(name, 'requests')
+    recorder.observe(name, 'connect_seconds', response.connect_time)
+    recorder.observe(name, 'download_seconds', response.download_time)
+    recorder.observe(name, 'response_bytes', len(response.body))
+
+def _parse_response(recorder, name, response, parse, *args):
+    """Returns parse(body, *args) for the body of an HTTPResponse, timing
+    the decoding and the parsing with recorder unless it is None"""
+    if recorder is None:
+        return parse(_recode_body(response), *args)
+    start = _timer()
+    body = _recode_body(response)
+    decoded = _timer()
+    result = parse(body, *args)
+    recorder.observe(name, 'decode_seconds', decoded - start)
+    recorder.observe(name, 'parse_seconds', _timer() - decoded)
+    if 'error' in result:
+        recorder.increment(name, 'errors')
+    return result
+
+def _count_error(provider, error = None):
+    recorder = metrics
+    if recorder is not None:
+        recorder.increment(provider, 'errors')
+        if isinstance(getattr(error, 'reason', None), socket.timeout):
+            recorder.increment(provider, 'timeouts')
+
+
+class MetricsCollector(object):
+    """In-memory collector for the metrics hooks of the report functions.
+
+    The get_weather_from_* functions report what happens during a fetch to
+    the object assigned to the module attribute metrics, which is None by
+    default. Any object with these two methods can be used, e.g. to
+    forward the metrics to a monitoring system:
+
+      increment(provider, name): counts an event. Names are 'requests',
+      'cache_hits', 'cache_misses', 'not_modified', 'errors', 'timeouts'
+      (errors because the timeout of the call ran out), 'retries' and
+      'circuit_open' (calls rejected by an open CircuitBreaker).
+
+      observe(provider, name, value): records a measurement. Names are
+      'connect_seconds', 'download_seconds', 'decode_seconds' (charset
+      re-encoding), 'parse_seconds', 'response_bytes' and
+      'rate_limit_wait_seconds' (see RateLimiter).
+
+    provider is 'weather_com', 'yahoo' or 'noaa', or 'weather_com_search'
+    and 'yahoo_search' for get_loc_id_from_weather_com() and
+    get_woeid_from_yahoo(), whose cache is the LocationCache. The methods
+    are called from the fetching threads and must be thread-safe.
+
+    This collector keeps the counters and every measurement in memory:
+
+      pywapi.metrics = collector = pywapi.MetricsCollector()
+      pywapi.get_weather_from_noaa('KJFK')
+      collector.counters()    # {('noaa', 'requests'): 1, ...}
+      collector.histograms()  # {('noaa', 'parse_seconds'): {...}, ...}
+
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def increment(self, provider, name):
+        key = (provider, name)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def observe(self, provider, name, value):
+        key = (provider, name)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = []
+            values.append(value)
+
+    def counters(self):
+        """Returns the counters keyed by (provider, name)"""
+        with self._lock:
+            return dict(self._counters)
+
+    def values(self, provider, name):
+        """Returns the list of measurements of (provider, name)"""
+        with self._lock:
+            return list(self._values.get((provider, name), ()))
+
+    def histograms(self):
+        """Returns a summary of the measurements keyed by (provider, name):
+        a dictionary with count, sum, min, max, p50, p90 and p99"""
+        with self._lock:
+            items = [(key, sorted(values))
+                     for (key, values) in self._values.items()]
+        summaries = {}
+        for (key, values) in items:
+            last = len(values) - 1
+            summaries[key] = {
+                'count': len(values), 'sum': sum(values),
+                'min': values[0], 'max': values[-1],
+                'p50': values[int(round(0.50 * last))],
+                'p90': values[int(round(0.90 * last))],
+                'p99': values[int(round(0.99 * last))]}
+        return summaries
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._values.clear()
+
+
+# receiver of the metrics hooks, disabled by default, see MetricsCollector
+metrics = None
+
+
+class CompactReport(object):
+    """Read-only report with a small memory footprint, returned by the
+    get_weather_from_* functions when called with compact = True.
+
+    Supports the reading part of the dictionary interface: report[key],
+    get(), in, len(), iteration, keys(), values() and items(). Nested
+    dictionaries are CompactReports as well and lists become tuples.
+    Reports with the same keys share one key index, and short strings
+    such as units, numbers and condition text are stored only once, see
+    COMPACT_INTERN_MAX_LENGTH. Use to_dict() to get an ordinary
+    dictionary, e.g. to serialize a report.
+
+    """
+
+    __slots__ = ('_shape', '_values')
+
+    def __init__(self, shape, values):
+        self._shape = shape
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._shape.index[key]]
+
+    def get(self, key, default = None):
+        index = self._shape.index.get(key)
+        if index is None:
+            return default
+        return self._values[index]
+
+    def __contains__(self, key):
+        return key in self._shape.index
+
+    def __iter__(self):
+        return iter(self._shape.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def keys(self):
+        return list(self._shape.keys)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return list(zip(self._shape.keys, self._values))
+
+    def __eq__(self, other):
+        if isinstance(other, CompactReport):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'CompactReport(%r)' % (self.to_dict(),)
+
+    def to_dict(self):
+        """Returns the report as nested dictionaries and lists"""
+        return _expand_report(self)
+
+
+class _ReportShape(object):
+    """Keys of a CompactReport and the position of each key"""
+
+    __slots__ = ('keys', 'index')
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.index = dict((key, i) for (i, key) in enumerate(keys))
+
+
+_report_shapes = {}
+_interned_strings = {}
+
+def compact_report(weather_data):
+    """Converts a report dictionary, as returned by the get_weather_from_*
+    functions, to a CompactReport. Errors are returned unchanged."""
+    if 'error' in weather_data:
+        return weather_data
+    return _compact_value(weather_data)
+
+def _compact_value(value):
+    if isinstance(value, dict):
+        keys = tuple(value)
+        shape = _report_shapes.get(keys)
+        if shape is None:
+            shape = _report_shapes.setdefault(keys, _ReportShape(keys))
+        return CompactReport(shape,
+                             tuple([_compact_value(value[key])
+                                    for key in keys]))
+    if isinstance(value, list):
+        return tuple([_compact_value(item) for item in value])
+    if (isinstance(value, (str, unicode)) and
+            len(value) <= COMPACT_INTERN_MAX_LENGTH):
+        interned = _interned_strings.get(value)
+        if interned is not None:
+            return interned
+        if len(_interned_strings) < COMPACT_INTERN_MAX_ENTRIES:
+            return _interned_strings.setdefault(value, value)
+    return value
+
+def _expand_report(value):
+    if isinstance(value, CompactReport):
+        return dict((key, _expand_report(item))
+                    for (key, item) in zip(value._shape.keys, value._values))
+    if isinstance(value, tuple):
+        return [_expand_report(item) for item in value]
+    return value
+
+def _report_result(weather_data, compact):
+    """Returns a report in the form requested by the caller"""
+    if compact:
+        return compact_report(weather_data)
+    return weather_data
+
+
+class LocationCache(object):
+    """Persistent cache of location searches, stored in an SQLite database.
+
+    Place names almost never change their location ID or WOEID, so the
+    results of get_loc_id_from_weather_com() and get_woeid_from_yahoo()
+    can be kept across process restarts. The cache is disabled by
+    default. To enable it, assign an instance to the module attribute
+    location_cache:
+
+      pywapi.location_cache = pywapi.LocationCache()
+
+    Results are keyed by provider ('weather_com' or 'yahoo') and the
+    normalized search string: transliterated to ASCII when unidecode is
+    installed, lower case, with runs of whitespace collapsed. Entries
+    expire after ttl seconds. Error results are never cached.
+
+    Parameters:
+      path: file name of the database, ':memory:' for a cache that is not
+      persisted. Defaults to locations.sqlite in the user cache directory.
+      ttl: seconds an entry stays valid, LOCATION_CACHE_TTL by default
+
+    """
+
+    def __init__(self, path = None, ttl = LOCATION_CACHE_TTL):
+        try:
+            import sqlite3
+        except ImportError:
+            raise RuntimeError('LocationCache requires the sqlite3 module')
+        if path is None:
+            path = _default_location_cache_path()
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread = False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS locations ('
+                             'provider TEXT NOT NULL, '
+                             'search TEXT NOT NULL, '
+                             'expires REAL NOT NULL, '
+                             'result TEXT NOT NULL, '
+                             'PRIMARY KEY (provider, search))')
+
+    def get(self, provider, search_string):
+        """Returns the cached search result for provider and
+        search_string, or None if there is none or it has expired"""
+        key = normalize_search_string(search_string)
+        with self._lock:
+            row = self._db.execute('SELECT expires, result FROM locations '
+                                   'WHERE provider = ? AND search = ?',
+                                   (provider, key)).fetchone()
+            if row is None or row[0] <= time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+        return _decode_search_result(row[1])
+
+    def put(self, provider, search_string, result, ttl = None):
+        """Stores a search result in the {'count': n, i: (id, name)}
+        format. Error results are ignored."""
+        self.preload(provider, [(search_string, result)], ttl)
+
+    def preload(self, provider, results, ttl = None):
+        """Stores many search results at once, in a single transaction.
+
+        Parameters:
+          provider: 'weather_com' or 'yahoo'
+          results: a dictionary of search results keyed by search string,
+          or an iterable of (search_string, result) pairs. Results are in
+          the {'count': n, i: (id, name)} format; errors are skipped.
+          ttl: seconds the entries stay valid, self.ttl by default
+
+        Returns:
+          count: the number of entries stored
+
+        """
+        if ttl is None:
+            ttl = self.ttl
+        if hasattr(results, 'items'):
+            results = results.items()
+        expires = time.time() + ttl
+        rows = [(provider, normalize_search_string(search_string), expires,
+                 _encode_search_result(result))
+                for (search_string, result) in results
+                if 'error' not in result]
+        with self._lock:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO locations '
+                                     'VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def purge(self):
+        """Removes the expired entries. Returns the number removed."""
+        with self._lock:
+            with self._db:
+                cursor = self._db.execute('DELETE FROM locations '
+                                          'WHERE expires <= ?', (time.time(),))
+        return cursor.rowcount
+
+    def clear(self):
+        """Removes all entries. The counters are left untouched."""
+        with self._lock:
+            with self._db:
+                self._db.execute('DELETE FROM locations')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM locations'
+                                    ).fetchone()[0]
+
+    def stats(self):
+        """Returns a dictionary with the cache counters"""
+        return {'entries': len(self), 'hits': self.hits,
+                'misses': self.misses}
+
+
+# cache consulted by the location search functions, disabled by default
+location_cache = None
+
+
+def _default_location_cache_path():
+    """Returns the path of locations.sqlite in the user cache directory,
+    creating the directory if needed"""
+    if sys.platform.startswith('win'):
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = (os.environ.get('XDG_CACHE_HOME') or
+                os.path.join(os.path.expanduser('~'), '.cache'))
+    directory = os.path.join(base, 'pywapi')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return os.path.join(directory, 'locations.sqlite')
+
+def normalize_search_string(search_string):
+    """Returns the form of a place name search used as cache key:
+    transliterated to ASCII when unidecode is installed, lower case and
+    with runs of whitespace collapsed to one space"""
+    search_string = _transliterate(search_string)
+    return ' '.join(search_string.lower().split())
+
+def _transliterate(search_string):
+    """Converts a string to ASCII if unidecode is installed"""
+    try:
+        from unidecode import unidecode
+    except ImportError:
+        return search_string
+    return unidecode(search_string)
+
+def _encode_search_result(result):
+    return json.dumps([result[i] for i in xrange(result['count'])])
+
+def _decode_search_result(encoded):
+    places = json.loads(encoded)
+    result = dict((i, tuple(place)) for (i, place) in enumerate(places))
+    result['count'] = len(places)
+    return result
+
+def _location_cache_get(provider, search_string):
+    cache = location_cache
+    if cache is None:
+        return None
+    result = cache.get(provider, search_string)
+    recorder = metrics
+    if recorder is not None:
+        recorder.increment(provider + '_search', 'cache_hits' if result
+                           is not None else 'cache_misses')
+    return result
+
+def _location_cache_put(provider, search_string, result):
+    cache = location_cache
+    if cache is None or 'error' in result:
+        return
+    cache.put(provider, search_string, result)
+
+class Gazetteer(object):
+    """Local index of place names, for location searches without a round
+    trip to the provider.
+
+    Places are (id, name) pairs, e.g. Weather.com location IDs or Yahoo!
+    WOEIDs. Every word of a name starts a key of a sorted array, so a
+    search string matches the names containing words that start with it:
+    'los ang' matches 'Los Angeles, CA' and 'East Los Angeles, CA'. When
+    nothing matches, the search is repeated allowing a few typos.
+
+    To answer get_loc_id_from_weather_com() or get_woeid_from_yahoo()
+    from a gazetteer, register it under the provider name; the provider
+    is still queried when the gazetteer has no match:
+
+      pywapi.gazetteers['weather_com'] = pywapi.Gazetteer.load('locids.tsv')
+
+    Parameters:
+      places: an iterable of (id, name) pairs
+
+    """
+
+    def __init__(self, places = ()):
+        self.ids = []
+        self.names = []
+        entries = []
+        for (place_id, name) in places:
+            index = len(self.ids)
+            self.ids.append(place_id)
+            self.names.append(name)
+            words = _gazetteer_words(name)
+            for i in xrange(len(words)):
+                entries.append((' '.join(words[i:]), index))
+            entries.append((' '.join(_gazetteer_words(place_id)), index))
+        entries.sort()
+        self._keys = [key for (key, index) in entries]
+        self._places = array('i', [index for (key, index) in entries])
+
+    @classmethod
+    def load(cls, path):
+        """Loads a gazetteer from a UTF-8 text file with one place per
+        line, the id and the name separated by a tab. Empty lines and
+        lines starting with # are skipped."""
+        with io.open(path, encoding = 'utf-8') as f:
+            return cls(tuple(line.rstrip('\r\n').split('\t', 1))
+                       for line in f
+                       if line.strip() and not line.startswith('#'))
+
+    def save(self, path):
+        """Writes the places to a file that load() can read"""
+        with io.open(path, 'w', encoding = 'utf-8') as f:
+            for (place_id, name) in zip(self.ids, self.names):
+                f.write(u'%s\t%s\n' % (place_id, name))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, search_string, limit = 10, max_distance = None):
+        """Finds the places matching a search string.
+
+        Parameters:
+          search_string: beginning of a place name, of one of its words
+          or of a place id
+          limit: the maximum number of places returned
+          max_distance: the number of typos (inserted, deleted or changed
+          letters) allowed when nothing matches exactly. By default 0 for
+          up to 3 letters, 1 for up to 6 letters and 2 otherwise.
+
+        Returns:
+          loc_id_data: A dictionary of tuples in the following format:
+          {'count': 2, 0: (ID1, Placename1), 1: (ID2, Placename2)}
+          or {'error': ...} if no place matches
+
+        """
+        query = ' '.join(_gazetteer_words(search_string))
+        if not query:
+            return {'error': 'No matching places found'}
+        places = self._prefix_matches(query)
+        if not places:
+            if max_distance is None:
+                max_distance = (len(query) > 3) + (len(query) > 6)
+            if max_distance > 0:
+                places = self._fuzzy_matches(query, max_distance)
+        if not places:
+            return {'error': 'No matching places found'}
+
+        # shortest names first, they are the closest to the search string
+        places = sorted(places,
+                        key = lambda index: (len(self.names[index]),
+                                             self.names[index]))[:limit]
+        result = {'count': len(places)}
+        for (i, index) in enumerate(places):
+            result[i] = (self.ids[index], self.names[index])
+        return result
+
+    def _prefix_matches(self, query):
+        start = bisect_left(self._keys, query)
+        end = bisect_left(self._keys, query + u'\uffff', start)
+        return set(self._places[start:end])
+
+    def _fuzzy_matches(self, query, max_distance):
+        """Returns the places with a key starting with a string at most
+        max_distance edits away from query.
+
+        The sorted keys are walked as a trie: the rows of the edit distance
+        table of a key prefix are reused for the next key sharing it, and
+        all keys sharing a prefix are skipped together once the prefix
+        matches or can no longer match.
+        """
+        keys = self._keys
+        places = set()
+        first_row = list(xrange(len(query) + 1))
+        rows = [first_row]
+        previous = u''
+        i = 0
+        while i < len(keys):
+            key = keys[i]
+            # reuse the rows of the prefix shared with the previous key
+            common = 0
+            limit = min(len(key), len(previous), len(rows) - 1)
+            while common < limit and key[common] == previous[common]:
+                common += 1
+            del rows[common + 1:]
+            previous = key
+            skip_prefix = None
+            for depth in xrange(common, len(key)):
+                row = rows[-1]
+                char = key[depth]
+                new_row = [row[0] + 1]
+                for j in xrange(1, len(query) + 1):
+                    new_row.append(min(new_row[j - 1] + 1, row[j] + 1,
+                                       row[j - 1] + (query[j - 1] != char)))
+                rows.append(new_row)
+                if new_row[-1] <= max_distance:
+                    skip_prefix = key[:depth + 1]
+                    end = bisect_left(keys, skip_prefix + u'\uffff', i)
+                    places.update(self._places[i:end])
+                    break
+                if min(new_row) > max_distance:
+                    skip_prefix = key[:depth + 1]
+                    break
+            if skip_prefix is None:
+                i += 1
+            else:
+                i = bisect_left(keys, skip_prefix + u'\uffff', i + 1)
+        return places
+
+
+# gazetteers searched before querying a provider, keyed by provider name
+# ('weather_com' or 'yahoo')
+gazetteers = {}
+
+
+def _gazetteer_words(name):
+    """Returns the normalized words of a place name"""
+    return re.sub(r'[\W_]+', ' ', normalize_search_string(name),
+                  flags = re.UNICODE).split()
+
+def _gazetteer_search(provider, search_string):
+    gazetteer = gazetteers.get(provider)
+    if gazetteer is None:
+        return None
+    result = gazetteer.search(search_string)
+    if 'error' in result:
+        return None
+    return result
+
+def _search_locations(provider, search_string, url, parse, timeout = None):
+    """Returns the cached result of a location search, or fetches url and
+    parses the response with parse. A registered gazetteer is searched
+    first."""
+    result = _gazetteer_search(provider, search_string)
+    if result is not None:
+        return result
+    result = _location_cache_get(provider, search_string)
+    if result is not None:
+        return result
+    deadline = Deadline.from_timeout(timeout)
+    try:
+        response = _fetch_with_retries(
+            provider + '_search', lambda: _fetch_response(url, None, deadline),
+            deadline)
+        if deadline is not None:
+            deadline.check()
+    except _url_errors.URLError:
+        _count_error(provider + '_search', sys.exc_info()[1])
+        return {'error': 'Could not connect to server'}
+    result = _search_from_response(provider, response, parse)
+    _location_cache_put(provider, search_string, result)
+    return result
+
+    
+class XMLSelector(object):
+    """Describes an element to extract with xml_extract()
+
+    A selector matches the first descendant element with the given tag
+    inside the element matched by its parent selector, the same element
+    that getElementsByTagName(tag)[0] would return. With many = True it
+    matches every such descendant instead.
 
-YAHOO_WEATHER_URL    = 'http://xml.weather.yahoo.com/forecastrss/%s_%s.xml'
-YAHOO_WEATHER_NS     = 'http://xml.weather.yahoo.com/ns/rss/1.0'
+    Parameters:
+      tag: tag name ('geo:lat'), or a tuple (namespace, local name)
+      children: selectors to match inside the matched element
+      many: whether to match every descendant instead of the first one
+      attrs: tuple of attributes to extract from the matched element
 
-NOAA_WEATHER_URL     = 'http://www.weather.gov/xml/current_obs/%s.xml'
+    """
+    __slots__ = ('tag', 'children', 'many', 'attrs', 'by_tag')
 
-WEATHER_COM_URL      = 'http://wxdata.weather.com/wxdata/weather/local/%s?' + \
-                       'unit=%s&dayf=5&cc=*'
+    def __init__(self, tag, children = (), many = False, attrs = ()):
+        self.tag = tag
+        self.children = tuple(children)
+        self.many = many
+        self.attrs = tuple(attrs)
+        self.by_tag = dict((child.tag, child) for child in self.children)
 
-LOCID_SEARCH_URL     = 'http://wxdata.weather.com/wxdata/search/search?where=%s'
 
-WOEID_SEARCH_URL     = 'http://query.yahooapis.com/v1/public/yql'
-WOEID_QUERY_STRING   = 'select line1, line2, line3, line4, ' + \
-                       'woeid from geo.placefinder where text="%s"'
+class XMLMatch(object):
+    """Element matched by an XMLSelector
 
-#WXUG_BASE_URL        = 'http://api.wunderground.com/auto/wui/geo'
-#WXUG_FORECAST_URL    = WXUG_BASE_URL + '/ForecastXML/index.xml?query=%s'
-#WXUG_CURRENT_URL     = WXUG_BASE_URL + '/WXCurrentObXML/index.xml?query=%s'
-#WXUG_GEOLOOKUP_URL   = WXUG_BASE_URL + '/GeoLookupXML/index.xml?query=%s'
-#WXUG_ALERTS_URL      = WXUG_BASE_URL + '/AlertsXML/index.xml?query=%s'
+    Attributes:
+      text: data of the first child node if it is a text or CDATA node,
+            otherwise None
+      has_children: whether the element has any child nodes
+      attrs: dictionary of the attributes requested by the selector.
+             Missing attributes are empty strings.
 
+    """
+    __slots__ = ('text', 'has_children', 'attrs', 'found')
 
+    def __init__(self):
+        self.text = None
+        self.has_children = False
+        self.attrs = None
+        self.found = {}
 
-class WindUnits:
-    """Class for available wind unit systems"""
-    MPS = 1
-    MPH = 2
-    BEAUFORT = 3
-    KPH = 4
-    KNOTS = 5
+    def first(self, tag):
+        """Returns the match of the child selector with the given tag, or
+        None if no such element exists"""
+        return self.found.get(tag)
 
-    
-def get_weather_from_weather_com(location_id, units = 'metric'):
+    def all(self, tag):
+        """Returns the list of matches of a child selector with many = True"""
+        return self.found.get(tag, [])
+
+    def text_or_empty(self):
+        """Returns the text of the element, or an empty string"""
+        if self.text is None:
+            return unicode('')
+        return self.text
+
+    @staticmethod
+    def child_text(match, tag):
+        """Returns the text of the child selector of match with the given
+        tag, or an empty string if match or the child is missing or has no
+        text"""
+        if match is None:
+            return unicode('')
+        child = match.found.get(tag)
+        if child is None or child.text is None:
+            return unicode('')
+        return child.text
+
+
+class XMLPlan(object):
+    """A list of XMLSelectors compiled for xml_extract()
+
+    Compiling a plan once and reusing it for every document saves building
+    the selectors again, and lets the extractor skip elements whose tag
+    does not appear anywhere in the plan.
+
+    """
+    __slots__ = ('root', 'tags')
+
+    def __init__(self, selectors):
+        self.root = XMLSelector(None, selectors)
+        self.tags = set()
+        stack = list(self.root.children)
+        while stack:
+            selector = stack.pop()
+            self.tags.add(selector.tag)
+            stack.extend(selector.children)
+
+
+class XMLExtractor(object):
+    """Incremental, event-based extraction of the elements described by an
+    XMLPlan (or a list of XMLSelectors). Only the selected values are kept;
+    no tree is built for the document, and every element is visited once.
+
+    Feed the document with feed(), in as many pieces as needed, then call
+    close() to get the XMLMatch of the document, whose children are the
+    matches of the top-level selectors.
+
+    """
+
+    def __init__(self, plan):
+        if not isinstance(plan, XMLPlan):
+            plan = XMLPlan(plan)
+        self._plan_tags = plan.tags
+        self.document = XMLMatch()
+        self._depth = 0
+        # open matched elements whose selector has children, as
+        # (depth, selector, match), outermost first
+        self._scopes = [(0, plan.root, self.document)]
+        # matches whose first child node is not known yet
+        self._pending = []
+        # matches collecting the data of their first child node
+        self._collecting = []
+        self._parts = []
+        self._collecting_cdata = False
+        self._in_cdata = False
+        self._names = {}
+        parser = expat.ParserCreate(namespace_separator = ' ')
+        parser.namespace_prefixes = True
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start_element
+        parser.EndElementHandler = self._end_element
+        parser.CharacterDataHandler = self._character_data
+        parser.StartCdataSectionHandler = self._start_cdata
+        parser.EndCdataSectionHandler = self._end_cdata
+        parser.CommentHandler = self._other_node
+        parser.ProcessingInstructionHandler = self._other_node
+        self._parser = parser
+
+    def feed(self, data):
+        """Parses the next piece of the document"""
+        self._parser.Parse(data, False)
+
+    def close(self):
+        """Finishes parsing and returns the XMLMatch of the document"""
+        self._parser.Parse(b'', True)
+        # break the reference cycle through the handlers
+        self._parser = None
+        return self.document
+
+    def _split_name(self, name):
+        # expat reports 'uri local prefix', 'uri local' or 'local'
+        parts = name.split(' ')
+        if len(parts) == 3:
+            names = ('%s:%s' % (parts[2], parts[1]), (parts[0], parts[1]))
+        elif len(parts) == 2:
+            names = (parts[1], (parts[0], parts[1]))
+        else:
+            names = (name, (None, name))
+        # only keep the forms of the name that the plan refers to
+        keys = tuple(key for key in names if key in self._plan_tags)
+        self._names[name] = keys
+        return keys
+
+    def _first_node_found(self):
+        for match in self._pending:
+            match.has_children = True
+        self._pending = []
+
+    def _finish_text(self):
+        text = ''.join(self._parts)
+        for match in self._collecting:
+            match.text = text
+        self._collecting = []
+        self._parts = []
+
+    def _start_element(self, name, attrs):
+        if self._pending:
+            self._first_node_found()
+        if self._collecting:
+            self._finish_text()
+        self._depth += 1
+        try:
+            keys = self._names[name]
+        except KeyError:
+            keys = self._split_name(name)
+        if not keys:
+            return
+        scopes = self._scopes
+        for i in xrange(len(scopes)):
+            (depth, selector, match) = scopes[i]
+            for key in keys:
+                child = selector.by_tag.get(key)
+                if child is not None:
+                    break
+            else:
+                continue
+            if child.many:
+                new_match = XMLMatch()
+                match.found.setdefault(child.tag, []).append(new_match)
+            elif child.tag in match.found:
+                continue
+            else:
+                new_match = XMLMatch()
+                match.found[child.tag] = new_match
+            if child.attrs:
+                new_match.attrs = dict((attr, attrs.get(attr, unicode('')))
+                                       for attr in child.attrs)
+            if child.children:
+                scopes.append((self._depth, child, new_match))
+            self._pending.append(new_match)
+
+    def _end_element(self, name):
+        if self._pending:
+            self._pending = []
+        if self._collecting:
+            self._finish_text()
+        scopes = self._scopes
+        while scopes[-1][0] == self._depth:
+            scopes.pop()
+        self._depth -= 1
+
+    def _character_data(self, data):
+        if self._pending:
+            # the first child node of the pending elements is text
+            self._collecting = self._pending
+            self._pending = []
+            for match in self._collecting:
+                match.has_children = True
+            self._collecting_cdata = self._in_cdata
+            self._parts.append(data)
+        elif self._collecting:
+            if self._collecting_cdata == self._in_cdata:
+                self._parts.append(data)
+            else:
+                self._finish_text()
+
+    def _start_cdata(self):
+        self._in_cdata = True
+        # every CDATA section is a node of its own
+        if self._collecting and self._collecting_cdata:
+            self._finish_text()
+
+    def _end_cdata(self):
+        self._in_cdata = False
+        if self._collecting and self._collecting_cdata:
+            self._finish_text()
+
+    def _other_node(self, *args):
+        if self._pending:
+            self._first_node_found()
+        if self._collecting:
+            self._finish_text()
+
+
+def xml_extract(xml_response, plan):
+    """Extracts the elements described by a plan from an XML document
+
+    Parameters:
+      xml_response: the XML document (bytes)
+      plan: an XMLPlan, or a list of XMLSelectors to match in the document
+
+    Returns:
+      the XMLMatch of the document. Use its first() and all() methods to
+      get the matches of the selectors.
+
+    """
+    extractor = XMLExtractor(plan)
+    extractor.feed(xml_response)
+    return extractor.close()
+
+def get_weather_from_weather_com(location_id, units = 'metric',
+                                 compact = False, typed = False,
+                                 timeout = None):
     """Fetches weather report from Weather.com
 
     Parameters:
@@ -102,146 +2467,195 @@ def get_weather_from_weather_com(location_id, units = 'metric'):
       Note that choosing metric units changes all the weather units to metric.
       For example, wind speed will be reported as kilometers per hour and
       barometric pressure as millibars.
- 
+
+      compact: if True, return the report as a CompactReport, which takes
+      less memory than the nested dictionaries.
+
+      typed: if True, numeric fields are converted to int or float, and
+      to None if the provider has no value for them (e.g. 'N/A').
+
+      timeout: seconds allowed for fetching, decoding and parsing the
+      report, or a (connect, read) tuple of seconds allowed for opening
+      the connection and for the rest, see Deadline.from_timeout(). If
+      the time runs out, the report contains only the key 'error'.
+
     Returns:
       weather_data: a dictionary of weather data that exists in XML feed.
     
     """
-    location_id = quote(location_id)
+    (cache_key, url) = _weather_com_request(location_id, units)
+    weather_data = _get_report(cache_key, url, parse_weather_com_response,
+                                 'Could not connect to Weather.com',
+                                 typed, timeout)
+    return _report_result(weather_data, compact)
+
+def _weather_com_request(location_id, units):
+    """Returns the cache key and the URL of a Weather.com report"""
+    location_id = _url_quoting.quote(location_id)
     if units == 'metric':
         unit = 'm'
     elif units == 'imperial' or units == '':    # for backwards compatibility
         unit = ''
     else:
         unit = 'm'      # fallback to metric
-    url = WEATHER_COM_URL % (location_id, unit)
-    try:
-        handler = urlopen(url)
-    except URLError:
-        return {'error': 'Could not connect to Weather.com'}
-    if sys.version > '3':
-        # Python 3
-        content_type = dict(handler.getheaders())['Content-Type']
-    else:
-        # Python 2
-        content_type = handler.info().dict['content-type']
-    try:
-        charset = re.search('charset\=(.*)', content_type).group(1)
-    except AttributeError:
-        charset = 'utf-8'
-    if charset.lower() != 'utf-8':
-        xml_response = handler.read().decode(charset).encode('utf-8')
-    else:
-        xml_response = handler.read()
-    dom = minidom.parseString(xml_response)    
-    handler.close()
+    return (('weather_com', location_id, unit),
+            WEATHER_COM_URL % (location_id, unit))
 
-    try:
-        weather_dom = dom.getElementsByTagName('weather')[0]
-    except IndexError:
-        error_data = {'error': dom.getElementsByTagName('error')[
-            0].getElementsByTagName('err')[0].firstChild.data}
-        dom.unlink()
-        return error_data
+WEATHER_COM_KEY_MAP = {
+    'head':'units', 'ut':'temperature', 'ud':'distance',
+    'us':'speed', 'up':'pressure', 'ur':'rainfall',
+    'loc':'location', 'dnam':'name', 'lat':'lat', 'lon':'lon',
+    'cc':'current_conditions', 'lsup':'last_updated',
+    'obst':'station', 'tmp':'temperature',
+    'flik':'feels_like', 't':'text', 'icon':'icon',
+    'bar':'barometer', 'r':'reading', 'd':'direction',
+    'wind':'wind', 's':'speed', 'gust':'gust', 'hmid':'humidity',
+    'vis':'visibility', 'uv':'uv', 'i':'index', 'dewp':'dewpoint',
+    'moon':'moon_phase', 'hi':'high', 'low':'low', 'sunr':'sunrise',
+    'suns':'sunset', 'bt':'brief_text', 'ppcp':'chance_precip'}
 
-    key_map = {'head':'units', 'ut':'temperature', 'ud':'distance',
-               'us':'speed', 'up':'pressure', 'ur':'rainfall',
-               'loc':'location', 'dnam':'name', 'lat':'lat', 'lon':'lon',
-               'cc':'current_conditions', 'lsup':'last_updated',
-               'obst':'station', 'tmp':'temperature',
-               'flik':'feels_like', 't':'text', 'icon':'icon',
-               'bar':'barometer', 'r':'reading', 'd':'direction',
-               'wind':'wind', 's':'speed', 'gust':'gust', 'hmid':'humidity',
-               'vis':'visibility', 'uv':'uv', 'i':'index', 'dewp':'dewpoint',
-               'moon':'moon_phase', 'hi':'high', 'low':'low', 'sunr':'sunrise',
-               'suns':'sunset', 'bt':'brief_text', 'ppcp':'chance_precip'}
-
-    data_structure = {'head': ('ut', 'ud', 'us', 'up', 'ur'),
-                      'loc': ('dnam', 'lat', 'lon'),
-                      'cc': ('lsup', 'obst', 'tmp', 'flik', 't',
-                             'icon', 'hmid', 'vis', 'dewp')}
-    cc_structure = {'bar': ('r','d'),
-                    'wind': ('s','gust','d','t'),
-                    'uv': ('i','t'),
-                    'moon': ('icon','t')}
-
-    # sanity check, skip missing items
-    try:
-        for (tag, list_of_tags2) in data_structure.items():
-            for tag2 in list_of_tags2:
-                if weather_dom.getElementsByTagName(tag)[0].childNodes.length == 0:
-                    data_structure[tag] = []
-    except IndexError:
-        error_data = {'error': 'Error parsing Weather.com response. Full response: %s' % xml_response}
-        return error_data
+WEATHER_COM_DATA_STRUCTURE = (('head', ('ut', 'ud', 'us', 'up', 'ur')),
+                              ('loc', ('dnam', 'lat', 'lon')),
+                              ('cc', ('lsup', 'obst', 'tmp', 'flik', 't',
+                                      'icon', 'hmid', 'vis', 'dewp')))
+WEATHER_COM_CC_STRUCTURE = (('bar', ('r','d')),
+                            ('wind', ('s','gust','d','t')),
+                            ('uv', ('i','t')),
+                            ('moon', ('icon','t')))
+WEATHER_COM_DAY_TAGS = ('hi', 'low', 'sunr', 'suns')
+WEATHER_COM_PART_TAGS = ('icon', 't', 'bt', 'ppcp', 'hmid')
+WEATHER_COM_WIND_TAGS = ('s', 'gust', 'd', 't')
+WEATHER_COM_TIME_OF_DAY_MAP = {'d':'day', 'n':'night'}
 
-    try:
-        weather_data = {}
-        for (tag, list_of_tags2) in data_structure.items():
-            key = key_map[tag]
-            weather_data[key] = {}
-            for tag2 in list_of_tags2:
-                key2 = key_map[tag2]
-                try:
-                    weather_data[key][key2] = weather_dom.getElementsByTagName(
-                        tag)[0].getElementsByTagName(tag2)[0].firstChild.data
-                except AttributeError:
-                    # current tag has empty value
-                    weather_data[key][key2] = unicode('')
-    except IndexError:
-        error_data = {'error': 'Error parsing Weather.com response. Full response: %s' % xml_response}
-        return error_data
+# numeric fields of a Weather.com report, see decode_fields()
+WEATHER_COM_WIND_TYPES = {'speed': int, 'gust': int, 'direction': int}
+WEATHER_COM_PART_TYPES = {'chance_precip': int, 'humidity': int,
+                          'wind': WEATHER_COM_WIND_TYPES}
+WEATHER_COM_FIELD_TYPES = {
+    'current_conditions': {'temperature': int, 'feels_like': int,
+                           'humidity': int, 'dewpoint': int,
+                           'visibility': float,
+                           'barometer': {'reading': float},
+                           'uv': {'index': int},
+                           'wind': WEATHER_COM_WIND_TYPES},
+    'forecasts': [{'high': int, 'low': int,
+                   'day': WEATHER_COM_PART_TYPES,
+                   'night': WEATHER_COM_PART_TYPES}],
+    'location': {'lat': float, 'lon': float}}
 
-    if weather_dom.getElementsByTagName('cc')[0].childNodes.length > 0:
-        cc_dom = weather_dom.getElementsByTagName('cc')[0]
-        for (tag, list_of_tags2) in cc_structure.items():
-            key = key_map[tag]
-            weather_data['current_conditions'][key] = {}
-            for tag2 in list_of_tags2:
-                key2 = key_map[tag2]
-                try:
-                    weather_data['current_conditions'][key][key2] = cc_dom.getElementsByTagName(
-                        tag)[0].getElementsByTagName(tag2)[0].firstChild.data
-                except AttributeError:
-                    # current tag has empty value
-                    weather_data['current_conditions'][key][key2] = unicode('')
+def _compile_weather_com_plan():
+    """Builds the extraction plan and the (tag, key) pairs used by
+    parse_weather_com_response() from the tables above"""
+    def keyed(tags):
+        return tuple((tag, WEATHER_COM_KEY_MAP[tag]) for tag in tags)
+
+    selectors = []
+    for (tag, list_of_tags2) in WEATHER_COM_DATA_STRUCTURE:
+        children = [XMLSelector(tag2) for tag2 in list_of_tags2]
+        if tag == 'cc':
+            children.extend(XMLSelector(tag2, [XMLSelector(tag3)
+                                               for tag3 in list_of_tags3])
+                            for (tag2, list_of_tags3)
+                            in WEATHER_COM_CC_STRUCTURE)
+        selectors.append(XMLSelector(tag, children))
+    part = XMLSelector('part',
+                       [XMLSelector(tag) for tag in WEATHER_COM_PART_TAGS] +
+                       [XMLSelector('wind', [XMLSelector(tag) for tag
+                                             in WEATHER_COM_WIND_TAGS])],
+                       many = True, attrs = ('p',))
+    day = XMLSelector('day',
+                      [XMLSelector(tag) for tag in WEATHER_COM_DAY_TAGS] +
+                      [part], many = True, attrs = ('t', 'dt'))
+    selectors.append(XMLSelector('dayf', [day]))
+    plan = XMLPlan([XMLSelector('weather', selectors),
+                    XMLSelector('error', [XMLSelector('err')])])
+
+    data_structure = tuple((tag, WEATHER_COM_KEY_MAP[tag], keyed(tags))
+                           for (tag, tags) in WEATHER_COM_DATA_STRUCTURE)
+    cc_structure = tuple((tag, WEATHER_COM_KEY_MAP[tag], keyed(tags))
+                         for (tag, tags) in WEATHER_COM_CC_STRUCTURE)
+    return (plan, data_structure, cc_structure,
+            keyed(WEATHER_COM_DAY_TAGS), keyed(WEATHER_COM_PART_TAGS),
+            keyed(WEATHER_COM_WIND_TAGS))
+
+(_WEATHER_COM_PLAN, _WEATHER_COM_DATA, _WEATHER_COM_CC, _WEATHER_COM_DAY,
+ _WEATHER_COM_PART, _WEATHER_COM_WIND) = _compile_weather_com_plan()
+
+def parse_weather_com_response(xml_response, typed = False):
+    """Extracts the weather report from a Weather.com XML response, as
+    returned by get_weather_from_weather_com()
+
+    Parameters:
+      xml_response: the raw response body (bytes)
+      typed: if True, numeric fields are converted to int or float, and
+      to None if the provider has no value for them (e.g. 'N/A').
+
+    Returns:
+      weather_data: a dictionary of weather data that exists in XML feed.
+
+    """
+    document = xml_extract(xml_response, _WEATHER_COM_PLAN)
+
+    weather_dom = document.first('weather')
+    if weather_dom is None:
+        try:
+            return {'error': document.first('error').first('err').text}
+        except AttributeError:
+            return {'error': 'Error parsing Weather.com response. Full response: %s' % xml_response}
+
+    weather_data = {}
+    for (tag, key, list_of_tags2) in _WEATHER_COM_DATA:
+        element = weather_dom.first(tag)
+        if element is None:
+            error_data = {'error': 'Error parsing Weather.com response. Full response: %s' % xml_response}
+            return error_data
+        weather_data[key] = {}
+        # skip missing items
+        if not element.has_children:
+            continue
+        for (tag2, key2) in list_of_tags2:
+            child = element.first(tag2)
+            if child is None:
+                error_data = {'error': 'Error parsing Weather.com response. Full response: %s' % xml_response}
+                return error_data
+            # current tag may have an empty value
+            weather_data[key][key2] = child.text_or_empty()
+
+    cc_dom = weather_dom.first('cc')
+    if cc_dom.has_children:
+        current_conditions = weather_data['current_conditions']
+        for (tag, key, list_of_tags2) in _WEATHER_COM_CC:
+            current_conditions[key] = {}
+            element = cc_dom.first(tag)
+            for (tag2, key2) in list_of_tags2:
+                current_conditions[key][key2] = \
+                    XMLMatch.child_text(element, tag2)
     
     forecasts = []
-    if len(weather_dom.getElementsByTagName('dayf')) > 0:
-        time_of_day_map = {'d':'day', 'n':'night'}
-        for forecast in weather_dom.getElementsByTagName('dayf')[0].getElementsByTagName('day'):
+    dayf_dom = weather_dom.first('dayf')
+    if dayf_dom is not None:
+        for forecast in dayf_dom.all('day'):
             tmp_forecast = {}
-            tmp_forecast['day_of_week'] = forecast.getAttribute('t')
-            tmp_forecast['date'] = forecast.getAttribute('dt')
-            for tag in ('hi', 'low', 'sunr', 'suns'):
-                key = key_map[tag]
-                try:
-                    tmp_forecast[key] = forecast.getElementsByTagName(
-                    tag)[0].firstChild.data
-                except AttributeError:
-                    # if nighttime on current day, key 'hi' is empty
-                    tmp_forecast[key] = unicode('')
-            for part in forecast.getElementsByTagName('part'):
-                time_of_day = time_of_day_map[part.getAttribute('p')]
-                tmp_forecast[time_of_day] = {}
-                for tag2 in ('icon', 't', 'bt', 'ppcp', 'hmid'):
-                    key2 = key_map[tag2]
-                    try:
-                        tmp_forecast[time_of_day][
-                            key2] = part.getElementsByTagName(tag2)[0].firstChild.data
-                    except AttributeError:
-                        # if nighttime on current day, keys 'icon' and 't' are empty
-                        tmp_forecast[time_of_day][key2] = unicode('')
-                tmp_forecast[time_of_day]['wind'] = {}
-                for tag2 in ('s', 'gust', 'd', 't'):            
-                    key2 = key_map[tag2]
-                    tmp_forecast[time_of_day]['wind'][key2] = part.getElementsByTagName(
-                        'wind')[0].getElementsByTagName(tag2)[0].firstChild.data
+            tmp_forecast['day_of_week'] = forecast.attrs['t']
+            tmp_forecast['date'] = forecast.attrs['dt']
+            for (tag, key) in _WEATHER_COM_DAY:
+                # if nighttime on current day, key 'hi' is empty
+                tmp_forecast[key] = XMLMatch.child_text(forecast, tag)
+            for part in forecast.all('part'):
+                time_of_day = WEATHER_COM_TIME_OF_DAY_MAP[part.attrs['p']]
+                tmp_forecast[time_of_day] = part_data = {}
+                for (tag2, key2) in _WEATHER_COM_PART:
+                    # if nighttime on current day, keys 'icon' and 't' are empty
+                    part_data[key2] = XMLMatch.child_text(part, tag2)
+                part_data['wind'] = {}
+                wind = part.first('wind')
+                for (tag2, key2) in _WEATHER_COM_WIND:
+                    part_data['wind'][key2] = XMLMatch.child_text(wind, tag2)
             forecasts.append(tmp_forecast)
         
     weather_data['forecasts'] = forecasts
-    
-    dom.unlink()
+    if typed:
+        decode_fields(weather_data, WEATHER_COM_FIELD_TYPES)
     return weather_data
 
 def get_weather_from_google(location_id, hl = ''): 		
@@ -257,12 +2671,15 @@ def get_weather_from_google(location_id, hl = ''):
                              'discontinued as of September 2012.'}
     return weather_data
 
-def get_countries_from_google(hl = ''):
+def get_countries_from_google(hl = '', timeout = None):
     """Get list of countries in specified language from Google
     
     Parameters:
       hl: the language parameter (language code). Default value is empty
       string, in this case Google will use English.
+
+      timeout: seconds allowed for the request, or a (connect, read)
+      tuple, see Deadline.from_timeout().
     Returns:
       countries: a list of elements(all countries that exists in XML feed).
       Each element is a dictionary with 'name' and 'iso_code' keys. 
@@ -273,41 +2690,26 @@ def get_countries_from_google(hl = ''):
     url = GOOGLE_COUNTRIES_URL % hl
     
     try:
-        handler = urlopen(url)
-    except URLError:
+        xml_response = _fetch_url(url, Deadline.from_timeout(timeout))
+    except _url_errors.URLError:
         return [{'error':'Could not connect to Google'}]
-    if sys.version > '3':
-        # Python 3
-        content_type = dict(handler.getheaders())['Content-Type']
-    else:
-        # Python 2
-        content_type = handler.info().dict['content-type']
-    try:
-        charset = re.search('charset\=(.*)', content_type).group(1)
-    except AttributeError:
-        charset = 'utf-8'
-    if charset.lower() != 'utf-8':
-        xml_response = handler.read().decode(charset).encode('utf-8')
-    else:
-        xml_response = handler.read()
-    dom = minidom.parseString(xml_response)
-    handler.close()
+    document = xml_extract(xml_response, [
+        XMLSelector('country', [XMLSelector('name', attrs = ('data',)),
+                                XMLSelector('iso_code', attrs = ('data',))],
+                    many = True)])
 
     countries = []
-    countries_dom = dom.getElementsByTagName('country')
+    countries_dom = document.all('country')
     
     for country_dom in countries_dom:
         country = {}
-        country['name'] = country_dom.getElementsByTagName(
-            'name')[0].getAttribute('data')
-        country['iso_code'] = country_dom.getElementsByTagName(
-            'iso_code')[0].getAttribute('data')
+        country['name'] = country_dom.first('name').attrs['data']
+        country['iso_code'] = country_dom.first('iso_code').attrs['data']
         countries.append(country)
     
-    dom.unlink()
     return countries
 
-def get_cities_from_google(country_code, hl = ''):
+def get_cities_from_google(country_code, hl = '', timeout = None):
     """Get list of cities of necessary country in specified language from Google
     
     Parameters:
@@ -316,6 +2718,9 @@ def get_cities_from_google(country_code, hl = ''):
       hl: the language parameter (language code). Default value is empty 
       string, in this case Google will use English.
 
+      timeout: seconds allowed for the request, or a (connect, read)
+      tuple, see Deadline.from_timeout().
+
     Returns:
       cities: a list of elements(all cities that exists in XML feed). Each 
       element is a dictionary with 'name', 'latitude_e6' and 'longitude_e6' 
@@ -326,44 +2731,29 @@ def get_cities_from_google(country_code, hl = ''):
     url = GOOGLE_CITIES_URL % (country_code.lower(), hl)
     
     try:
-        handler = urlopen(url)
-    except URLError:
+        xml_response = _fetch_url(url, Deadline.from_timeout(timeout))
+    except _url_errors.URLError:
         return [{'error':'Could not connect to Google'}]
-    if sys.version > '3':
-        # Python 3
-        content_type = dict(handler.getheaders())['Content-Type']
-    else:
-        # Python 2
-        content_type = handler.info().dict['content-type']
-    try:
-        charset = re.search('charset\=(.*)', content_type).group(1)
-    except AttributeError:
-        charset = 'utf-8'
-    if charset.lower() != 'utf-8':
-        xml_response = handler.read().decode(charset).encode('utf-8')
-    else:
-        xml_response = handler.read()
-    dom = minidom.parseString(xml_response)
-    handler.close()
+    document = xml_extract(xml_response, [
+        XMLSelector('city', [XMLSelector('name', attrs = ('data',)),
+                             XMLSelector('latitude_e6', attrs = ('data',)),
+                             XMLSelector('longitude_e6', attrs = ('data',))],
+                    many = True)])
 
     cities = []
-    cities_dom = dom.getElementsByTagName('city')
+    cities_dom = document.all('city')
     
     for city_dom in cities_dom:
         city = {}
-        city['name'] = city_dom.getElementsByTagName(
-            'name')[0].getAttribute('data')
-        city['latitude_e6'] = city_dom.getElementsByTagName(
-            'latitude_e6')[0].getAttribute('data')
-        city['longitude_e6'] = city_dom.getElementsByTagName(
-            'longitude_e6')[0].getAttribute('data')
+        city['name'] = city_dom.first('name').attrs['data']
+        city['latitude_e6'] = city_dom.first('latitude_e6').attrs['data']
+        city['longitude_e6'] = city_dom.first('longitude_e6').attrs['data']
         cities.append(city)
     
-    dom.unlink()
-    
     return cities
 
-def get_weather_from_yahoo(location_id, units = 'metric'):
+def get_weather_from_yahoo(location_id, units = 'metric', compact = False,
+                           typed = False, timeout = None):
     """Fetches weather report from Yahoo! Weather
 
     Parameters:
@@ -374,114 +2764,478 @@ def get_weather_from_yahoo(location_id, units = 'metric'):
       Note that choosing metric units changes all the weather units to
       metric. For example, wind speed will be reported as kilometers per
       hour and barometric pressure as millibars.
- 
+
+      compact: if True, return the report as a CompactReport, which takes
+      less memory than the nested dictionaries.
+
+      typed: if True, numeric fields are converted to int or float, and
+      to None if the provider has no value for them (e.g. 'N/A').
+
+      timeout: seconds allowed for fetching, decoding and parsing the
+      report, or a (connect, read) tuple of seconds allowed for opening
+      the connection and for the rest, see Deadline.from_timeout(). If
+      the time runs out, the report contains only the key 'error'.
+
     Returns:
       weather_data: a dictionary of weather data that exists in XML feed.
       See http://developer.yahoo.com/weather/#channel
 
     """
-    location_id = quote(location_id)
+    (cache_key, url) = _yahoo_request(location_id, units)
+    weather_data = _get_report(cache_key, url, parse_yahoo_response,
+                                 'Could not connect to Yahoo! Weather',
+                                 typed, timeout)
+    return _report_result(weather_data, compact)
+
+def _yahoo_request(location_id, units):
+    """Returns the cache key and the URL of a Yahoo! Weather report"""
+    location_id = _url_quoting.quote(location_id)
     if units == 'metric':
         unit = 'c'
     elif units == 'imperial' or units == '':   # for backwards compatibility
         unit = 'f'
     else:
         unit = 'c'  # fallback to metric
-    url = YAHOO_WEATHER_URL % (location_id, unit)
-    try:
-        handler = urlopen(url)
-    except URLError:
-        return {'error': 'Could not connect to Yahoo! Weather'}
-    if sys.version > '3':
-        # Python 3
-        content_type = dict(handler.getheaders())['Content-Type']
-    else:
-        # Python 2
-        content_type = handler.info().dict['content-type']
-    try:
-        charset = re.search('charset\=(.*)', content_type).group(1)
-    except AttributeError:
-        charset = 'utf-8'
-    if charset.lower() != 'utf-8':
-        xml_response = handler.read().decode(charset).encode('utf-8')
-    else:
-        xml_response = handler.read()
-    dom = minidom.parseString(xml_response)
-    handler.close()
-        
+    return (('yahoo', location_id, unit),
+            YAHOO_WEATHER_URL % (location_id, unit))
+
+YAHOO_NS_DATA_STRUCTURE = (
+    ('location', ('city', 'region', 'country')),
+    ('units', ('temperature', 'distance', 'pressure', 'speed')),
+    ('wind', ('chill', 'direction', 'speed')),
+    ('atmosphere', ('humidity', 'visibility', 'pressure', 'rising')),
+    ('astronomy', ('sunrise', 'sunset')),
+    ('condition', ('text', 'code', 'temp', 'date'))
+)
+YAHOO_FORECAST_ATTRS = ('day', 'date', 'low', 'high', 'text', 'code')
+
+_YAHOO_PLAN = XMLPlan(
+    [XMLSelector('title'), XMLSelector('link'),
+     XMLSelector('item', [XMLSelector('title'), XMLSelector('description')]),
+     XMLSelector('geo:lat'), XMLSelector('geo:long'),
+     XMLSelector((YAHOO_WEATHER_NS, 'forecast'), many = True,
+                 attrs = YAHOO_FORECAST_ATTRS)] +
+    [XMLSelector((YAHOO_WEATHER_NS, tag), attrs = attrs)
+     for (tag, attrs) in YAHOO_NS_DATA_STRUCTURE])
+
+# numeric fields of a Yahoo! Weather report, see decode_fields()
+YAHOO_FIELD_TYPES = {
+    'atmosphere': {'humidity': int, 'pressure': float, 'rising': int,
+                   'visibility': float},
+    'condition': {'temp': int},
+    'forecasts': [{'high': int, 'low': int}],
+    'geo': {'lat': float, 'long': float},
+    'wind': {'chill': int, 'direction': int, 'speed': float}}
+
+def parse_yahoo_response(xml_response, typed = False):
+    """Extracts the weather report from a Yahoo! Weather RSS response, as
+    returned by get_weather_from_yahoo()
+
+    Parameters:
+      xml_response: the raw response body (bytes)
+      typed: if True, numeric fields are converted to int or float, and
+      to None if the provider has no value for them (e.g. 'N/A').
+
+    Returns:
+      weather_data: a dictionary of weather data that exists in XML feed.
+
+    """
+    document = xml_extract(xml_response, _YAHOO_PLAN)
+
+    item = document.first('item')
     weather_data = {}
-    try:
-        weather_data['title'] = dom.getElementsByTagName(
-            'title')[0].firstChild.data
-        weather_data['link'] = dom.getElementsByTagName(
-            'link')[0].firstChild.data
-    except IndexError:
-        error_data = {'error': dom.getElementsByTagName('item')[
-            0].getElementsByTagName('title')[0].firstChild.data}
-        dom.unlink()
-        return error_data
+    if document.first('title') is None or document.first('link') is None:
+        return {'error': XMLMatch.child_text(item, 'title')}
+    weather_data['title'] = document.first('title').text
+    weather_data['link'] = document.first('link').text
         
-    ns_data_structure = { 
-        'location': ('city', 'region', 'country'),
-        'units': ('temperature', 'distance', 'pressure', 'speed'),
-        'wind': ('chill', 'direction', 'speed'),
-        'atmosphere': ('humidity', 'visibility', 'pressure', 'rising'),
-        'astronomy': ('sunrise', 'sunset'),
-        'condition': ('text', 'code', 'temp', 'date')
-    }       
-    
-    for (tag, attrs) in ns_data_structure.items():
-        weather_data[tag] = xml_get_ns_yahoo_tag(
-            dom, YAHOO_WEATHER_NS, tag, attrs
-            )
+    for (tag, attrs) in YAHOO_NS_DATA_STRUCTURE:
+        element = document.first((YAHOO_WEATHER_NS, tag))
+        if element is None:
+            return {'error': XMLMatch.child_text(item, 'title')}
+        weather_data[tag] = element.attrs
 
     weather_data['geo'] = {}
-    try:
-        weather_data['geo']['lat'] = dom.getElementsByTagName(
-            'geo:lat')[0].firstChild.data
-        weather_data['geo']['long'] = dom.getElementsByTagName(
-            'geo:long')[0].firstChild.data
-    except AttributeError:
+    lat = document.first('geo:lat')
+    lon = document.first('geo:long')
+    if lat is not None and lat.text is not None and \
+       lon is not None and lon.text is not None:
+        weather_data['geo']['lat'] = lat.text
+        weather_data['geo']['long'] = lon.text
+    else:
         weather_data['geo']['lat'] = unicode()
         weather_data['geo']['long'] = unicode()
 
-    weather_data['condition']['title'] = dom.getElementsByTagName(
-        'item')[0].getElementsByTagName('title')[0].firstChild.data
-    weather_data['html_description'] = dom.getElementsByTagName(
-        'item')[0].getElementsByTagName('description')[0].firstChild.data
-    
-    forecasts = []
-    for forecast in dom.getElementsByTagNameNS(YAHOO_WEATHER_NS, 'forecast'):
-        forecasts.append(xml_get_attrs(forecast,('day', 'date', 'low', 'high',
-                                                 'text', 'code')))
-    weather_data['forecasts'] = forecasts
-    
-    dom.unlink()
-    return weather_data
-    
-def get_everything_from_yahoo(country_code, cities):
-    """Get all weather data from yahoo for a specific country.
+    weather_data['condition']['title'] = item.first('title').text
+    weather_data['html_description'] = item.first('description').text
+    
+    forecasts = []
+    for forecast in document.all((YAHOO_WEATHER_NS, 'forecast')):
+        forecasts.append(forecast.attrs)
+    weather_data['forecasts'] = forecasts
+    if typed:
+        decode_fields(weather_data, YAHOO_FIELD_TYPES)
+    
+    return weather_data
+    
+def get_everything_from_yahoo(country_code, cities, max_workers = 1,
+                              compact = False, typed = False, sink = None,
+                              timeout = None):
+    """Get all weather data from yahoo for a specific country.
+
+    Parameters:
+      country_code: A four letter code of the necessary country.
+                    For example 'GMXX' or 'FRXX'.
+      cities: The maximum number of cities for which to get data.
+
+      max_workers: The maximum number of reports to fetch at the same time.
+      Default value is 1, which fetches one city after another.
+
+      compact: if True, return the reports as CompactReports.
+
+      typed: if True, convert numeric fields to int or float.
+
+      sink: an object with a method append(city_code, weather_data), such
+      as ReportColumns, called with every result as soon as it is fetched.
+
+      timeout: time allowed for each city, see get_weather_from_yahoo().
+      
+    Returns:
+      weather_reports: A dictionary containing weather data for each city.
+      Cities that could not be fetched are left out. If no city at all
+      could be fetched, the dictionary contains only the key 'error'.
+
+    """
+    city_codes = yield_all_country_city_codes_yahoo(country_code, cities)
+    def fetch(city_code):
+        weather_data = get_weather_from_yahoo(city_code, compact = compact,
+                                              typed = typed,
+                                              timeout = timeout)
+        if sink is not None:
+            sink.append(city_code, weather_data)
+        return weather_data
+    results = _map_concurrently(fetch, city_codes, max_workers)
+    return _reports_by_city(results)
+
+def iter_everything_from_yahoo(country_code, cities, max_workers = 1,
+                               buffer_size = 16, compact = False,
+                               typed = False, timeout = None):
+    """Get all weather data from yahoo for a specific country, one city at
+    a time as the reports arrive.
+
+    At most buffer_size results wait for the caller; when the buffer is
+    full, fetching pauses until the caller takes the next result, so a
+    slow caller bounds the memory used. Closing the generator early stops
+    the remaining fetches.
+
+    Parameters:
+      country_code: A four letter code of the necessary country.
+                    For example 'GMXX' or 'FRXX'.
+      cities: The maximum number of cities for which to get data.
+
+      max_workers: The maximum number of reports to fetch at the same time.
+      Default value is 1, which fetches one city after another.
+
+      buffer_size: The maximum number of fetched results not yet taken by
+      the caller.
+
+      compact: if True, yield the reports as CompactReports.
+
+      typed: if True, convert numeric fields to int or float.
+
+      timeout: time allowed for each city, see get_weather_from_yahoo().
+
+    Returns:
+      results: A generator of (city_code, weather_data) tuples, in the
+      order the reports arrive. weather_data contains the key 'error' if
+      the city could not be fetched.
+
+    """
+    city_codes = yield_all_country_city_codes_yahoo(country_code, cities)
+    def fetch(city_code):
+        return get_weather_from_yahoo(city_code, compact = compact,
+                                      typed = typed, timeout = timeout)
+    return _imap_unordered(fetch, city_codes, max_workers, buffer_size)
+
+def _reports_by_city(results):
+    """Keys a list of Yahoo! reports by city name, leaving out errors.
+    Returns the first error if no report could be fetched."""
+    weather_reports = {}
+    error_data = None
+    for weather_data in results:
+        if ('error' in weather_data):
+            if error_data is None:
+                error_data = weather_data
+            continue
+        city = weather_data['location']['city']
+        weather_reports[city] = weather_data
+
+    if not weather_reports and error_data is not None:
+        return error_data
+    return weather_reports
+
+def _map_concurrently(function, items, max_workers):
+    """Calls function on every item, using at most max_workers threads
+
+    Parameters:
+      function: callable taking a single item
+      items: iterable of items
+      max_workers: the maximum number of concurrent calls
+
+    Returns:
+      a list of the results, in the same order as items. If any call
+      raised an exception, the first one is re-raised after all workers
+      have finished.
+
+    """
+    items = list(items)
+    if max_workers is None or max_workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    results = [None] * len(items)
+    failures = []
+    pending = queue.Queue()
+    for index in xrange(len(items)):
+        pending.put(index)
+
+    def worker():
+        while True:
+            try:
+                index = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = function(items[index])
+            except Exception:
+                failures.append(sys.exc_info())
+
+    workers = []
+    for i in xrange(min(max_workers, len(items))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        workers.append(thread)
+    for thread in workers:
+        thread.join()
+
+    if failures:
+        raise failures[0][1]
+    return results
+
+def _imap_unordered(function, items, max_workers, buffer_size):
+    """Calls function on every item using at most max_workers threads, and
+    yields (item, result) tuples as the calls finish.
+
+    Items are taken from the iterable only when a thread is free. Threads
+    wait while buffer_size results are waiting to be consumed. If a call
+    raises an exception, it is re-raised in the consumer. When the
+    generator is closed, the threads stop after their current call.
+    """
+    if max_workers is None or max_workers <= 1:
+        for item in items:
+            yield (item, function(item))
+        return
+
+    items = iter(items)
+    items_lock = threading.Lock()
+    results = queue.Queue(max(buffer_size, 1))
+    stopped = threading.Event()
+    finished = object()
+
+    def put(outcome):
+        # block while the buffer is full, unless the consumer has gone
+        while not stopped.is_set():
+            try:
+                results.put(outcome, timeout = 0.1)
+                return
+            except queue.Full:
+                pass
+
+    def worker():
+        try:
+            while not stopped.is_set():
+                with items_lock:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        return
+                try:
+                    put((item, function(item), None))
+                except Exception:
+                    put((item, None, sys.exc_info()))
+        finally:
+            put(finished)
+
+    running = max_workers
+    for i in xrange(max_workers):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+
+    try:
+        while running:
+            outcome = results.get()
+            if outcome is finished:
+                running -= 1
+                continue
+            (item, result, exc_info) = outcome
+            if exc_info is not None:
+                raise exc_info[1]
+            yield (item, result)
+    finally:
+        stopped.set()
+
+# columns of ReportColumns for Yahoo! reports: name, path in the report,
+# type (float for numeric columns)
+YAHOO_COLUMNS = (
+    ('city', ('location', 'city'), unicode),
+    ('region', ('location', 'region'), unicode),
+    ('country', ('location', 'country'), unicode),
+    ('lat', ('geo', 'lat'), float),
+    ('long', ('geo', 'long'), float),
+    ('date', ('condition', 'date'), unicode),
+    ('code', ('condition', 'code'), unicode),
+    ('text', ('condition', 'text'), unicode),
+    ('temperature', ('condition', 'temp'), float),
+    ('humidity', ('atmosphere', 'humidity'), float),
+    ('pressure', ('atmosphere', 'pressure'), float),
+    ('visibility', ('atmosphere', 'visibility'), float),
+    ('wind_chill', ('wind', 'chill'), float),
+    ('wind_direction', ('wind', 'direction'), float),
+    ('wind_speed', ('wind', 'speed'), float),
+    ('temperature_unit', ('units', 'temperature'), unicode),
+    ('speed_unit', ('units', 'speed'), unicode),
+    ('pressure_unit', ('units', 'pressure'), unicode),
+    ('distance_unit', ('units', 'distance'), unicode))
+
+class ReportColumns(object):
+    """Collects reports into one buffer per column, e.g. during a crawl:
+
+      columns = pywapi.ReportColumns()
+      pywapi.get_everything_from_yahoo('GRXX', 81, sink = columns)
+      numpy.save('greece.npy', columns.to_numpy())
+
+    The first column, location_id, holds the location each report was
+    fetched for. Numeric columns are stored in arrays of doubles, with NaN
+    where the report has no number; text columns in lists. Reports can be
+    plain, typed or compact. Errors are counted but not stored.
+
+    Parameters:
+      columns: sequence of (name, path, type) describing the columns,
+      YAHOO_COLUMNS by default. path is the sequence of keys leading to
+      the value in the report, type is float or unicode.
+
+    """
+
+    def __init__(self, columns = YAHOO_COLUMNS):
+        self.columns = tuple(columns)
+        self.location_ids = []
+        self.errors = 0
+        self._buffers = [array('d') if column_type is float else []
+                         for (name, path, column_type) in self.columns]
+        self._lock = threading.Lock()
+
+    def append(self, location_id, weather_data):
+        """Adds a report to the columns. Thread-safe."""
+        if 'error' in weather_data:
+            with self._lock:
+                self.errors += 1
+            return
+        row = []
+        for (name, path, column_type) in self.columns:
+            value = _report_value(weather_data, path)
+            if column_type is float:
+                value = _to_float(value)
+            elif value is None:
+                value = u''
+            row.append(value)
+        with self._lock:
+            self.location_ids.append(location_id)
+            for (buffer, value) in zip(self._buffers, row):
+                buffer.append(value)
+
+    def __len__(self):
+        return len(self.location_ids)
+
+    def names(self):
+        """Returns the column names, starting with location_id"""
+        return ['location_id'] + [name for (name, path, column_type)
+                                  in self.columns]
+
+    def column(self, name):
+        """Returns the buffer of a column: an array of doubles or a list"""
+        if name == 'location_id':
+            return self.location_ids
+        return self._buffers[self.names().index(name) - 1]
+
+    def to_numpy(self):
+        """Returns the reports as a NumPy structured array with one field
+        per column. Requires NumPy."""
+        numpy = _import_numpy()
+        if numpy is None:
+            raise RuntimeError('ReportColumns.to_numpy() requires NumPy')
+        dtype = []
+        for name in self.names():
+            values = self.column(name)
+            if isinstance(values, array):
+                dtype.append((name, 'f8'))
+            else:
+                width = max([len(value) for value in values] or [1])
+                dtype.append((name, 'U%d' % width))
+        table = numpy.empty(len(self), dtype = dtype)
+        for name in self.names():
+            values = self.column(name)
+            if isinstance(values, array):
+                table[name] = numpy.frombuffer(values, dtype = 'f8')
+            else:
+                table[name] = values
+        return table
+
+    def to_arrow(self):
+        """Returns the reports as a pyarrow Table. Requires pyarrow."""
+        try:
+            import numpy
+            import pyarrow
+        except ImportError:
+            raise RuntimeError('ReportColumns.to_arrow() requires pyarrow')
+        arrays = []
+        for name in self.names():
+            values = self.column(name)
+            if isinstance(values, array):
+                # from_pandas stores the NaN of missing numbers as nulls
+                arrays.append(pyarrow.array(
+                    numpy.frombuffer(values, dtype = 'f8'),
+                    type = pyarrow.float64(), from_pandas = True))
+            else:
+                arrays.append(pyarrow.array(values, type = pyarrow.string()))
+        return pyarrow.Table.from_arrays(arrays, names = self.names())
+
+    def write_parquet(self, path):
+        """Writes the reports to a Parquet file. Requires pyarrow."""
+        table = self.to_arrow()
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, path)
 
-    Parameters:
-      country_code: A four letter code of the necessary country.
-                    For example 'GMXX' or 'FRXX'.
-      cities: The maximum number of cities for which to get data.
-      
-    Returns:
-      weather_reports: A dictionary containing weather data for each city.
+    def write_csv(self, csv_file):
+        """Writes the reports as CSV with a header line to csv_file, a file
+        opened for writing text. Missing numbers are left empty."""
+        writer = csv.writer(csv_file)
+        writer.writerow(self.names())
+        buffers = [self.location_ids] + self._buffers
+        for i in xrange(len(self)):
+            writer.writerow(['' if value != value else value   # NaN
+                             for value in [buffer[i] for buffer in buffers]])
 
-    """
-    city_codes = yield_all_country_city_codes_yahoo(country_code, cities)
-    
-    weather_reports = {}
-    for city_c in city_codes:
-        weather_data = get_weather_from_yahoo(city_c)
-        if ('error' in weather_data):
-            return weather_data
-        city = weather_data['location']['city']
-        weather_reports[city] = weather_data
-        
-    return weather_reports
+
+def _report_value(weather_data, path):
+    """Returns the value at path in a report, None if there is none"""
+    value = weather_data
+    for key in path:
+        try:
+            value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return value
 
 def yield_all_country_city_codes_yahoo(country_code, cities):
     """Yield all cities codes for a specific country.
@@ -499,7 +3253,8 @@ def yield_all_country_city_codes_yahoo(country_code, cities):
     for i in range(1, cities + 1):
         yield ''.join([country_code, (4 - len(str(i))) * '0', str(i)])
 
-def get_weather_from_noaa(station_id):
+def get_weather_from_noaa(station_id, compact = False, typed = False,
+                          timeout = None):
     """Fetches weather report from NOAA: National Oceanic and Atmospheric
     Administration (United States)
 
@@ -515,82 +3270,357 @@ def get_weather_from_noaa(station_id):
       Another way to get the station ID: use the 'Weather.location2station'
       function of this library: http://code.google.com/p/python-weather/
 
+      compact: if True, return the report as a CompactReport, which takes
+      less memory than the nested dictionaries.
+
+      typed: if True, numeric fields are converted to int or float, and
+      to None if the provider has no value for them (e.g. 'N/A').
+
+      timeout: seconds allowed for fetching, decoding and parsing the
+      report, or a (connect, read) tuple of seconds allowed for opening
+      the connection and for the rest, see Deadline.from_timeout(). If
+      the time runs out, the report contains only the key 'error'.
+
     Returns:
       weather_data: a dictionary of weather data that exists in XML feed. 
 
       ( useful icons: http://www.weather.gov/xml/current_obs/weather.php )
 
     """
-    station_id = quote(station_id)
-    url = NOAA_WEATHER_URL % (station_id)
-    try:
-        handler = urlopen(url)
-    except URLError:
-        return {'error': 'Could not connect to NOAA'}
-    if sys.version > '3':
-        # Python 3
-        content_type = dict(handler.getheaders())['Content-Type']
-    else:
-        # Python 2
-        content_type = handler.info().dict['content-type']
-    try:
-        charset = re.search('charset\=(.*)', content_type).group(1)
-    except AttributeError:
-        charset = 'utf-8'
-    if charset.lower() != 'utf-8':
-        xml_response = handler.read().decode(charset).encode('utf-8')
-    else:
-        xml_response = handler.read()
-    dom = minidom.parseString(xml_response)
-    handler.close()
-        
-    data_structure = ('suggested_pickup',
-                'suggested_pickup_period',
-                'location',
-                'station_id',
-                'latitude',
-                'longitude',
-                'observation_time',
-                'observation_time_rfc822',
-                'weather',
-                'temperature_string',
-                'temp_f',
-                'temp_c',
-                'relative_humidity',
-                'wind_string',
-                'wind_dir',
-                'wind_degrees',
-                'wind_mph',
-                'wind_gust_mph',
-                'pressure_string',
-                'pressure_mb',
-                'pressure_in',
-                'dewpoint_string',
-                'dewpoint_f',
-                'dewpoint_c',
-                'heat_index_string',
-                'heat_index_f',
-                'heat_index_c',
-                'windchill_string',
-                'windchill_f',
-                'windchill_c',
-                'icon_url_base',
-                'icon_url_name',
-                'two_day_history_url',
-                'ob_url'
-                )
+    (cache_key, url) = _noaa_request(station_id)
+    weather_data = _get_report(cache_key, url, parse_noaa_response,
+                                 'Could not connect to NOAA',
+                                 typed, timeout)
+    return _report_result(weather_data, compact)
+
+def _noaa_request(station_id):
+    """Returns the cache key and the URL of a NOAA report"""
+    station_id = _url_quoting.quote(station_id)
+    return (('noaa', station_id), NOAA_WEATHER_URL % (station_id))
+
+NOAA_DATA_STRUCTURE = ('suggested_pickup',
+                       'suggested_pickup_period',
+                       'location',
+                       'station_id',
+                       'latitude',
+                       'longitude',
+                       'observation_time',
+                       'observation_time_rfc822',
+                       'weather',
+                       'temperature_string',
+                       'temp_f',
+                       'temp_c',
+                       'relative_humidity',
+                       'wind_string',
+                       'wind_dir',
+                       'wind_degrees',
+                       'wind_mph',
+                       'wind_gust_mph',
+                       'pressure_string',
+                       'pressure_mb',
+                       'pressure_in',
+                       'dewpoint_string',
+                       'dewpoint_f',
+                       'dewpoint_c',
+                       'heat_index_string',
+                       'heat_index_f',
+                       'heat_index_c',
+                       'windchill_string',
+                       'windchill_f',
+                       'windchill_c',
+                       'icon_url_base',
+                       'icon_url_name',
+                       'two_day_history_url',
+                       'ob_url')
+
+_NOAA_PLAN = XMLPlan([XMLSelector('current_observation',
+                                  [XMLSelector(tag)
+                                   for tag in NOAA_DATA_STRUCTURE])])
+
+# numeric fields of a NOAA report, see decode_fields()
+NOAA_FIELD_TYPES = {
+    'suggested_pickup_period': int,
+    'latitude': float, 'longitude': float,
+    'temp_f': float, 'temp_c': float, 'relative_humidity': int,
+    'wind_degrees': int, 'wind_mph': float, 'wind_gust_mph': float,
+    'pressure_mb': float, 'pressure_in': float,
+    'dewpoint_f': float, 'dewpoint_c': float,
+    'heat_index_f': float, 'heat_index_c': float,
+    'windchill_f': float, 'windchill_c': float}
+
+def parse_noaa_response(xml_response, typed = False):
+    """Extracts the weather report from a NOAA current_obs XML response,
+    as returned by get_weather_from_noaa()
+
+    Parameters:
+      xml_response: the raw response body (bytes)
+      typed: if True, numeric fields are converted to int or float, and
+      to None if the provider has no value for them (e.g. 'N/A').
+
+    Returns:
+      weather_data: a dictionary of weather data that exists in XML feed.
+
+    """
+    document = xml_extract(xml_response, _NOAA_PLAN)
+
+    current_observation = document.first('current_observation')
+    if current_observation is None:
+        return {'error': 'Error parsing NOAA response'}
     weather_data = {}
-    current_observation = dom.getElementsByTagName('current_observation')[0]
-    for tag in data_structure:
-        try:
-            weather_data[tag] = current_observation.getElementsByTagName(
-                tag)[0].firstChild.data
-        except IndexError:
-            pass
+    for tag in NOAA_DATA_STRUCTURE:
+        element = current_observation.first(tag)
+        if element is not None:
+            weather_data[tag] = element.text_or_empty()
+    if typed:
+        decode_fields(weather_data, NOAA_FIELD_TYPES)
 
-    dom.unlink()
     return weather_data
 
+def _noaa_pickup_period(weather_data):
+    """Returns the suggested_pickup_period of a NOAA report in seconds,
+    or None if the report does not suggest one"""
+    try:
+        return int(weather_data['suggested_pickup_period']) * 60
+    except (KeyError, TypeError, ValueError):
+        return None
+
+# fields of the reports returned by get_current_conditions(), in metric
+# units: temperatures in C, pressure in mb, visibility in km and wind
+# speed in km/h
+CONDITIONS_FIELDS = ('temperature', 'feels_like', 'dewpoint', 'humidity',
+                     'pressure', 'visibility', 'wind_speed',
+                     'wind_direction', 'text', 'observation_time')
+
+# providers of get_current_conditions(), in order of preference
+CONDITIONS_PROVIDERS = ('noaa', 'weather_com', 'yahoo')
+
+# path of every field in the typed metric report of each provider, and the
+# factor converting it to the units of CONDITIONS_FIELDS (None if the
+# value is used as it is). A list of paths is tried in order until one
+# has a value.
+CONDITIONS_PATHS = {
+    'weather_com': {
+        'temperature': (('current_conditions', 'temperature'), None),
+        'feels_like': (('current_conditions', 'feels_like'), None),
+        'dewpoint': (('current_conditions', 'dewpoint'), None),
+        'humidity': (('current_conditions', 'humidity'), None),
+        'pressure': (('current_conditions', 'barometer', 'reading'), None),
+        'visibility': (('current_conditions', 'visibility'), None),
+        'wind_speed': (('current_conditions', 'wind', 'speed'), None),
+        'wind_direction': (('current_conditions', 'wind', 'direction'),
+                           None),
+        'text': (('current_conditions', 'text'), None),
+        'observation_time': (('current_conditions', 'last_updated'), None)},
+    'yahoo': {
+        'temperature': (('condition', 'temp'), None),
+        'feels_like': (('wind', 'chill'), None),
+        'humidity': (('atmosphere', 'humidity'), None),
+        'pressure': (('atmosphere', 'pressure'), None),
+        'visibility': (('atmosphere', 'visibility'), None),
+        'wind_speed': (('wind', 'speed'), None),
+        'wind_direction': (('wind', 'direction'), None),
+        'text': (('condition', 'text'), None),
+        'observation_time': (('condition', 'date'), None)},
+    'noaa': {
+        'temperature': (('temp_c',), None),
+        # NOAA only reports a wind chill or heat index when it applies
+        'feels_like': ([('windchill_c',), ('heat_index_c',), ('temp_c',)],
+                       None),
+        'dewpoint': (('dewpoint_c',), None),
+        'humidity': (('relative_humidity',), None),
+        'pressure': (('pressure_mb',), None),
+        # NOAA reports have no visibility, see NOAA_DATA_STRUCTURE
+        'wind_speed': (('wind_mph',), 1.609344),
+        'wind_direction': (('wind_degrees',), None),
+        'text': (('weather',), None),
+        'observation_time': (('observation_time_rfc822',), None)}}
+
+def get_current_conditions(location_ids, mode = 'fastest',
+                           providers = CONDITIONS_PROVIDERS,
+                           timeout = None):
+    """Fetches the current conditions of a location from several providers
+    at the same time
+
+    Parameters:
+      location_ids: a dictionary of the location ID for each provider to
+      ask, e.g. {'noaa': 'KJFK', 'weather_com': 'USNY0996',
+      'yahoo': 'USNY0996'}
+
+      mode: 'fastest' to return the first report that arrives without an
+      error, 'merge' to wait for all providers and combine their reports,
+      see merge_conditions().
+
+      providers: the providers in order of preference. Providers without
+      a location ID are not asked.
+
+      timeout: time allowed for each provider, see
+      get_weather_from_noaa().
+
+    Returns:
+      conditions: a dictionary with the keys of CONDITIONS_FIELDS (None if
+      no provider had a value) and 'provider', the provider of the report
+      in 'fastest' mode, or 'sources', the provider of every field in
+      'merge' mode. If no provider answered, the dictionary contains only
+      the key 'error'.
+
+    In 'fastest' mode, the fetches still running when the first report
+    arrives are abandoned; they finish in the background (bounded by
+    timeout) and fill the caches, if any.
+
+    """
+    if mode not in ('fastest', 'merge'):
+        raise ValueError("mode must be 'fastest' or 'merge', not %r" % mode)
+    providers = [provider for provider in providers
+                 if provider in location_ids]
+    def fetch(provider):
+        return _provider_conditions(provider, location_ids[provider],
+                                    timeout)
+    results = _imap_unordered(fetch, providers, len(providers),
+                              len(providers))
+    if mode == 'merge':
+        return merge_conditions(dict(results), providers)
+    try:
+        for (provider, conditions) in results:
+            if 'error' not in conditions:
+                conditions['provider'] = provider
+                return conditions
+    finally:
+        results.close()
+    return _conditions_error(providers)
+
+def _provider_conditions(provider, location_id, timeout):
+    """Fetches the typed metric report of provider and returns its
+    normalized conditions, or an error if it could not be fetched or
+    parsed"""
+    try:
+        if provider == 'noaa':
+            weather_data = get_weather_from_noaa(location_id, typed = True,
+                                                 timeout = timeout)
+        elif provider == 'weather_com':
+            weather_data = get_weather_from_weather_com(
+                location_id, typed = True, timeout = timeout)
+        elif provider == 'yahoo':
+            weather_data = get_weather_from_yahoo(location_id, typed = True,
+                                                  timeout = timeout)
+        else:
+            return {'error': 'Unknown provider %s' % provider}
+    except Exception:
+        # a provider answering garbage must not fail the other providers
+        return {'error': 'Invalid response from %s' % provider}
+    return normalize_conditions(provider, weather_data)
+
+def normalize_conditions(provider, weather_data):
+    """Extracts the current conditions from the typed metric report of a
+    provider, see CONDITIONS_PATHS
+
+    Parameters:
+      provider: 'noaa', 'weather_com' or 'yahoo'
+      weather_data: a report returned by get_weather_from_<provider>(...,
+      typed = True), in metric units
+
+    Returns:
+      conditions: a dictionary with the keys of CONDITIONS_FIELDS, None for
+      the fields the report has no value for, or the error of the report.
+
+    """
+    if 'error' in weather_data:
+        return {'error': weather_data['error']}
+    paths = CONDITIONS_PATHS[provider]
+    conditions = {}
+    for field in CONDITIONS_FIELDS:
+        (path, factor) = paths.get(field, ((), None))
+        if isinstance(path, list):
+            value = None
+            for alternative in path:
+                value = _report_value(weather_data, alternative)
+                if value is not None:
+                    break
+        else:
+            value = _report_value(weather_data, path) if path else None
+        if factor is not None and value is not None:
+            value = _decode_number(value, float)
+            if value is not None:
+                value = round(value * factor, 2)
+        conditions[field] = value
+    return conditions
+
+def merge_conditions(conditions_by_provider, providers):
+    """Combines the normalized conditions of several providers
+
+    Parameters:
+      conditions_by_provider: a dictionary of the conditions returned by
+      normalize_conditions() for each provider
+      providers: the providers in order of preference
+
+    Returns:
+      conditions: a dictionary with, for every field of CONDITIONS_FIELDS,
+      the value of the first provider that has one, and 'sources', the
+      provider of every field that has a value. If all conditions are
+      errors, a dictionary with only the key 'error'.
+
+    """
+    answered = [provider for provider in providers
+                if 'error' not in conditions_by_provider.get(
+                    provider, {'error': None})]
+    if not answered:
+        return _conditions_error(providers)
+    merged = {}
+    sources = {}
+    for field in CONDITIONS_FIELDS:
+        merged[field] = None
+        for provider in answered:
+            value = conditions_by_provider[provider][field]
+            if value is not None:
+                merged[field] = value
+                sources[field] = provider
+                break
+    merged['sources'] = sources
+    return merged
+
+def _conditions_error(providers):
+    return {'error': 'Could not get current conditions from %s' %
+                     (', '.join(providers) or 'any provider')}
+
+def decode_fields(weather_data, field_types):
+    """Converts the numeric fields of a report in place.
+
+    Parameters:
+      weather_data: a report as returned by the parse_*_response()
+      functions
+      field_types: a dictionary with the same layout as the report, giving
+      int or float for every numeric field, e.g. NOAA_FIELD_TYPES. A list
+      holding one dictionary applies it to every item of a list.
+
+    Values that are not numbers, such as '' or 'N/A', become None, except
+    'calm' wind speeds which become 0. Fields missing from the report are
+    ignored.
+    """
+    for (key, field_type) in field_types.items():
+        value = weather_data.get(key)
+        if value is None:
+            continue
+        if isinstance(field_type, dict):
+            if isinstance(value, dict):
+                decode_fields(value, field_type)
+        elif isinstance(field_type, list):
+            for item in value:
+                decode_fields(item, field_type[0])
+        else:
+            weather_data[key] = _decode_number(value, field_type)
+
+def _decode_number(value, number_type):
+    try:
+        return number_type(value)
+    except ValueError:
+        pass
+    try:
+        # e.g. '12.5' in an int field
+        return float(value)
+    except ValueError:
+        if value.strip().lower() == 'calm':
+            return 0
+        return None
+
 def xml_get_ns_yahoo_tag(dom, ns, tag, attrs):
     """Parses the necessary tag and returns the dictionary with values
     
@@ -623,6 +3653,10 @@ def xml_get_attrs(xml_element, attrs):
         result[attr] = xml_element.getAttribute(attr)   
     return result
 
+# compass points for wind directions starting at each threshold (in degrees)
+WIND_DIRECTION_THRESHOLDS = (23, 68, 113, 158, 203, 248, 293, 338)
+WIND_DIRECTIONS = ('N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW', 'N')
+
 def wind_direction(degrees):
     """ Convert wind degrees to direction """
     try:
@@ -630,22 +3664,22 @@ def wind_direction(degrees):
     except ValueError:
         return ''
     
-    if degrees < 23 or degrees >= 338:
-        return 'N'
-    elif degrees < 68:
-        return 'NE'
-    elif degrees < 113:
-        return 'E'
-    elif degrees < 158:
-        return 'SE'
-    elif degrees < 203:
-        return 'S'
-    elif degrees < 248:
-        return 'SW'
-    elif degrees < 293:
-        return 'W'
-    elif degrees < 338:
-        return 'NW'
+    return WIND_DIRECTIONS[bisect_right(WIND_DIRECTION_THRESHOLDS, degrees)]
+
+# Beaufort scale for each unit system: speeds below the first value are
+# calm (0), the second value holds the upper limits of Beaufort numbers
+# 1 to 11, and speeds above the last limit are hurricane force (12).
+BEAUFORT_SCALE = {
+    # Calm; Light air, Light breeze, Gentle breeze, Moderate breeze,
+    # Fresh breeze, Strong breeze, High wind, Gale, Strong gale,
+    # Storm, Violent storm
+    WindUnits.KPH: (1, (5.5, 11, 19, 28, 38, 49, 61, 74, 88, 102, 117)),
+    WindUnits.MPH: (1, (3, 7, 12, 17, 24, 30, 38, 46, 54, 63, 73)),
+    WindUnits.MPS: (0.3, (1.5, 3.4, 5.4, 7.9, 10.7, 13.8, 17.1, 20.7,
+                          24.4, 28.4, 32.6)),
+    WindUnits.KNOTS: (1, (3, 6, 10, 16, 21, 27, 33, 40, 47, 55, 63)),
+}
+_BEAUFORT_NUMBERS = tuple(str(number) for number in xrange(13))
 
 def wind_beaufort_scale(value, wind_units = WindUnits.KPH):
     """Convert wind speed value to Beaufort number (0-12)
@@ -666,136 +3700,97 @@ def wind_beaufort_scale(value, wind_units = WindUnits.KPH):
     
     try:
         value = float(value)
-    except ValueError:
+    except (TypeError, ValueError):
         return ''
 
     if value < 0.0:
         return ''
 
-    if wind_units == WindUnits.KPH:
-        if value < 1:
-            # Calm
-            return '0'
-        elif value <= 5.5:
-            # Light air
-            return '1'
-        elif value <= 11:
-            # Light breeze
-            return '2'
-        elif value <= 19:
-            # Gentle breeze
-            return '3'
-        elif value <= 28:
-            # Moderate breeze
-            return '4'
-        elif value <= 38:
-            # Fresh breeze
-            return '5'
-        elif value <= 49:
-            # Strong breeze
-            return '6'
-        elif value <= 61:
-            # High wind, moderate gale, near gale
-            return '7'
-        elif value <= 74:
-            # Gale, fresh gale
-            return '8'
-        elif value <= 88:
-            # Strong gale
-            return '9'
-        elif value <= 102:
-            # Storm, whole gale
-            return '10'
-        elif value <= 117:
-            # Violent storm
-            return '11'
-        else:
-            # Hurricane
-            return '12'
-    
-    if wind_units == WindUnits.MPH:
-        if value < 1:
-            return '0'
-        elif value <= 3:
-            return '1'
-        elif value <= 7:
-            return '2'
-        elif value <= 12:
-            return '3'
-        elif value <= 17:
-            return '4'
-        elif value <= 24:
-            return '5'
-        elif value <= 30:
-            return '6'
-        elif value <= 38:
-            return '7'
-        elif value <= 46:
-            return '8'
-        elif value <= 54:
-            return '9'
-        elif value <= 63:
-            return '10'
-        elif value <= 73:
-            return '11'
-        else:
-            return '12'
-
-    if wind_units == WindUnits.MPS:
-        if value < 0.3:
-            return '0'
-        elif value <= 1.5:
-            return '1'
-        elif value <= 3.4:
-            return '2'
-        elif value <= 5.4:
-            return '3'
-        elif value <= 7.9:
-            return '4'
-        elif value <= 10.7:
-            return '5'
-        elif value <= 13.8:
-            return '6'
-        elif value <= 17.1:
-            return '7'
-        elif value <= 20.7:
-            return '8'
-        elif value <= 24.4:
-            return '9'
-        elif value <= 28.4:
-            return '10'
-        elif value <= 32.6:
-            return '11'
-        else:
-            return '12'
-        
-    if wind_units == WindUnits.KNOTS:
-        if value < 1:
-            return '0'
-        if value <= 3:
-            return '1'
-        if value <= 6:
-            return '2'
-        if value <= 10:
-            return '3'
-        if value <= 16:
-            return '4'
-        if value <= 21:
-            return '5'
-        if value <= 27:
-            return '6'
-        if value <= 33:
-            return '7'
-        if value <= 40:
-            return '8'
-        if value <= 47:
-            return '9'
-        if value <= 55:
-            return '10'
-        if value <= 63:
-            return '11'
+    try:
+        (calm, limits) = BEAUFORT_SCALE[wind_units]
+    except KeyError:
+        return None
+    if value < calm:
+        return '0'
+    return _BEAUFORT_NUMBERS[1 + bisect_left(limits, value)]
+
+def wind_beaufort_scale_array(values, wind_units = WindUnits.KPH):
+    """Convert whole sequences of wind speeds to Beaufort numbers at once,
+    see wind_beaufort_scale()
+
+    Parameters:
+        values: sequence or NumPy array of wind speeds
+        wind_units: unit system of the values, defaults to km/h
+
+    Returns:
+        a NumPy array of Beaufort numbers (integers from 0 to 12), with -1
+        for values that are negative or not numbers. Without NumPy, a list
+        of integers.
+
+    """
+    if wind_units == WindUnits.BEAUFORT:
+        (calm, limits) = (0, None)
+    else:
+        (calm, limits) = BEAUFORT_SCALE[wind_units]
+
+    numpy = _import_numpy()
+    if numpy is None:
+        numbers = []
+        for value in values:
+            value = _to_float(value)
+            if not value >= 0.0:
+                numbers.append(-1)
+            elif limits is None:
+                numbers.append(int(value) if value <= 12 else -1)
+            elif value < calm:
+                numbers.append(0)
+            else:
+                numbers.append(1 + bisect_left(limits, value))
+        return numbers
+
+    values = _float_array(values)
+    with numpy.errstate(invalid = 'ignore'):
+        if limits is None:
+            valid = (values >= 0.0) & (values <= 12.0)
+            numbers = numpy.where(valid, values, -1).astype(numpy.int8)
         else:
-            return '12'
+            numbers = (numpy.searchsorted(limits, values, side = 'left') +
+                       1).astype(numpy.int8)
+            numbers[values < calm] = 0
+            numbers[~(values >= 0.0)] = -1
+    return numbers
+
+def wind_direction_array(degrees):
+    """Convert whole sequences of wind degrees to compass points at once,
+    see wind_direction()
+
+    Parameters:
+        degrees: sequence or NumPy array of wind directions in degrees
+
+    Returns:
+        a NumPy array of compass points ('N', 'NE', ...), with '' for
+        values that are not finite numbers. Without NumPy, a list of
+        strings.
+
+    """
+    numpy = _import_numpy()
+    if numpy is None:
+        directions = []
+        for value in degrees:
+            value = _to_float(value)
+            if math.isnan(value) or math.isinf(value):
+                directions.append('')
+            else:
+                directions.append(WIND_DIRECTIONS[bisect_right(
+                    WIND_DIRECTION_THRESHOLDS, int(value))])
+        return directions
+
+    degrees = numpy.trunc(_float_array(degrees))
+    indexes = numpy.searchsorted(WIND_DIRECTION_THRESHOLDS, degrees,
+                                 side = 'right')
+    # map NaN and infinities to the empty string
+    indexes[~numpy.isfinite(degrees)] = len(WIND_DIRECTIONS)
+    return numpy.array(WIND_DIRECTIONS + ('',))[indexes]
 
 def get_wind_direction(degrees):
     """ Same as wind_direction """
@@ -808,7 +3803,7 @@ def getText(nodelist):
                     rc = rc + node.data
     return rc
 
-def get_location_ids(search_string):
+def get_location_ids(search_string, timeout = None):
     """Get location IDs for place names matching a specified string.
     Same as get_loc_id_from_weather_com() but different return format.
     
@@ -817,12 +3812,15 @@ def get_location_ids(search_string):
       For example, a search for 'Los Angeles' will return matches for the
       city of that name in California, Chile, Cuba, Nicaragua, etc as well
       as 'East Los Angeles, CA', 'Lake Los Angeles, CA', etc.
+
+      timeout: seconds allowed for the search, or a (connect, read)
+      tuple, see Deadline.from_timeout().
       
     Returns:
       location_ids: A dictionary containing place names keyed to location ID
 
     """
-    loc_id_data = get_loc_id_from_weather_com(search_string)
+    loc_id_data = get_loc_id_from_weather_com(search_string, timeout)
     if 'error' in loc_id_data:
         return loc_id_data
     
@@ -831,7 +3829,7 @@ def get_location_ids(search_string):
         location_ids[loc_id_data[i][0]] = loc_id_data[i][1]
     return location_ids
 
-def get_loc_id_from_weather_com(search_string):
+def get_loc_id_from_weather_com(search_string, timeout = None):
     """Get location IDs for place names matching a specified string.
     Same as get_location_ids() but different return format.
     
@@ -840,59 +3838,60 @@ def get_loc_id_from_weather_com(search_string):
       For example, a search for 'Los Angeles' will return matches for the
       city of that name in California, Chile, Cuba, Nicaragua, etc as well
       as 'East Los Angeles, CA', 'Lake Los Angeles, CA', etc.
+
+      timeout: seconds allowed for the search, or a (connect, read)
+      tuple, see Deadline.from_timeout().
       
     Returns:
       loc_id_data: A dictionary of tuples in the following format:
       {'count': 2, 0: (LOCID1, Placename1), 1: (LOCID2, Placename2)}
 
     """
+    return _search_locations('weather_com', search_string,
+                             _loc_id_search_url(search_string),
+                             parse_loc_id_response, timeout)
+
+def _loc_id_search_url(search_string):
+    """Returns the URL of a Weather.com location search"""
     # Weather.com stores place names as ascii-only, so convert if possible
-    try:
-        # search_string = unidecode(search_string.encode('utf-8'))
-        search_string = unidecode(search_string)
-    except NameError:
-        pass
+    search_string = _transliterate(search_string)
     
-    url = LOCID_SEARCH_URL % quote(search_string)
-    try:
-        handler = urlopen(url)
-    except URLError:
-        return {'error': 'Could not connect to server'}
-    if sys.version > '3':
-        # Python 3
-        content_type = dict(handler.getheaders())['Content-Type']
-    else:
-        # Python 2
-        content_type = handler.info().dict['content-type']
-    try:
-        charset = re.search('charset\=(.*)', content_type).group(1)
-    except AttributeError:
-        charset = 'utf-8'
-    if charset.lower() != 'utf-8':
-        xml_response = handler.read().decode(charset).encode('utf-8')
-    else:
-        xml_response = handler.read()
-    dom = minidom.parseString(xml_response)
-    handler.close()
+    return LOCID_SEARCH_URL % _url_quoting.quote(search_string)
 
-    loc_id_data = {}
-    try:
-        num_locs = 0
-        for loc in dom.getElementsByTagName('search')[0].getElementsByTagName('loc'):
-            loc_id = loc.getAttribute('id')  # loc id
-            place_name = loc.firstChild.data  # place name
-            loc_id_data[num_locs] = (loc_id, place_name)
-            num_locs += 1
-        loc_id_data['count'] = num_locs
-    except IndexError:
+_LOC_ID_SEARCH_PLAN = XMLPlan([XMLSelector('search', [
+    XMLSelector('loc', many = True, attrs = ('id',))])])
+
+def parse_loc_id_response(xml_response):
+    """Extracts the location IDs from a Weather.com search response, as
+    returned by get_loc_id_from_weather_com()
+
+    Parameters:
+      xml_response: the raw response body (bytes)
+
+    Returns:
+      loc_id_data: A dictionary of tuples in the following format:
+      {'count': 2, 0: (LOCID1, Placename1), 1: (LOCID2, Placename2)}
+
+    """
+    document = xml_extract(xml_response, _LOC_ID_SEARCH_PLAN)
+
+    search = document.first('search')
+    if search is None:
         error_data = {'error': 'No matching Location IDs found'}
         return error_data
-    finally:
-        dom.unlink()
+
+    loc_id_data = {}
+    num_locs = 0
+    for loc in search.all('loc'):
+        loc_id = loc.attrs['id']  # loc id
+        place_name = loc.text_or_empty()  # place name
+        loc_id_data[num_locs] = (loc_id, place_name)
+        num_locs += 1
+    loc_id_data['count'] = num_locs
 
     return loc_id_data
 
-def get_where_on_earth_ids(search_string):    
+def get_where_on_earth_ids(search_string, timeout = None):    
     """Get Yahoo 'Where On Earth' ID for the place names that best match the
     specified string. Same as get_woeid_from_yahoo() but different return format.
     
@@ -904,12 +3903,15 @@ def get_where_on_earth_ids(search_string):
       For example, 'Paris' will match 'Paris, France', 'Deutschland' will match
       'Germany', 'Ontario' will match 'Ontario, Canada', 'SFO' will match 'San
       Francisco International Airport', etc.
+
+      timeout: seconds allowed for the search, or a (connect, read)
+      tuple, see Deadline.from_timeout().
       
     Returns:
       where_on_earth_ids: A dictionary containing place names keyed to WOEID.
 
     """
-    woeid_data = get_woeid_from_yahoo(search_string)
+    woeid_data = get_woeid_from_yahoo(search_string, timeout)
     if 'error' in woeid_data:
         return woeid_data
     
@@ -918,7 +3920,7 @@ def get_where_on_earth_ids(search_string):
         where_on_earth_ids[woeid_data[i][0]] = woeid_data[i][1]
     return where_on_earth_ids
 
-def get_woeid_from_yahoo(search_string):    
+def get_woeid_from_yahoo(search_string, timeout = None):    
     """Get Yahoo WOEID for the place names that best match the specified string.
     Same as get_where_on_earth_ids() but different return format.
     
@@ -929,12 +3931,21 @@ def get_woeid_from_yahoo(search_string):
       For example, 'Paris' will match 'Paris, France', 'Deutschland' will match
       'Germany', 'Ontario' will match 'Ontario, Canada', 'SFO' will match 'San
       Francisco International Airport', etc.
+
+      timeout: seconds allowed for the search, or a (connect, read)
+      tuple, see Deadline.from_timeout().
       
     Returns:
       woeid_data: A dictionary of tuples in the following format:
       {'count': 2, 0: (WOEID1, Placename1), 1: (WOEID2, Placename2)}
 
     """
+    return _search_locations('yahoo', search_string,
+                             _woeid_search_url(search_string),
+                             parse_woeid_response, timeout)
+
+def _woeid_search_url(search_string):
+    """Returns the URL of a Yahoo! WOEID search"""
     ## This uses Yahoo's YQL tables to directly query Yahoo's database, e.g.                        
     ## http://query.yahooapis.com/v1/public/yql?q=select%20*%20from%20geo.placefinder%20where%20text%3D%22New%20York%22
     if sys.version > '3':
@@ -944,26 +3955,20 @@ def get_woeid_from_yahoo(search_string):
         # Python 2
         encoded_string = search_string.encode('utf-8')
     params = {'q': WOEID_QUERY_STRING % encoded_string, 'format': 'json'}
-    url = '?'.join((WOEID_SEARCH_URL, urlencode(params)))
-    try:
-        handler = urlopen(url)
-    except URLError:
-        return {'error': 'Could not connect to server'}
-    if sys.version > '3':
-        # Python 3
-        content_type = dict(handler.getheaders())['Content-Type']
-    else:
-        # Python 2
-        content_type = handler.info().dict['content-type']
-    try:
-        charset = re.search('charset\=(.*)', content_type).group(1)
-    except AttributeError:
-        charset = 'utf-8'
-    if charset.lower() != 'utf-8':
-        json_response = handler.read().decode(charset).encode('utf-8')
-    else:
-        json_response = handler.read()
-    handler.close()
+    return '?'.join((WOEID_SEARCH_URL, _url_quoting.urlencode(params)))
+
+def parse_woeid_response(json_response):
+    """Extracts the WOEIDs from a Yahoo! YQL placefinder response, as
+    returned by get_woeid_from_yahoo()
+
+    Parameters:
+      json_response: the raw response body (bytes)
+
+    Returns:
+      woeid_data: A dictionary of tuples in the following format:
+      {'count': 2, 0: (WOEID1, Placename1), 1: (WOEID2, Placename2)}
+
+    """
     yahoo_woeid_result = json.loads(json_response)
 
     try:
@@ -1014,8 +4019,11 @@ def heat_index(temperature, humidity, units = 'metric'):
       heat_index: a numerical value representing the heat index
         in the temperature scale of the specified unit system.
         Returns None if the specified temperature is less than 80°F
-        or the specified relative humidity is less than 40%.
+        or the specified relative humidity is less than 40%, or if
+        either is None.
     """
+    if temperature is None or humidity is None:
+        return None
     # fallback to metric
     if units != 'imperial' and units != '' and units != 'metric':
         units = 'metric'
@@ -1032,22 +4040,231 @@ def heat_index(temperature, humidity, units = 'metric'):
     if (R < 40.0 or T < 80.0):
         return None
 
-    Rsquared = pow(R, 2.0)
-    Tsquared = pow(T, 2.0)
-
-    # coefficients for calculation
-    c = [None, -42.379, 2.04901523, 10.14333127, -0.22475541,  
-         -6.83783 * pow(10.0,-3.0), -5.481717 * pow(10.0,-2.0),
-         1.22874 * pow(10.0,-3.0), 8.5282 * pow(10.0,-4.0),
-         -1.99 * pow(10.0,-6.0)]
-
-    heat_index = ( c[1] + (c[2]* T) + (c[3]* R) + (c[4]* T * R) +
-                   (c[5]* Tsquared) + (c[6]* Rsquared) +
-                   (c[7]* Tsquared * R) + (c[8]* T * Rsquared) +
-                   (c[9]* Tsquared * Rsquared) )
+    heat_index = _heat_index_fahrenheit(T, R)
     
     # round to one decimal place
     if units == 'metric':
         return round(((heat_index - 32.0) * 5.0/9.0), 1)
     else:
         return round(heat_index, 1)
+
+# coefficients for the heat index calculation, c_1 to c_9
+HEAT_INDEX_COEFFICIENTS = (-42.379, 2.04901523, 10.14333127, -0.22475541,
+                           -6.83783 * pow(10.0,-3.0), -5.481717 * pow(10.0,-2.0),
+                           1.22874 * pow(10.0,-3.0), 8.5282 * pow(10.0,-4.0),
+                           -1.99 * pow(10.0,-6.0))
+
+def _heat_index_fahrenheit(T, R):
+    """Heat index formula, for numbers or NumPy arrays"""
+    (c1, c2, c3, c4, c5, c6, c7, c8, c9) = HEAT_INDEX_COEFFICIENTS
+    Tsquared = T * T
+    Rsquared = R * R
+    return ( c1 + (c2* T) + (c3* R) + (c4* T * R) +
+             (c5* Tsquared) + (c6* Rsquared) +
+             (c7* Tsquared * R) + (c8* T * Rsquared) +
+             (c9* Tsquared * Rsquared) )
+
+def _wind_chill_formula(T, V, units):
+    """NWS wind chill formula, for numbers or NumPy arrays. T and V are
+    in degrees Celsius and km/h for metric units, degrees Fahrenheit and
+    mph otherwise."""
+    V16 = V ** 0.16
+    if units == 'metric':
+        return 13.12 + 0.6215 * T - 11.37 * V16 + 0.3965 * T * V16
+    return 35.74 + 0.6215 * T - 35.75 * V16 + 0.4275 * T * V16
+
+# Magnus formula constants for the dew point (Alduchov and Eskridge, 1996)
+DEW_POINT_A = 17.625
+DEW_POINT_B = 243.04    # degrees Celsius
+
+def _dew_point_celsius(T, R, log):
+    """Magnus dew point formula, for numbers or NumPy arrays. T is in
+    degrees Celsius, log is the logarithm function to use."""
+    gamma = log(R / 100.0) + (DEW_POINT_A * T) / (DEW_POINT_B + T)
+    return (DEW_POINT_B * gamma) / (DEW_POINT_A - gamma)
+
+def _unit_system(units):
+    """Returns 'metric' or 'imperial' for the units parameter"""
+    if units == 'imperial' or units == '':   # for backwards compatibility
+        return 'imperial'
+    return 'metric'     # fallback to metric
+
+def _import_numpy():
+    """Returns the numpy module, None if NumPy is not installed"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+def _to_float(value):
+    """Converts a value to float, NaN if it is not a number"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+def _float_array(values):
+    """Converts a sequence to a NumPy array of floats, with NaN for
+    values that are not numbers ('', 'N/A', None)"""
+    import numpy
+    try:
+        return numpy.asarray(values, dtype = float)
+    except (TypeError, ValueError):
+        return numpy.array([_to_float(value) for value in values],
+                           dtype = float)
+
+def _heat_index_value(T, R, units):
+    # T and R are floats in the given unit system, NaN when not valid
+    if units == 'metric':
+        T = (T * 9.0/5.0) + 32.0
+    if not (R >= 40.0 and T >= 80.0):
+        return float('nan')
+    heat_index = _heat_index_fahrenheit(T, R)
+    if units == 'metric':
+        heat_index = (heat_index - 32.0) * 5.0/9.0
+    return round(heat_index, 1)
+
+def _wind_chill_value(T, V, units):
+    if units == 'metric':
+        valid = T <= 10.0 and V >= 4.8
+    else:
+        valid = T <= 50.0 and V >= 3.0
+    if not valid:
+        return float('nan')
+    return round(_wind_chill_formula(T, V, units), 1)
+
+def _dew_point_value(T, R, units):
+    if not (0.0 < R <= 100.0):
+        return float('nan')
+    if units == 'imperial':
+        T = (T - 32.0) * 5.0/9.0
+    dew_point = _dew_point_celsius(T, R, math.log)
+    if units == 'imperial':
+        dew_point = (dew_point * 9.0/5.0) + 32.0
+    return round(dew_point, 1)
+
+def heat_index_array(temperature, humidity, units = 'metric'):
+    """Calculate the heat index for whole sequences of temperatures and
+    relative humidities at once, see heat_index()
+
+    Parameters:
+      temperature: sequence or NumPy array of air temperatures
+      humidity: sequence or NumPy array of relative humidities
+      units: type of units. 'metric' for metric and 'imperial' for non-metric.
+
+    Returns:
+      a NumPy array of heat indexes, rounded to one decimal place, with NaN
+      where the heat index does not apply (below 80°F or 40% humidity) or
+      the input is not a number. Without NumPy, a list of floats.
+
+    """
+    return comfort_metrics(temperature, humidity, None, units)['heat_index']
+
+def wind_chill_array(temperature, wind_speed, units = 'metric'):
+    """Calculate the wind chill for whole sequences of temperatures and
+    wind speeds at once, with the NWS wind chill formula
+
+    Parameters:
+      temperature: sequence or NumPy array of air temperatures
+      wind_speed: sequence or NumPy array of wind speeds, in km/h for
+      metric units and mph for imperial units
+      units: type of units. 'metric' for metric and 'imperial' for non-metric.
+
+    Returns:
+      a NumPy array of wind chill temperatures, rounded to one decimal
+      place, with NaN where the wind chill does not apply (above 10°C/50°F
+      or below 4.8 km/h/3 mph) or the input is not a number. Without NumPy,
+      a list of floats.
+
+    """
+    return comfort_metrics(temperature, None, wind_speed, units)['wind_chill']
+
+def dew_point_array(temperature, humidity, units = 'metric'):
+    """Calculate the dew point for whole sequences of temperatures and
+    relative humidities at once, with the Magnus formula
+
+    Parameters:
+      temperature: sequence or NumPy array of air temperatures
+      humidity: sequence or NumPy array of relative humidities
+      units: type of units. 'metric' for metric and 'imperial' for non-metric.
+
+    Returns:
+      a NumPy array of dew points, rounded to one decimal place, with NaN
+      where the humidity is not in the range (0, 100] or the input is not a
+      number. Without NumPy, a list of floats.
+
+    """
+    return comfort_metrics(temperature, humidity, None, units)['dew_point']
+
+def comfort_metrics(temperature, humidity, wind_speed, units = 'metric'):
+    """Calculate heat index, wind chill and dew point for whole sequences
+    of observations in one pass
+
+    Parameters:
+      temperature: sequence or NumPy array of air temperatures
+      humidity: sequence or NumPy array of relative humidities, or None
+      wind_speed: sequence or NumPy array of wind speeds (km/h for metric,
+      mph for imperial units), or None
+      units: type of units. 'metric' for metric and 'imperial' for non-metric.
+
+    Returns:
+      a dictionary with the keys 'heat_index' and 'dew_point' (if humidity
+      is given) and 'wind_chill' (if wind_speed is given), see
+      heat_index_array(), dew_point_array() and wind_chill_array().
+
+    """
+    units = _unit_system(units)
+    values = {}
+
+    numpy = _import_numpy()
+    if numpy is None:
+        T = [_to_float(value) for value in temperature]
+        if humidity is not None:
+            R = [_to_float(value) for value in humidity]
+            values['heat_index'] = [_heat_index_value(t, r, units)
+                                    for (t, r) in zip(T, R)]
+            values['dew_point'] = [_dew_point_value(t, r, units)
+                                   for (t, r) in zip(T, R)]
+        if wind_speed is not None:
+            V = [_to_float(value) for value in wind_speed]
+            values['wind_chill'] = [_wind_chill_value(t, v, units)
+                                    for (t, v) in zip(T, V)]
+        return values
+
+    T = _float_array(temperature)
+    if units == 'metric':
+        T_celsius = T
+        T_fahrenheit = (T * 9.0/5.0) + 32.0
+    else:
+        T_celsius = (T - 32.0) * 5.0/9.0
+        T_fahrenheit = T
+
+    with numpy.errstate(invalid = 'ignore', divide = 'ignore'):
+        if humidity is not None:
+            R = _float_array(humidity)
+            heat_index = _heat_index_fahrenheit(T_fahrenheit, R)
+            if units == 'metric':
+                heat_index = (heat_index - 32.0) * 5.0/9.0
+            values['heat_index'] = numpy.where(
+                (R >= 40.0) & (T_fahrenheit >= 80.0),
+                numpy.round(heat_index, 1), numpy.nan)
+
+            dew_point = _dew_point_celsius(T_celsius, R, numpy.log)
+            if units == 'imperial':
+                dew_point = (dew_point * 9.0/5.0) + 32.0
+            values['dew_point'] = numpy.where(
+                (R > 0.0) & (R <= 100.0), numpy.round(dew_point, 1),
+                numpy.nan)
+
+        if wind_speed is not None:
+            V = _float_array(wind_speed)
+            wind_chill = _wind_chill_formula(T, V, units)
+            if units == 'metric':
+                valid = (T <= 10.0) & (V >= 4.8)
+            else:
+                valid = (T <= 50.0) & (V >= 3.0)
+            values['wind_chill'] = numpy.where(
+                valid, numpy.round(wind_chill, 1), numpy.nan)
+
+    return values
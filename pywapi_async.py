@@ -0,0 +1,639 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+### BEGIN LICENSE
+#Copyright (c) 2009 Eugene Kaznacheev <qetzal@gmail.com>
+#Copyright (c) 2013 Joshua Tasker <jtasker@gmail.com>
+
+#Permission is hereby granted, free of charge, to any person
+#obtaining a copy of this software and associated documentation
+#files (the "Software"), to deal in the Software without
+#restriction, including without limitation the rights to use,
+#copy, modify, merge, publish, distribute, sublicense, and/or sell
+#copies of the Software, and to permit persons to whom the
+#Software is furnished to do so, subject to the following
+#conditions:
+
+#The above copyright notice and this permission notice shall be
+#included in all copies or substantial portions of the Software.
+
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+#EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+#OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+#NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+#OTHER DEALINGS IN THE SOFTWARE.
+### END LICENSE
+
+
+""" Asyncio versions of the pywapi fetch functions (Python 3.5+)
+
+The coroutines of this module take the same parameters and return the same
+dictionaries as the functions of pywapi with the same names, and share its
+parsers and its response cache. Requests use non-blocking sockets, so a
+single event loop can keep many of them in flight.
+
+"""
+
+import asyncio
+import socket
+import ssl
+import time
+import weakref
+from urllib.error import URLError
+from urllib.error import HTTPError
+from urllib.parse import urljoin
+from urllib.parse import urlsplit
+from http.client import HTTPException
+
+import pywapi
+
+
+class AsyncHTTPConnectionPool(object):
+    """Pool of persistent HTTP/1.1 connections for asyncio, the counterpart
+    of pywapi.HTTPConnectionPool.
+
+    Idle connections are kept separately for every event loop, at most
+    maxsize per host, and dropped after idle_timeout seconds. Proxies and
+    installed openers are used like pywapi.HTTPConnectionPool does; a
+    request made with an installed opener runs in the default executor.
+
+    """
+
+    def __init__(self, maxsize = pywapi.HTTP_POOL_MAXSIZE,
+                 idle_timeout = pywapi.HTTP_POOL_IDLE_TIMEOUT,
+                 accept_encoding = pywapi.HTTP_ACCEPT_ENCODING):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.accept_encoding = accept_encoding
+        self._idle = weakref.WeakKeyDictionary()
+
+    async def request(self, url, headers = None, timeout = None):
+        """Performs a GET request, following redirects
+
+        Returns:
+          a pywapi.HTTPResponse
+
+        Raises URLError if the server could not be reached or the timeout
+        (see pywapi.Deadline.from_timeout()) ran out, and HTTPError if it
+        answered with an error status.
+
+        """
+        deadline = pywapi.Deadline.from_timeout(timeout)
+        if pywapi._opener_installed():
+            return await asyncio.get_event_loop().run_in_executor(
+                None, pywapi._request_with_opener, url, headers, deadline)
+        for i in range(pywapi.HTTP_MAX_REDIRECTS + 1):
+            response = await self._request_once(url, headers, deadline)
+            if response.status in (301, 302, 303, 307, 308) and \
+               'location' in response.headers:
+                url = urljoin(url, response.headers['location'])
+                continue
+            if response.status >= 400:
+                raise HTTPError(url, response.status, response.reason,
+                                response.headers, None)
+            return response
+        raise URLError('Too many redirects')
+
+    def clear(self):
+        """Closes all idle connections and forgets the proxy of every
+        host"""
+        pywapi._proxies.clear()
+        idle, self._idle = self._idle, weakref.WeakKeyDictionary()
+        for connections_by_host in idle.values():
+            for connections in connections_by_host.values():
+                for (reader, writer, last_used) in connections:
+                    writer.close()
+
+    async def _request_once(self, url, headers, deadline):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise URLError('Unsupported URL scheme: %s' % parts.scheme)
+        proxy = pywapi._proxy_for(parts)
+        key = (parts.scheme, parts.hostname, parts.port, proxy)
+        path = parts.path or '/'
+        if parts.query:
+            path = '?'.join((path, parts.query))
+        request_headers = {'Host': parts.netloc,
+                           'User-Agent': 'pywapi/%s' % pywapi.__version__}
+        if proxy is not None and parts.scheme == 'http':
+            # a plain proxy takes the absolute URL and the credentials
+            path = '%s://%s%s' % (parts.scheme, parts.netloc, path)
+            if proxy[2]:
+                request_headers['Proxy-Authorization'] = proxy[2]
+        if self.accept_encoding:
+            request_headers['Accept-Encoding'] = self.accept_encoding
+        if headers:
+            request_headers.update(headers)
+        request = ''.join(['GET %s HTTP/1.1\r\n' % path] +
+                          ['%s: %s\r\n' % item
+                           for item in request_headers.items()] +
+                          ['\r\n']).encode('latin-1')
+
+        loop = asyncio.get_event_loop()
+        while True:
+            start = pywapi._timer()
+            (connection, reused) = self._get_connection(loop, key)
+            writer = None
+            try:
+                if connection is None:
+                    # the timeouts raise once the deadline has passed, so
+                    # they are computed before the coroutines are created
+                    timeout = deadline and deadline.connect_timeout()
+                    connection = await _timed(self._connect(key), timeout)
+                connected = pywapi._timer()
+                if deadline is not None:
+                    deadline.connected()
+                (reader, writer) = connection
+                timeout = deadline and deadline.read_timeout()
+                (response, will_close) = await _timed(
+                    _exchange(reader, writer, request), timeout)
+            except (OSError, EOFError, ValueError, HTTPException,
+                    asyncio.TimeoutError) as e:
+                if writer is not None:
+                    writer.close()
+                if reused and (deadline is None or not deadline.expired()):
+                    # the server closed the idle connection, try a new one
+                    continue
+                if isinstance(e, asyncio.TimeoutError):
+                    e = socket.timeout('timed out')
+                raise URLError(e)
+            break
+
+        response.connect_time = connected - start
+        response.download_time = pywapi._timer() - connected
+        if will_close:
+            writer.close()
+        else:
+            self._put_connection(loop, key, reader, writer)
+        return response
+
+    def _get_connection(self, loop, key):
+        now = time.time()
+        connections = self._idle.get(loop, {}).get(key)
+        while connections:
+            (reader, writer, last_used) = connections.pop()
+            if now - last_used <= self.idle_timeout and not reader.at_eof():
+                return ((reader, writer), True)
+            writer.close()
+        return (None, False)
+
+    async def _connect(self, key):
+        (scheme, host, port, proxy) = key
+        if proxy is None:
+            if scheme == 'https':
+                return await asyncio.open_connection(
+                    host, port or 443, ssl = ssl.create_default_context())
+            return await asyncio.open_connection(host, port or 80)
+        (proxy_host, proxy_port, authorization) = proxy
+        if scheme == 'http':
+            return await asyncio.open_connection(proxy_host, proxy_port)
+        sock = await _open_tunnel(proxy_host, proxy_port, host, port or 443,
+                                  authorization)
+        return await asyncio.open_connection(
+            sock = sock, ssl = ssl.create_default_context(),
+            server_hostname = host)
+
+    def _put_connection(self, loop, key, reader, writer):
+        now = time.time()
+        connections = self._idle.setdefault(loop, {}).setdefault(key, [])
+        # drop connections that have been idle for too long
+        while connections and now - connections[0][2] > self.idle_timeout:
+            connections.pop(0)[1].close()
+        if len(connections) < self.maxsize:
+            connections.append((reader, writer, now))
+        else:
+            writer.close()
+
+
+async def _open_tunnel(proxy_host, proxy_port, host, port, authorization):
+    """Returns a socket connected to host through a CONNECT tunnel of
+    the proxy. Raises OSError if the proxy refuses the tunnel."""
+    loop = asyncio.get_event_loop()
+    (family, type, proto, canonname, address) = (await loop.getaddrinfo(
+        proxy_host, proxy_port, type = socket.SOCK_STREAM))[0]
+    sock = socket.socket(family, type, proto)
+    sock.setblocking(False)
+    try:
+        await loop.sock_connect(sock, address)
+        request = 'CONNECT %s:%d HTTP/1.1\r\nHost: %s:%d\r\n' % (
+            host, port, host, port)
+        if authorization:
+            request += 'Proxy-Authorization: %s\r\n' % authorization
+        await loop.sock_sendall(sock, (request + '\r\n').encode('latin-1'))
+        answer = b''
+        while b'\r\n\r\n' not in answer:
+            chunk = await loop.sock_recv(sock, 4096)
+            if not chunk:
+                raise OSError('Proxy closed the connection')
+            answer += chunk
+        status_line = answer.split(b'\r\n', 1)[0].decode('latin-1')
+        if status_line.split(' ')[1:2] != ['200']:
+            raise OSError('Tunnel connection failed: %s' % status_line)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+async def _timed(awaitable, timeout):
+    """Awaits awaitable, for at most timeout seconds unless it is None"""
+    if timeout is None:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, timeout)
+
+async def _exchange(reader, writer, request):
+    """Sends request and reads the response, see _read_response()"""
+    writer.write(request)
+    await writer.drain()
+    return await _read_response(reader)
+
+async def _read_response(reader):
+    """Reads an HTTP/1.1 response from reader
+
+    Returns:
+      a tuple of the pywapi.HTTPResponse and whether the server will
+      close the connection
+
+    """
+    while True:
+        status_line = await reader.readline()
+        if not status_line:
+            raise EOFError('Connection closed by server')
+        parts = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        version = parts[0]
+        status = int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ''
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            (name, sep, value) = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        # skip interim responses such as 100 Continue
+        if not 100 <= status < 200:
+            break
+
+    connection = headers.get('connection', '').lower()
+    will_close = connection == 'close' or \
+                 (version == 'HTTP/1.0' and connection != 'keep-alive')
+    coding = pywapi._content_coding(headers.get('content-encoding'))
+    decoder = coding and pywapi._ContentDecoder(coding)
+    if status in (204, 304):
+        body = b''
+    elif 'chunked' in headers.get('transfer-encoding', '').lower():
+        body = await _read_chunked(reader, decoder)
+    elif 'content-length' in headers:
+        body = await _read_length(reader, int(headers['content-length']),
+                                  decoder)
+    else:
+        body = await _read_length(reader, None, decoder)
+        will_close = True
+    headers = pywapi._decoded_headers(headers.items())
+    return (pywapi.HTTPResponse(status, reason, headers, body), will_close)
+
+async def _read_chunked(reader, decoder):
+    """Reads a body sent with chunked transfer encoding, decompressing it
+    with decoder unless that is None"""
+    chunks = []
+    while True:
+        size = int((await reader.readline()).split(b';')[0], 16)
+        if size == 0:
+            # skip the trailer
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            break
+        chunk = await reader.readexactly(size)
+        chunks.append(decoder.decompress(chunk) if decoder else chunk)
+        await reader.readexactly(2)
+    if decoder:
+        chunks.append(decoder.flush())
+    return b''.join(chunks)
+
+async def _read_length(reader, length, decoder):
+    """Reads a body of length bytes, or up to the end of the stream if
+    length is None, decompressing it with decoder unless that is None"""
+    if decoder is None:
+        if length is None:
+            return await reader.read()
+        return await reader.readexactly(length)
+    chunks = []
+    while length is None or length > 0:
+        if length is None:
+            chunk = await reader.read(pywapi.HTTP_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+        else:
+            chunk = await reader.readexactly(
+                min(length, pywapi.HTTP_READ_CHUNK_SIZE))
+            length -= len(chunk)
+        chunks.append(decoder.decompress(chunk))
+    chunks.append(decoder.flush())
+    return b''.join(chunks)
+
+
+# connection pool used by all coroutines of this module
+async_pool = AsyncHTTPConnectionPool()
+
+
+async def _get_report(cache_key, url, parse, connect_error, typed = False,
+                      timeout = None):
+    """Coroutine version of pywapi._get_report()"""
+    if typed:
+        cache_key = cache_key + ('typed',)
+    weather_data = pywapi._cache_get(cache_key)
+    recorder = pywapi.metrics
+    if recorder is not None and pywapi.response_cache is not None:
+        recorder.increment(cache_key[0], 'cache_hits' if weather_data
+                           is not None else 'cache_misses')
+    refresher = pywapi.prefetcher
+    if refresher is not None and pywapi.response_cache is not None:
+        # refreshes run in the threads of the Prefetcher
+        refresher.record(cache_key, pywapi._refresh_report, cache_key, url,
+                         parse, connect_error, typed)
+    if weather_data is not None:
+        return weather_data
+    deadline = pywapi.Deadline.from_timeout(timeout)
+    flight = single_flight
+    if flight is None:
+        return await _fetch_report(cache_key, url, parse, connect_error,
+                                   typed, deadline)
+    try:
+        return await flight.do(cache_key,
+                               lambda: _fetch_report(cache_key, url, parse,
+                                                     connect_error, typed,
+                                                     deadline),
+                               deadline)
+    except URLError as e:
+        pywapi._count_error(cache_key[0], e)
+        return {'error': connect_error}
+
+async def _fetch_report(cache_key, url, parse, connect_error, typed,
+                        deadline = None):
+    """Coroutine version of pywapi._fetch_report()"""
+    validators = pywapi.validator_cache
+    (headers, previous) = (None, None)
+    if validators is not None:
+        (headers, previous) = validators.request_headers(cache_key, url)
+    try:
+        response = await _fetch_with_retries(
+            cache_key[0], lambda: async_pool.request(url, headers, deadline),
+            deadline)
+        if deadline is not None:
+            deadline.check()
+    except URLError as e:
+        pywapi._count_error(cache_key[0], e)
+        return {'error': connect_error}
+    weather_data = pywapi._report_from_response(validators, cache_key, url,
+                                                response, previous, parse,
+                                                typed)
+    pywapi._cache_report(cache_key, weather_data)
+    return weather_data
+
+
+async def _fetch_with_retries(provider, fetch, deadline = None):
+    """Coroutine version of pywapi._fetch_with_retries(), following
+    pywapi.retry_policy, pywapi.circuit_breakers and pywapi.rate_limiter;
+    fetch returns an awaitable"""
+    policy = pywapi.retry_policy
+    breaker = pywapi._circuit_breaker(provider)
+    attempt = 0
+    while True:
+        pywapi._check_circuit(provider, breaker)
+        wait = pywapi._rate_limit_wait(provider, deadline)
+        if wait:
+            await asyncio.sleep(wait)
+        try:
+            result = await fetch()
+        except URLError as e:
+            delay = pywapi._retry_delay(provider, breaker, policy, e,
+                                        attempt, deadline)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+
+class AsyncSingleFlight(object):
+    """Coalesces concurrent identical fetches of an event loop, the
+    counterpart of pywapi.SingleFlight. Enable it with
+
+      pywapi_async.single_flight = pywapi_async.AsyncSingleFlight()
+
+    The shared fetch runs as a task, so it completes even if the caller
+    that started it is cancelled.
+
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._tasks = weakref.WeakKeyDictionary()
+
+    async def do(self, key, coroutine_function, deadline = None):
+        """Returns the result of coroutine_function(), or of the call
+        already in progress for key. Raises URLError when the
+        pywapi.Deadline deadline runs out."""
+        tasks = self._tasks.setdefault(asyncio.get_event_loop(), {})
+        task = tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coroutine_function())
+            tasks[key] = task
+            task.add_done_callback(lambda task: tasks.pop(key, None))
+            self.calls += 1
+        else:
+            self.shared += 1
+        if deadline is None:
+            return await asyncio.shield(task)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task),
+                                          deadline.remaining())
+        except asyncio.TimeoutError:
+            raise URLError(socket.timeout('timed out'))
+
+
+# coalescing of concurrent identical fetches, disabled by default
+single_flight = None
+
+
+async def get_weather_from_weather_com(location_id, units = 'metric',
+                                       compact = False, typed = False,
+                                       timeout = None):
+    """Fetches weather report from Weather.com,
+    see pywapi.get_weather_from_weather_com()"""
+    (cache_key, url) = pywapi._weather_com_request(location_id, units)
+    weather_data = await _get_report(cache_key, url,
+                                     pywapi.parse_weather_com_response,
+                                     'Could not connect to Weather.com',
+                                     typed, timeout)
+    return pywapi._report_result(weather_data, compact)
+
+async def get_weather_from_yahoo(location_id, units = 'metric',
+                                 compact = False, typed = False,
+                                 timeout = None):
+    """Fetches weather report from Yahoo! Weather,
+    see pywapi.get_weather_from_yahoo()"""
+    (cache_key, url) = pywapi._yahoo_request(location_id, units)
+    weather_data = await _get_report(cache_key, url,
+                                     pywapi.parse_yahoo_response,
+                                     'Could not connect to Yahoo! Weather',
+                                     typed, timeout)
+    return pywapi._report_result(weather_data, compact)
+
+async def get_weather_from_noaa(station_id, compact = False,
+                                typed = False, timeout = None):
+    """Fetches weather report from NOAA, see pywapi.get_weather_from_noaa()"""
+    (cache_key, url) = pywapi._noaa_request(station_id)
+    weather_data = await _get_report(cache_key, url,
+                                     pywapi.parse_noaa_response,
+                                     'Could not connect to NOAA',
+                                     typed, timeout)
+    return pywapi._report_result(weather_data, compact)
+
+async def get_everything_from_yahoo(country_code, cities,
+                                    max_concurrency = 10, compact = False,
+                                    typed = False, sink = None,
+                                    timeout = None):
+    """Get all weather data from yahoo for a specific country,
+    see pywapi.get_everything_from_yahoo()
+
+    Parameters:
+      country_code: A four letter code of the necessary country.
+                    For example 'GMXX' or 'FRXX'.
+      cities: The maximum number of cities for which to get data.
+      max_concurrency: The maximum number of requests in flight.
+      compact: if True, return the reports as pywapi.CompactReports.
+      typed: if True, convert numeric fields to int or float.
+      sink: an object with a method append(city_code, weather_data), such
+      as pywapi.ReportColumns, called with every result as it arrives.
+      timeout: time allowed for each city, once its request is started.
+
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch(city_code):
+        async with semaphore:
+            weather_data = await get_weather_from_yahoo(
+                city_code, compact = compact, typed = typed,
+                timeout = timeout)
+        if sink is not None:
+            sink.append(city_code, weather_data)
+        return weather_data
+
+    city_codes = pywapi.yield_all_country_city_codes_yahoo(country_code,
+                                                           cities)
+    results = await asyncio.gather(*[fetch(city_code)
+                                     for city_code in city_codes])
+    return pywapi._reports_by_city(results)
+
+async def get_current_conditions(location_ids, mode = 'fastest',
+                                 providers = pywapi.CONDITIONS_PROVIDERS,
+                                 timeout = None):
+    """Fetches the current conditions of a location from several providers
+    at the same time, see pywapi.get_current_conditions(). In 'fastest'
+    mode, the fetches still running when the first report arrives are
+    cancelled."""
+    if mode not in ('fastest', 'merge'):
+        raise ValueError("mode must be 'fastest' or 'merge', not %r" % mode)
+    providers = [provider for provider in providers
+                 if provider in location_ids]
+    tasks = dict((asyncio.ensure_future(_provider_conditions(
+                      provider, location_ids[provider], timeout)), provider)
+                 for provider in providers)
+    if mode == 'merge':
+        await asyncio.gather(*tasks)
+        return pywapi.merge_conditions(
+            dict((provider, task.result())
+                 for (task, provider) in tasks.items()), providers)
+    pending = set(tasks)
+    try:
+        while pending:
+            (done, pending) = await asyncio.wait(
+                pending, return_when = asyncio.FIRST_COMPLETED)
+            # prefer the preferred provider among those done together
+            for task in sorted(done, key = lambda task:
+                               providers.index(tasks[task])):
+                conditions = task.result()
+                if 'error' not in conditions:
+                    conditions['provider'] = tasks[task]
+                    return conditions
+    finally:
+        for task in pending:
+            task.cancel()
+    return pywapi._conditions_error(providers)
+
+async def _provider_conditions(provider, location_id, timeout):
+    """Coroutine version of pywapi._provider_conditions()"""
+    try:
+        if provider == 'noaa':
+            weather_data = await get_weather_from_noaa(
+                location_id, typed = True, timeout = timeout)
+        elif provider == 'weather_com':
+            weather_data = await get_weather_from_weather_com(
+                location_id, typed = True, timeout = timeout)
+        elif provider == 'yahoo':
+            weather_data = await get_weather_from_yahoo(
+                location_id, typed = True, timeout = timeout)
+        else:
+            return {'error': 'Unknown provider %s' % provider}
+    except asyncio.CancelledError:
+        raise       # an Exception before Python 3.8
+    except Exception:
+        return {'error': 'Invalid response from %s' % provider}
+    return pywapi.normalize_conditions(provider, weather_data)
+
+async def get_loc_id_from_weather_com(search_string, timeout = None):
+    """Get location IDs for place names matching a specified string,
+    see pywapi.get_loc_id_from_weather_com()"""
+    return await _search_locations('weather_com', search_string,
+                                   pywapi._loc_id_search_url(search_string),
+                                   pywapi.parse_loc_id_response, timeout)
+
+async def get_woeid_from_yahoo(search_string, timeout = None):
+    """Get Yahoo WOEID for the place names that best match the specified
+    string, see pywapi.get_woeid_from_yahoo()"""
+    return await _search_locations('yahoo', search_string,
+                                   pywapi._woeid_search_url(search_string),
+                                   pywapi.parse_woeid_response, timeout)
+
+async def _search_locations(provider, search_string, url, parse,
+                            timeout = None):
+    """Returns the cached result of a location search, or fetches url and
+    parses the response with parse. The gazetteer registered in
+    pywapi.gazetteers is searched first, then pywapi.location_cache, whose
+    SQLite reads and writes run in the default executor."""
+    result = pywapi._gazetteer_search(provider, search_string)
+    if result is not None:
+        return result
+    result = await _location_cache_call(pywapi._location_cache_get,
+                                        provider, search_string)
+    if result is not None:
+        return result
+    deadline = pywapi.Deadline.from_timeout(timeout)
+    try:
+        response = await _fetch_with_retries(
+            provider + '_search',
+            lambda: async_pool.request(url, None, deadline), deadline)
+        if deadline is not None:
+            deadline.check()
+    except URLError as e:
+        pywapi._count_error(provider + '_search', e)
+        return {'error': 'Could not connect to server'}
+    result = pywapi._search_from_response(provider, response, parse)
+    await _location_cache_call(pywapi._location_cache_put, provider,
+                               search_string, result)
+    return result
+
+async def _location_cache_call(function, *args):
+    """Returns function(*args), called in the default executor if
+    pywapi.location_cache is enabled, so that its disk I/O does not block
+    the event loop"""
+    if pywapi.location_cache is None:
+        return function(*args)
+    return await asyncio.get_event_loop().run_in_executor(None, function,
+                                                          *args)
@@ -24,11 +24,16 @@
 #FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 #OTHER DEALINGS IN THE SOFTWARE.
 
+import sys
 from distutils.core import setup
 
 __author__ = 'qetzal@gmail.com, jtasker@gmail.com'
 from pywapi import __version__
 
+py_modules = ['pywapi']
+if sys.version_info >= (3, 5):
+    # the asyncio API uses async/await syntax
+    py_modules.append('pywapi_async')
 
 setup(name='pywapi',
     version=__version__,
@@ -36,7 +41,7 @@ setup(name='pywapi',
     author='Eugene Kaznacheev, Joshua Tasker',
     author_email='qetzal@gmail.com, jtasker@gmail.com',
     url='http://code.google.com/p/python-weather-api/',
-    py_modules=['pywapi'],
+    py_modules=py_modules,
     license='MIT',
     keywords = 'weather api yahoo noaa google',
     platforms = 'any',